@@ -2,7 +2,6 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 from argparse import ArgumentParser
-import skimage
 import sklearn
 from skimage import metrics
 from sklearn import metrics
@@ -11,6 +10,7 @@ import nibabel as nib
 from skimage import morphology
 from skimage.morphology import skeletonize
 import json
+import torch
 from collections import defaultdict
 import statistics
 import pingouin as pg
@@ -18,6 +18,9 @@ from tqdm import tqdm
 from multiprocessing import Pool
 from functools import partial
 
+from ml4mip.utils.metrics import confusion_counts, confusion_scores
+from ml4mip.utils.surface_distance import surface_distances
+
 
 def centerline_dice(mask_true, mask_pred):
     """
@@ -130,22 +133,14 @@ class Graph:
         self.length_left = round(sum([item for items in length_list_left for item in items]),2)
         
 
-def f1_score(ground_truth, predicted):
-    tp = np.sum((predicted == 1) & (ground_truth == 1))
-    fp = np.sum((predicted == 1) & (ground_truth == 0))
-    fn = np.sum((predicted == 0) & (ground_truth == 1))
-    
-    precision = tp / (tp + fp) if (tp + fp) > 0 else 0
-    recall = tp / (tp + fn) if (tp + fn) > 0 else 0
-        
-    return (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
-
-def jaccard_score(ground_truth, predicted):
-    intersection = np.sum((ground_truth == 1) & (predicted == 1))
-    union = np.sum((ground_truth == 1) | (predicted == 1))
-
-    # Jaccard Score
-    return intersection / union if union > 0 else 0
+def overlap_scores(ground_truth, predicted):
+    """
+    F1 score (Dice) and Jaccard score from a single pass of confusion counts
+    :return: f1 score, jaccard score (0 if undefined)
+    """
+    counts = confusion_counts(torch.from_numpy(predicted[None]), torch.from_numpy(ground_truth[None]))
+    scores = confusion_scores(counts, scores=('dice', 'jaccard_index'), zero_division=0.0)
+    return scores['dice'].item(), scores['jaccard_index'].item()
 
 def calculate_icc_3_1(rater_1, rater_2):
     if len(rater_1) != len(rater_2):
@@ -166,19 +161,22 @@ def calculate_icc_3_1(rater_1, rater_2):
 
 
 
-def evaluate_segmentation(folder_true, folder_pred):
+def evaluate_segmentation(folder_true, folder_pred, physical_spacing=False):
     """
     Evaluate the segmentation on DICE score, Hausdorff distance, Jaccard index and centerline loss
     :param path_true: path to the ground-truth images
     :param path_pred: path to the predicted images
+    :param physical_spacing: measure the surface distances in mm instead of voxels
     :return: dataframe with metrics
     """
-    cn = ['ID', 'f1_score', 'hausdorff_distance', 'jaccard_score', 'centerline_dice']
+    cn = ['ID', 'f1_score', 'hausdorff_distance', 'hausdorff_distance_95', 'average_surface_distance', 'jaccard_score', 'centerline_dice']
     df = pd.DataFrame(columns=cn)
     image_ids = [mask_file.split('.')[0] for mask_file in sorted(os.listdir(folder_true)) if mask_file.endswith(".label.nii.gz")] 
     
     f1_all = []
     hd_all = []
+    hd95_all = []
+    asd_all = []
     js_all = []
     cd_all = []
     
@@ -194,15 +192,18 @@ def evaluate_segmentation(folder_true, folder_pred):
         mask_np = np.array(mask_nii.dataobj).astype(np.uint8)
         pred_nii = nib.load(pred_seg_path)
         pred_np = np.array(pred_nii.dataobj).astype(np.uint8)        
-        f1_metric = f1_score(mask_np, pred_np)
-        hd_metric = skimage.metrics.hausdorff_distance(mask_np, pred_np, method='standard')
-        js_metric = jaccard_score(mask_np, pred_np)
+        f1_metric, js_metric = overlap_scores(mask_np, pred_np)
+        spacing = mask_nii.header.get_zooms()[:3] if physical_spacing else None
+        distances = surface_distances(pred_np, mask_np, spacing=spacing)
+        hd_metric, hd95_metric, asd_metric = distances['hd'], distances['hd95'], distances['asd']
         cd_metric = centerline_dice(mask_np, pred_np)
         
-        df = pd.concat([df, pd.DataFrame([[image_id, f1_metric, hd_metric, js_metric, cd_metric]], columns=cn)], ignore_index=True)
+        df = pd.concat([df, pd.DataFrame([[image_id, f1_metric, hd_metric, hd95_metric, asd_metric, js_metric, cd_metric]], columns=cn)], ignore_index=True)
         
         f1_all.append(f1_metric)
         hd_all.append(hd_metric)
+        hd95_all.append(hd95_metric)
+        asd_all.append(asd_metric)
         js_all.append(js_metric)
         cd_all.append(cd_metric)
         
@@ -210,17 +211,20 @@ def evaluate_segmentation(folder_true, folder_pred):
     
     mean_dict = {'Mean F1-Score': round(statistics.mean(f1_all)*100, 2), 
                  'Mean Hausdorff Distance': round(statistics.mean(hd_all), 2), 
+                 'Mean Hausdorff Distance 95': round(statistics.mean(hd95_all), 2), 
+                 'Mean Average Surface Distance': round(statistics.mean(asd_all), 2), 
                  'Mean Jaccard Score': round(statistics.mean(js_all)*100, 2), 
                  'Mean Centerline Dice': round(statistics.mean(cd_all)*100, 2)}
     
     return df, mean_dict
 
-def evaluate_image(image_id, folder_true, folder_pred):
+def evaluate_image(image_id, folder_true, folder_pred, physical_spacing=False):
     """
     Evaluate a single image's segmentation metrics.
     :param image_id: Image ID
     :param folder_true: Path to the ground-truth images
     :param folder_pred: Path to the predicted images
+    :param physical_spacing: measure the surface distances in mm instead of voxels
     :return: A list of metrics for this image
     """
     print(f"load {image_id} ...")
@@ -236,21 +240,23 @@ def evaluate_image(image_id, folder_true, folder_pred):
     mask_np = np.array(mask_nii.dataobj).astype(np.uint8)
     pred_nii = nib.load(pred_seg_path)
     pred_np = np.array(pred_nii.dataobj).astype(np.uint8)        
-    f1_metric = f1_score(mask_np, pred_np)
-    hd_metric = skimage.metrics.hausdorff_distance(mask_np, pred_np, method='standard')
-    js_metric = jaccard_score(mask_np, pred_np)
+    f1_metric, js_metric = overlap_scores(mask_np, pred_np)
+    spacing = mask_nii.header.get_zooms()[:3] if physical_spacing else None
+    distances = surface_distances(pred_np, mask_np, spacing=spacing)
+    hd_metric, hd95_metric, asd_metric = distances['hd'], distances['hd95'], distances['asd']
     cd_metric = centerline_dice(mask_np, pred_np)
-    print(f"{image_id}: {f1_metric=:.4f} {hd_metric=:.4f} {js_metric=:.4f} {cd_metric=:.4f}")
-    return [image_id, f1_metric, hd_metric, js_metric, cd_metric]
+    print(f"{image_id}: {f1_metric=:.4f} {hd_metric=:.4f} {hd95_metric=:.4f} {js_metric=:.4f} {cd_metric=:.4f}")
+    return [image_id, f1_metric, hd_metric, hd95_metric, asd_metric, js_metric, cd_metric]
 
-def evaluate_segmentation_parallel(folder_true, folder_pred):
+def evaluate_segmentation_parallel(folder_true, folder_pred, physical_spacing=False):
     """
     Evaluate the segmentation on DICE score, Hausdorff distance, Jaccard index and centerline loss
     :param folder_true: Path to the ground-truth images
     :param folder_pred: Path to the predicted images
+    :param physical_spacing: measure the surface distances in mm instead of voxels
     :return: Dataframe with metrics and a dictionary with mean values
     """
-    cn = ['ID', 'f1_score', 'hausdorff_distance', 'jaccard_score', 'centerline_dice']
+    cn = ['ID', 'f1_score', 'hausdorff_distance', 'hausdorff_distance_95', 'average_surface_distance', 'jaccard_score', 'centerline_dice']
     df = pd.DataFrame(columns=cn)
     image_ids = [mask_file.split('.')[0] for mask_file in sorted(os.listdir(folder_true)) if mask_file.endswith(".label.nii.gz")] 
     
@@ -258,7 +264,7 @@ def evaluate_segmentation_parallel(folder_true, folder_pred):
     num_workers=20
     batch_size=10
 
-    handle_id = partial(evaluate_image, folder_true=folder_true, folder_pred=folder_pred)
+    handle_id = partial(evaluate_image, folder_true=folder_true, folder_pred=folder_pred, physical_spacing=physical_spacing)
     with (
         Pool(processes=num_workers) as pool,
         tqdm(total=len(image_ids), desc="Processing") as pbar,
@@ -270,11 +276,15 @@ def evaluate_segmentation_parallel(folder_true, folder_pred):
     # Calculate mean values
     f1_all = df['f1_score'].tolist()
     hd_all = df['hausdorff_distance'].tolist()
+    hd95_all = df['hausdorff_distance_95'].tolist()
+    asd_all = df['average_surface_distance'].tolist()
     js_all = df['jaccard_score'].tolist()
     cd_all = df['centerline_dice'].tolist()
 
     mean_dict = {'Mean F1-Score': round(statistics.mean(f1_all) * 100, 2),
                  'Mean Hausdorff Distance': round(statistics.mean(hd_all), 2),
+                 'Mean Hausdorff Distance 95': round(statistics.mean(hd95_all), 2),
+                 'Mean Average Surface Distance': round(statistics.mean(asd_all), 2),
                  'Mean Jaccard Score': round(statistics.mean(js_all) * 100, 2),
                  'Mean Centerline Dice': round(statistics.mean(cd_all) * 100, 2)}
     
@@ -429,6 +439,7 @@ def main():
     parser.add_argument("--true-folder", type=Path, default='test_data')
     parser.add_argument("--pred-folder", type=Path, default='pred_data')
     parser.add_argument("--metrics-folder", type=Path, default=str(Path.cwd()))
+    parser.add_argument("--physical-spacing", action="store_true", help="measure the surface distances in mm instead of voxels")
     args = parser.parse_args()
 
     if not os.path.isdir(args.true_folder):
@@ -442,7 +453,7 @@ def main():
     metrics_folder.mkdir(parents=True, exist_ok=True)
                         
     if args.task == "segmentation":
-        metrics_df, mean_dict = evaluate_segmentation(args.true_folder, args.pred_folder)
+        metrics_df, mean_dict = evaluate_segmentation(args.true_folder, args.pred_folder, args.physical_spacing)
         metrics_df.to_csv('segmentation-metrics.csv', index=False)
         with open(metrics_folder / "segmentation-metrics_mean.json", "w") as outfile: 
             json.dump(mean_dict, outfile)
@@ -453,7 +464,7 @@ def main():
         with open(metrics_folder / "graph_extraction-metrics_mean.json", "w") as outfile: 
             json.dump(mean_dict, outfile)
     elif args.task == "segmentation_parallel":
-        metrics_df, mean_dict = evaluate_segmentation_parallel(args.true_folder, args.pred_folder)
+        metrics_df, mean_dict = evaluate_segmentation_parallel(args.true_folder, args.pred_folder, args.physical_spacing)
         metrics_df.to_csv('segmentation-metrics.csv', index=False)
         with open(metrics_folder / "segmentation-metrics_mean.json", "w") as outfile: 
             json.dump(mean_dict, outfile)
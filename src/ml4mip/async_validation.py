@@ -0,0 +1,250 @@
+import contextlib
+import dataclasses
+import logging
+import queue
+from dataclasses import dataclass
+
+import mlflow
+import torch
+import torch.multiprocessing as mp
+from hydra.core.config_store import ConfigStore
+from torch import nn
+from torch.utils.data import DataLoader, Dataset
+
+from ml4mip import trainer
+from ml4mip.loss import LossConfig, get_loss
+from ml4mip.models import ModelConfig, get_model
+from ml4mip.utils.checkpoint import to_cpu
+from ml4mip.utils.distributed import unwrap_model
+from ml4mip.utils.logging import log_metrics
+from ml4mip.utils.metrics import MetricsConfig, get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AsyncValidationConfig:
+    # validate weight snapshots in a separate process while training continues
+    enabled: bool = False
+    # maximum number of epochs the validation may fall behind the training
+    # note: keep it at most checkpoint.keep_last, so a late result can still select the best checkpoint
+    max_lag: int = 1
+    # device of the validation worker, defaults to cuda if available
+    device: str | None = None
+    num_workers: int = 0
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_async_validation_config",
+    node=AsyncValidationConfig,
+)
+
+
+def _validation_worker(
+    model_cfg: ModelConfig,
+    loss_cfg: LossConfig,
+    metrics_cfg: MetricsConfig,
+    dataset: Dataset,
+    batch_size: int,
+    num_workers: int,
+    inference_cfg: trainer.InferenceConfig,
+    device_name: str,
+    tracking_uri: str | None,
+    run_id: str | None,
+    jobs: mp.Queue,
+    results: mp.Queue,
+    slots,
+) -> None:
+    """Validate the weight snapshots of the `jobs` queue until `None` is received.
+
+    The `(epoch, metrics)` of each snapshot are put into the `results` queue.
+    """
+    logging.basicConfig(level=logging.INFO)
+    device = torch.device(device_name)
+    # the weights are replaced by the snapshots, so don't load them from disk
+    model = get_model(dataclasses.replace(model_cfg, model_path=None))
+    loss_fn = get_loss(loss_cfg)
+    metrics = get_metrics(cfg=metrics_cfg)
+    val_loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",
+    )
+    if tracking_uri is not None:
+        mlflow.set_tracking_uri(tracking_uri)
+
+    while (job := jobs.get()) is not None:
+        epoch, num_epochs, state_dict = job
+        try:
+            model.load_state_dict(state_dict)
+            del state_dict
+            val_result = trainer.validate(
+                model=model,
+                val_loader=val_loader,
+                loss_fn=loss_fn,
+                metrics=metrics,
+                device=device,
+                inference_cfg=inference_cfg,
+            )
+            if run_id is not None:
+                log_metrics(
+                    "val",
+                    val_result,
+                    step=epoch,
+                    epochs=(epoch, num_epochs),
+                    logger=logger,
+                    run_id=run_id,
+                )
+            results.put((epoch, val_result))
+        finally:
+            # free the slot, so the training process can submit the next snapshot
+            slots.release()
+
+
+class AsyncValidator:
+    """Run `trainer.validate` on weight snapshots in a separate worker process.
+
+    The training process hands a CPU copy of the weights to the worker after every epoch and
+    continues training. The worker rebuilds the model with `get_model`, validates it and logs
+    the results to the given MLflow run at the epoch's step; `results` returns them to the
+    training process, e.g. to select the best checkpoint. At most `max_lag` snapshots are
+    pending at a time; `submit` blocks until the worker has caught up.
+    """
+
+    def __init__(
+        self,
+        model_cfg: ModelConfig,
+        loss_cfg: LossConfig,
+        dataset: Dataset,
+        inference_cfg: trainer.InferenceConfig,
+        metrics_cfg: MetricsConfig | None = None,
+        batch_size: int = 1,
+        max_lag: int = 1,
+        device: str | None = None,
+        num_workers: int = 0,
+        tracking_uri: str | None = None,
+        run_id: str | None = None,
+    ):
+        if max_lag < 1:
+            msg = f"max_lag must be at least 1, got {max_lag}"
+            raise ValueError(msg)
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+
+        ctx = mp.get_context("spawn")
+        self._jobs = ctx.Queue()
+        self._results = ctx.Queue()
+        # results received by `close` until they are collected by `results`
+        self._received: list[tuple[int, dict[str, float]]] = []
+        self._closed = False
+        self._slots = ctx.BoundedSemaphore(max_lag)
+        self._process = ctx.Process(
+            target=_validation_worker,
+            args=(
+                model_cfg,
+                loss_cfg,
+                metrics_cfg or MetricsConfig(),
+                dataset,
+                batch_size,
+                num_workers,
+                inference_cfg,
+                device,
+                tracking_uri,
+                run_id,
+                self._jobs,
+                self._results,
+                self._slots,
+            ),
+            name="async-validation",
+        )
+        self._process.start()
+        logger.info("Started asynchronous validation worker (device=%s, max_lag=%d)", device, max_lag)
+
+    @classmethod
+    def from_config(
+        cls,
+        cfg: AsyncValidationConfig,
+        model_cfg: ModelConfig,
+        loss_cfg: LossConfig,
+        dataset: Dataset,
+        inference_cfg: trainer.InferenceConfig,
+        metrics_cfg: MetricsConfig | None = None,
+        batch_size: int = 1,
+        tracking_uri: str | None = None,
+        run_id: str | None = None,
+    ) -> "AsyncValidator":
+        return cls(
+            model_cfg=model_cfg,
+            loss_cfg=loss_cfg,
+            dataset=dataset,
+            inference_cfg=inference_cfg,
+            metrics_cfg=metrics_cfg,
+            batch_size=batch_size,
+            max_lag=cfg.max_lag,
+            device=cfg.device,
+            num_workers=cfg.num_workers,
+            tracking_uri=tracking_uri,
+            run_id=run_id,
+        )
+
+    def _check_alive(self) -> None:
+        if not self._process.is_alive():
+            msg = f"Validation worker died with exit code {self._process.exitcode}"
+            raise RuntimeError(msg)
+
+    def submit(self, model: nn.Module, epoch: int, num_epochs: int) -> None:
+        """Hand a snapshot of the model weights to the validation worker."""
+        # wait for a free slot, i.e. until the validation is at most max_lag - 1 epochs behind
+        while not self._slots.acquire(timeout=1.0):
+            self._check_alive()
+        self._check_alive()
+        self._jobs.put((epoch, num_epochs, to_cpu(unwrap_model(model).state_dict())))
+
+    def results(self) -> list[tuple[int, dict[str, float]]]:
+        """The `(epoch, metrics)` of the snapshots validated since the last call, without blocking."""
+        received, self._received = self._received, []
+        with contextlib.suppress(queue.Empty):
+            while True:
+                received.append(self._results.get_nowait())
+        return received
+
+    def close(self) -> None:
+        """Wait until all submitted snapshots are validated and stop the worker.
+
+        The results of the remaining snapshots are still returned by `results`.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._process.is_alive():
+            self._jobs.put(None)
+        # receive while waiting, a worker with unconsumed queue items doesn't exit
+        while self._process.is_alive():
+            with contextlib.suppress(queue.Empty):
+                self._received.append(self._results.get(timeout=0.1))
+        self._process.join()
+        self._received.extend(self.results())
+        self._jobs.close()
+        if self._process.exitcode != 0:
+            msg = f"Validation worker failed with exit code {self._process.exitcode}"
+            raise RuntimeError(msg)
+
+    def terminate(self) -> None:
+        """Stop the worker without waiting for pending validations."""
+        self._closed = True
+        self._process.terminate()
+        self._process.join()
+        self._jobs.close()
+
+    def __enter__(self) -> "AsyncValidator":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # e.g. on a KeyboardInterrupt don't wait for the remaining validations
+        if exc_type is not None:
+            self.terminate()
+        else:
+            self.close()
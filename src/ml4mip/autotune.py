@@ -0,0 +1,260 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import platform
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import hydra
+import torch
+from hydra.core.config_store import ConfigStore
+from omegaconf import OmegaConf
+from torch import nn
+
+from ml4mip.models import ModelConfig, get_model, source_digest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "ml4mip" / "autotune.json"
+# cubic windows probed unless given, filtered to multiples of the network strides
+DEFAULT_WINDOW_SIZES = (64, 96, 128, 160, 192)
+
+_lock = threading.Lock()
+# results of this process by cache file and key, so the cache file is read once
+_results: dict[tuple[str, str], "AutotuneResult"] = {}
+
+
+@dataclass
+class AutotuneConfig:
+    model: ModelConfig = field(default_factory=ModelConfig)
+    device: str | None = None
+    # candidate window sizes (edge length of cubic windows), default: DEFAULT_WINDOW_SIZES
+    window_sizes: list[int] | None = None
+    max_batch_size: int = 16
+    # fraction of the device (CUDA) or host (CPU) memory the windows may use
+    memory_fraction: float = 0.8
+    # estimated peak memory per input voxel on the CPU, where the peak memory isn't measured
+    cpu_bytes_per_voxel: int = 2048
+    # maximum number of voxels of a batch of windows (optional)
+    max_voxels: int | None = None
+    repeats: int = 3
+    cache_path: str | None = None
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_autotune_config",
+    node=AutotuneConfig,
+)
+
+
+@dataclass
+class AutotuneResult:
+    sw_size: tuple[int, int, int]
+    sw_batch_size: int
+    voxels_per_sec: float
+    peak_memory: int | None = None
+
+
+def size_multiple(model: nn.Module) -> int:
+    """Multiple the spatial input size of a model must have (the product of its downsampling strides)."""
+    strides = getattr(model, "strides", None)
+    if strides is not None:
+        # monai UNet
+        return math.prod(max(stride) if isinstance(stride, tuple | list) else stride for stride in strides)
+    pools = [module for module in model.modules() if isinstance(module, nn.MaxPool3d)]
+    return math.prod(pool.stride if isinstance(pool.stride, int) else max(pool.stride) for pool in pools)
+
+
+def cache_key(model: nn.Module, device: torch.device) -> str:
+    """Key of a (model architecture, device, precision) combination, the weights don't matter.
+
+    Exported models (frozen TorchScript, ONNX) have no parameters, they are keyed by their file.
+    """
+    parameters = list(model.parameters())
+    precision = str(parameters[0].dtype) if parameters else "float32"
+    architecture = source_digest(model) or hashlib.blake2b(
+        ";".join(f"{name}:{tuple(p.shape)}" for name, p in model.named_parameters()).encode(), digest_size=6
+    ).hexdigest()
+    architecture = architecture[:12]
+    if device.type == "cuda":
+        device_name = torch.cuda.get_device_name(device)
+    else:
+        device_name = f"{platform.processor() or platform.machine()} ({torch.get_num_threads()} threads)"
+    return f"{type(model).__name__}-{architecture}|{device.type}:{device_name}|{precision}"
+
+
+def host_memory() -> int | None:
+    """Physical memory of the host in bytes (None if unknown)."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _is_out_of_memory(error: RuntimeError) -> bool:
+    # the CPU allocator raises a plain RuntimeError
+    return isinstance(error, torch.cuda.OutOfMemoryError) or "can't allocate memory" in str(error)
+
+
+def _probe(
+    model: nn.Module, size: tuple[int, int, int], batch_size: int, device: torch.device, repeats: int
+) -> tuple[float, int | None]:
+    """Voxels per second and peak memory of the model on batches of windows."""
+    parameters = list(model.parameters())
+    dtype = parameters[0].dtype if parameters and parameters[0].is_floating_point() else torch.float32
+    inputs = torch.rand(batch_size, 1, *size, device=device, dtype=dtype)
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+    with torch.no_grad():
+        # warmup (cudnn algorithm selection)
+        model(inputs)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(inputs)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        elapsed = time.perf_counter() - start
+    peak_memory = torch.cuda.max_memory_allocated(device) if device.type == "cuda" else None
+    return repeats * batch_size * math.prod(size) / elapsed, peak_memory
+
+
+def tune(
+    model: nn.Module,
+    device: torch.device,
+    window_sizes: list[int] | tuple[int, ...] | None = None,
+    max_batch_size: int = 16,
+    memory_fraction: float = 0.8,
+    repeats: int = 3,
+    max_voxels: int | None = None,
+    cpu_bytes_per_voxel: int = 2048,
+) -> AutotuneResult:
+    """Find the window size and window batch size with the highest throughput within the memory budget.
+
+    For every window size compatible with the strides of the model the batch size is doubled until
+    the device runs out of memory, the peak memory exceeds the budget or `max_batch_size` (or
+    `max_voxels`) is reached. On the CPU the batches are bounded by the host memory instead, with
+    an estimated peak memory of `cpu_bytes_per_voxel` per input voxel.
+    """
+    model = model.to(device).eval()
+    multiple = size_multiple(model)
+    sizes = [size for size in (window_sizes or DEFAULT_WINDOW_SIZES) if size % multiple == 0]
+    if not sizes:
+        msg = f"None of the window sizes {window_sizes} is a multiple of the network strides ({multiple})."
+        raise ValueError(msg)
+    budget = None
+    if device.type == "cuda":
+        budget = memory_fraction * torch.cuda.get_device_properties(device).total_memory
+    elif (memory := host_memory()) is not None:
+        host_max_voxels = int(memory_fraction * memory / cpu_bytes_per_voxel)
+        max_voxels = min(max_voxels, host_max_voxels) if max_voxels is not None else host_max_voxels
+
+    best = None
+    for edge in sizes:
+        size = (edge, edge, edge)
+        batch_size = 1
+        while batch_size <= max_batch_size and (max_voxels is None or batch_size * math.prod(size) <= max_voxels):
+            try:
+                voxels_per_sec, peak_memory = _probe(model, size, batch_size, device, repeats)
+            except RuntimeError as e:
+                if not _is_out_of_memory(e):
+                    raise
+                if device.type == "cuda":
+                    torch.cuda.empty_cache()
+                logger.info("Window %s, batch size %d: out of memory", size, batch_size)
+                break
+            logger.info(
+                "Window %s, batch size %d: %.3g voxels/s, peak memory %s",
+                size,
+                batch_size,
+                voxels_per_sec,
+                peak_memory,
+            )
+            if budget is not None and peak_memory > budget:
+                break
+            if best is None or voxels_per_sec > best.voxels_per_sec:
+                best = AutotuneResult(size, batch_size, voxels_per_sec, peak_memory)
+            batch_size *= 2
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+    if best is None:
+        msg = f"No window size of {sizes} fits into the memory of {device}."
+        raise RuntimeError(msg)
+    return best
+
+
+def load_cache(path: str | Path | None = None) -> dict[str, dict]:
+    """The cached results, empty if there is no (readable) cache file."""
+    path = Path(path) if path is not None else DEFAULT_CACHE_PATH
+    try:
+        with path.open() as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning("Ignoring unreadable autotune cache %s: %s", path, e)
+        return {}
+
+
+def save_result(key: str, result: AutotuneResult, path: str | Path | None = None) -> None:
+    path = Path(path) if path is not None else DEFAULT_CACHE_PATH
+    cache = load_cache(path)
+    cache[key] = asdict(result)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write atomically, other processes (e.g. the DDP ranks) may read or write the cache at the same time
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, suffix=".tmp", delete=False) as f:
+        json.dump(cache, f, indent=4)
+    Path(f.name).replace(path)
+
+
+def autotuned(
+    model: nn.Module,
+    device: torch.device,
+    cache_path: str | Path | None = None,
+    **kwargs,
+) -> AutotuneResult:
+    """The cached result of the model on the device, the model is tuned (and cached) on a miss."""
+    key = cache_key(model, device)
+    with _lock:
+        if (str(cache_path), key) in _results:
+            return _results[str(cache_path), key]
+        cached = load_cache(cache_path).get(key)
+        if cached is not None:
+            result = AutotuneResult(**{**cached, "sw_size": tuple(cached["sw_size"])})
+        else:
+            logger.info("Tuning the sliding window for %s", key)
+            result = tune(model, device, **kwargs)
+            save_result(key, result, cache_path)
+        logger.info("Sliding window of %s: size %s, batch size %d", key, result.sw_size, result.sw_batch_size)
+        _results[str(cache_path), key] = result
+        return result
+
+
+@hydra.main(version_base=None, config_name="base_autotune_config")
+def main(cfg: AutotuneConfig) -> None:
+    logger.info(OmegaConf.to_yaml(cfg))
+    cfg = OmegaConf.to_object(cfg)
+
+    device = torch.device(cfg.device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    model = get_model(cfg.model).to(device).eval()
+    result = tune(
+        model,
+        device,
+        window_sizes=cfg.window_sizes,
+        max_batch_size=cfg.max_batch_size,
+        memory_fraction=cfg.memory_fraction,
+        repeats=cfg.repeats,
+        max_voxels=cfg.max_voxels,
+        cpu_bytes_per_voxel=cfg.cpu_bytes_per_voxel,
+    )
+    key = cache_key(model, device)
+    save_result(key, result, cfg.cache_path)
+    logger.info("%s: %s (written to %s)", key, result, cfg.cache_path or DEFAULT_CACHE_PATH)
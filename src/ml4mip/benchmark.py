@@ -0,0 +1,367 @@
+import importlib.util
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import hydra
+import nibabel as nib
+import numpy as np
+import torch
+from hydra.core.config_store import ConfigStore
+from monai.metrics import HausdorffDistanceMetric
+from omegaconf import OmegaConf
+from scipy.ndimage import binary_erosion
+from skimage.morphology import skeletonize
+from torch import nn
+
+from ml4mip import trainer
+from ml4mip.dataset import (
+    TARGET_PIXEL_DIM,
+    TARGET_SPATIAL_SIZE,
+    NiftiDataset,
+    PositiveBiasedRandomCrop,
+    TransformType,
+    get_transform,
+)
+from ml4mip.export import ExportFormat, export_model
+from ml4mip.graph_extraction import (
+    ExtractionConfig,
+    connected_component_distance_filter,
+    extract_graph,
+    reduce_graph,
+    skeleton_to_graph,
+)
+from ml4mip.loss import SoftSkeletonize
+from ml4mip.models import get_model
+from ml4mip.phantom import PhantomConfig, generate_phantom
+from ml4mip.utils.metrics import ClDiceMetric, ConfusionMetric, SurfaceDistanceMetric
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BenchmarkConfig:
+    # json file the results are written to
+    output: str = str(Path.cwd() / "benchmark.json")
+    # results of a previous run to compare against
+    baseline: str | None = None
+    # a benchmark is reported as regression if its median is slower than the baseline by this ratio
+    tolerance: float = 0.1
+    # exit with an error code if a regression is found
+    fail_on_regression: bool = False
+    # run only the benchmarks whose name starts with one of these prefixes
+    only: list[str] | None = None
+    repeats: int = 5
+    warmup: int = 1
+    volume_size: tuple[int, int, int] = TARGET_SPATIAL_SIZE
+    patch_size: tuple[int, int, int] = (96, 96, 96)
+    spacing: tuple[float, float, float] = TARGET_PIXEL_DIM
+    seed: int = 0
+    num_threads: int | None = None
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="benchmark_config",
+    node=BenchmarkConfig,
+)
+
+
+def _time(fn: Callable[[], Any], repeats: int, warmup: int) -> dict[str, Any]:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        "times": times,
+        "median": statistics.median(times),
+        "min": min(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+
+def _benchmarks(
+    image: np.ndarray, mask: np.ndarray, cfg: BenchmarkConfig, workdir: Path
+) -> dict[str, Callable[[], Callable[[], Any]]]:
+    """Map the benchmark names to setup functions returning the function to time.
+
+    The setups are only called for the selected benchmarks and are not timed.
+    """
+    affine = np.diag([*cfg.spacing, 1.0])
+    patch_size = tuple(cfg.patch_size)
+    benchmarks = {}
+
+    def case_dir() -> Path:
+        data_dir = workdir / "data"
+        if not data_dir.exists():
+            data_dir.mkdir()
+            nib.save(nib.Nifti1Image(image, affine), data_dir / "0.img.nii.gz")
+            nib.save(nib.Nifti1Image(mask, affine), data_dir / "0.label.nii.gz")
+        return data_dir
+
+    def dataset_setup(transform_type: TransformType):
+        def setup():
+            dataset = NiftiDataset(
+                data_dir=case_dir(),
+                transform=get_transform(
+                    transform_type,
+                    size=patch_size,
+                    target_pixel_dim=cfg.spacing,
+                    target_spatial_size=cfg.volume_size,
+                ),
+                split_ratio=1.0,
+            )
+            return lambda: dataset[0]
+
+        return setup
+
+    for transform_type in TransformType:
+        benchmarks[f"dataset_getitem[{transform_type.value}]"] = dataset_setup(transform_type)
+
+    def crop_setup():
+        crop = PositiveBiasedRandomCrop(keys=["image", "mask"], positive_key="mask", roi_size=patch_size)
+        crop.set_random_state(cfg.seed)
+        data = {"image": torch.from_numpy(image[None]), "mask": torch.from_numpy(mask[None])}
+        return lambda: crop(data)
+
+    benchmarks["positive_biased_random_crop"] = crop_setup
+
+    def inference_setup(mode: trainer.InferenceMode):
+        def setup():
+            # a single convolution, so the inference machinery dominates the timing
+            model = nn.Conv3d(1, 1, kernel_size=3, padding=1).eval()
+            inference_cfg = trainer.InferenceConfig(mode=mode, sw_size=patch_size, model_input_size=patch_size)
+            images = torch.from_numpy(image[None, None].astype(np.float32))
+
+            @torch.no_grad()
+            def run():
+                return trainer.inference(images, model, inference_cfg)
+
+            return run
+
+        return setup
+
+    for mode in trainer.InferenceMode:
+        benchmarks[f"inference[{mode.value}]"] = inference_setup(mode)
+
+    def backend_setup(export_format: ExportFormat):
+        def setup():
+            model = nn.Conv3d(1, 1, kernel_size=3, padding=1).eval()
+            (model_cfg,) = export_model(model, workdir / "export", [export_format], example_size=patch_size).values()
+            exported = get_model(model_cfg)
+            inference_cfg = trainer.InferenceConfig(sw_size=patch_size)
+            images = torch.from_numpy(image[None, None].astype(np.float32))
+
+            @torch.no_grad()
+            def run():
+                return trainer.inference(images, exported, inference_cfg)
+
+            return run
+
+        return setup
+
+    for export_format in ExportFormat:
+        # ONNX Runtime is an optional dependency (`pip install ML4MIP[onnx]`)
+        if export_format == ExportFormat.ONNX and importlib.util.find_spec("onnxruntime") is None:
+            continue
+        benchmarks[f"inference_backend[{export_format.value}]"] = backend_setup(export_format)
+
+    benchmarks["connected_component_distance_filter"] = lambda: (
+        lambda: connected_component_distance_filter(mask, min_size=1, max_dist=0, n_largest=3)
+    )
+
+    def skeleton_to_graph_setup():
+        skeleton = skeletonize(mask)
+        return lambda: skeleton_to_graph(skeleton)
+
+    benchmarks["skeleton_to_graph"] = skeleton_to_graph_setup
+
+    def reduce_graph_setup():
+        graph = skeleton_to_graph(skeletonize(mask))
+        return lambda: reduce_graph(graph)
+
+    benchmarks["reduce_graph"] = reduce_graph_setup
+
+    def extract_graph_setup():
+        nifti_obj = nib.Nifti1Image(mask, affine)
+        return lambda: extract_graph(nifti_obj, ExtractionConfig(), path=None)
+
+    benchmarks["extract_graph"] = extract_graph_setup
+
+    # a prediction that differs from the target at the vessel boundaries
+    def prediction_and_target() -> tuple[torch.Tensor, torch.Tensor]:
+        pred = binary_erosion(mask, iterations=1)
+        return torch.from_numpy(pred[None, None]).float(), torch.from_numpy(mask[None, None]).float()
+
+    def cldice_setup():
+        metric = ClDiceMetric()
+        y_pred, y = prediction_and_target()
+
+        def run():
+            metric(y_pred=y_pred, y=y)
+            metric.reset()
+
+        return run
+
+    benchmarks["cldice_metric"] = cldice_setup
+
+    def confusion_setup():
+        metric = ConfusionMetric()
+        y_pred, y = prediction_and_target()
+
+        def run():
+            metric(y_pred=y_pred, y=y)
+            return metric.aggregate()
+
+        return run
+
+    benchmarks["confusion_metric"] = confusion_setup
+
+    def hausdorff_setup():
+        metric = HausdorffDistanceMetric(include_background=True, reduction="mean")
+        y_pred, y = prediction_and_target()
+
+        def run():
+            metric(y_pred=y_pred, y=y)
+            metric.reset()
+
+        return run
+
+    benchmarks["hausdorff_distance_metric"] = hausdorff_setup
+
+    def surface_distance_setup():
+        metric = SurfaceDistanceMetric()
+        y_pred, y = prediction_and_target()
+
+        def run():
+            metric(y_pred=y_pred, y=y)
+            metric.reset()
+
+        return run
+
+    benchmarks["surface_distance_metric"] = surface_distance_setup
+
+    def soft_skeletonize_setup():
+        skeletonize_fn = SoftSkeletonize(num_iter=10)
+        # a training batch of patches, forward and backward
+        logits = torch.randn(2, 1, *patch_size, requires_grad=True)
+
+        def run():
+            skeletonize_fn(torch.sigmoid(logits)).sum().backward()
+
+        return run
+
+    benchmarks["soft_skeletonize"] = soft_skeletonize_setup
+
+    return benchmarks
+
+
+def run_benchmarks(cfg: BenchmarkConfig) -> dict[str, Any]:
+    """Run the (selected) benchmarks and return the results with some environment information."""
+    if cfg.num_threads is not None:
+        torch.set_num_threads(cfg.num_threads)
+    torch.manual_seed(cfg.seed)
+
+    image, mask, _ = generate_phantom(
+        PhantomConfig(size=tuple(cfg.volume_size), spacing=tuple(cfg.spacing)),
+        np.random.default_rng(cfg.seed),
+    )
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks = _benchmarks(image, mask, cfg, Path(workdir))
+        for name, setup in benchmarks.items():
+            if cfg.only and not any(name.startswith(prefix) for prefix in cfg.only):
+                continue
+            logger.info("Running %s", name)
+            try:
+                results[name] = _time(setup(), repeats=cfg.repeats, warmup=cfg.warmup)
+            except Exception as e:
+                # a broken component shouldn't prevent the other measurements
+                logger.exception("Benchmark %s failed", name)
+                results[name] = {"error": repr(e)}
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "num_threads": torch.get_num_threads(),
+            "volume_size": list(cfg.volume_size),
+            "patch_size": list(cfg.patch_size),
+            "repeats": cfg.repeats,
+        },
+        "results": results,
+    }
+
+
+def compare_results(
+    results: dict[str, Any], baseline: dict[str, Any], tolerance: float = 0.1
+) -> dict[str, dict[str, Any]]:
+    """Compare the median times of all benchmarks present in both runs.
+
+    Returns:
+        Per benchmark the baseline and current median, their ratio and whether it is a regression.
+    """
+    comparison = {}
+    for name, result in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or "median" not in base or "median" not in result:
+            continue
+        ratio = result["median"] / base["median"] if base["median"] > 0 else float("inf")
+        comparison[name] = {
+            "baseline": base["median"],
+            "current": result["median"],
+            "ratio": ratio,
+            "regression": ratio > 1 + tolerance,
+        }
+    return comparison
+
+
+def format_comparison(comparison: dict[str, dict[str, Any]]) -> str:
+    width = max((len(name) for name in comparison), default=10)
+    lines = [f"{'benchmark':<{width}}  {'baseline':>10}  {'current':>10}  {'ratio':>7}"]
+    for name, row in comparison.items():
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(
+            f"{name:<{width}}  {row['baseline']:>9.4f}s  {row['current']:>9.4f}s  {row['ratio']:>6.2f}x{flag}"
+        )
+    return "\n".join(lines)
+
+
+@hydra.main(version_base=None, config_name="benchmark_config")
+def main(cfg: BenchmarkConfig) -> None:
+    logger.info(OmegaConf.to_yaml(cfg))
+    cfg = OmegaConf.to_object(cfg)
+
+    results = run_benchmarks(cfg)
+    if cfg.baseline is not None:
+        with Path(cfg.baseline).open() as f:
+            baseline = json.load(f)
+        comparison = compare_results(results, baseline, tolerance=cfg.tolerance)
+        results["comparison"] = comparison
+        logger.info("\n%s", format_comparison(comparison))
+
+    output = Path(cfg.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w") as f:
+        json.dump(results, f, indent=4)
+    msg = f"Benchmark results written to {output}"
+    logger.info(msg)
+
+    if cfg.fail_on_regression and any(row["regression"] for row in results.get("comparison", {}).values()):
+        sys.exit(1)
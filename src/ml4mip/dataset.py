@@ -27,14 +27,18 @@ from monai.transforms import (
     Resized,
     ResizeWithPadOrCrop,
     ResizeWithPadOrCropd,
+    ScaleIntensity,
     ScaleIntensityd,
     Spacing,
     Spacingd,
+    ToTensor,
     ToTensord,
 )
 from scipy.stats import truncnorm
 from torch.utils.data import Dataset
 
+from ml4mip.loss import target_skeleton
+
 logger = logging.getLogger(__name__)
 
 
@@ -86,6 +90,9 @@ class DatasetConfig:
     mask_operation: MaskOperations = MaskOperations.STD
     max_epochs: int = 1
     grouped: bool = False
+    # append the soft skeleton of the mask as extra channel, so the clDice losses don't recompute it
+    # (computed once per volume/patch if cached)
+    target_skeleton: bool = False
 
 
 @dataclass
@@ -127,8 +134,10 @@ class ABCNiftiDataset(Dataset, ABC):
         cache: bool = False,
         cache_pooling: int = 0,
         mask_operation: MaskOperations = MaskOperations.STD,
+        target_skeleton: bool = False,
     ) -> None:
         self.use_cache = cache
+        self.target_skeleton = target_skeleton
 
         self.data_dir: Path = Path(data_dir)
         self.mask_dir: Path = self.data_dir
@@ -198,7 +207,10 @@ class ABCNiftiDataset(Dataset, ABC):
 
             # Extract the transformed image and mask and append to the output lists
             images.append(loaded_data["image"])
-            masks.append(perform_mask_transformation(loaded_data["mask"], self.mask_operation))
+            mask = perform_mask_transformation(loaded_data["mask"], self.mask_operation)
+            if self.target_skeleton:
+                mask = torch.cat([mask, target_skeleton(mask)])
+            masks.append(mask)
 
         return (
             (
@@ -281,6 +293,7 @@ class NiftiDataset(ABCNiftiDataset):
         cache: bool = False,
         cache_pooling: int = 0,
         mask_operation: MaskOperations = MaskOperations.STD,
+        target_skeleton: bool = False,
         **kwargs,
     ) -> None:
         super().__init__(
@@ -294,6 +307,7 @@ class NiftiDataset(ABCNiftiDataset):
             cache=cache,
             cache_pooling=cache_pooling,
             mask_operation=mask_operation,
+            target_skeleton=target_skeleton,
             **kwargs,
         )
 
@@ -370,6 +384,7 @@ class GroupedNifitDataset(ABCNiftiDataset):
         cache: bool = False,
         cache_pooling: int = 0,
         max_epoch: int = 1,
+        target_skeleton: bool = False,
     ) -> None:
         super().__init__(
             data_dir=data_dir,
@@ -381,6 +396,7 @@ class GroupedNifitDataset(ABCNiftiDataset):
             cache=cache,
             cache_pooling=cache_pooling,
             mask_operation=MaskOperations.STD,
+            target_skeleton=target_skeleton,
         )
 
         self.max_epoch = max_epoch
@@ -522,6 +538,7 @@ def get_dataset(
                 cache=cfg.cache,
                 cache_pooling=cfg.cache_pooling,
                 max_epoch=cfg.max_epochs,
+                target_skeleton=cfg.target_skeleton,
             )
             if cfg.grouped
             else NiftiDataset(
@@ -543,6 +560,7 @@ def get_dataset(
                 cache=cfg.cache,
                 cache_pooling=cfg.cache_pooling,
                 mask_operation=cfg.mask_operation,
+                target_skeleton=cfg.target_skeleton,
             )
         )
 
@@ -905,6 +923,27 @@ def get_std_transform(
     return Compose(transforms)
 
 
+def get_inference_transform(
+    target_pixel_dim: tuple[float, float, float] = TARGET_PIXEL_DIM,
+    target_spatial_size: tuple[int, int, int] = TARGET_SPATIAL_SIZE,
+):
+    """Preprocessing of the (unlabeled) images at inference time."""
+    return Compose(
+        [
+            Spacing(
+                pixdim=target_pixel_dim,
+                mode="bilinear",
+            ),
+            ScaleIntensity(minv=0.0, maxv=1.0),
+            ResizeWithPadOrCrop(
+                spatial_size=target_spatial_size,
+                mode="edge",
+            ),
+            ToTensor(),
+        ]
+    )
+
+
 def get_scaling_transform(
     target_pixel_dim: tuple[float, float, float] = TARGET_PIXEL_DIM,
     target_spatial_size: tuple[int, int, int] = TARGET_SPATIAL_SIZE,
@@ -983,3 +1022,79 @@ def reshape_to_original(mask):
             ),
         ]
     )(mask)
+
+
+def resample_to_original(
+    output: MetaTensor,
+    threshold: float | None = 0.5,
+    slab_size: int = 16,
+    device: torch.device | None = None,
+) -> MetaTensor:
+    """Resample a prediction (C x H x W x D) of the network grid onto the grid of the original image.
+
+    Instead of inverting the padding/cropping and the spacing one after another (see
+    `reshape_to_original`), the mapping from the original voxels to the network voxels is composed
+    into a single affine from the affine of the prediction and the original affine. The prediction
+    (logits or probabilities) is interpolated trilinearly once and thresholded in the same pass.
+    The original grid is processed in slabs that only read the part of the prediction they need.
+
+    Args:
+        output: The prediction with the meta data of the transformed image.
+        threshold: Threshold to a uint8 mask (None: return the interpolated float values).
+        slab_size: Number of original slices along the first axis resampled at once.
+        device: Device of the resampling (default: the device of the prediction).
+
+    Returns:
+        The prediction on the original grid with the original affine.
+    """
+    original_shape = output.meta.get("spatial_shape")
+    original_affine = output.meta.get("original_affine")
+    if original_shape is None:
+        msg = "Original shape information is not available in the metadata."
+        raise ValueError(msg)
+    if original_affine is None:
+        msg = "Original affine information is not available in the metadata."
+        raise ValueError(msg)
+    original_shape = [int(size) for size in original_shape]
+    original_affine = torch.as_tensor(np.asarray(original_affine), dtype=torch.float64)
+
+    values = output.as_tensor()
+    device = device if device is not None else values.device
+    # original voxel -> world -> network voxel
+    transform = (torch.linalg.inv(output.affine.to(torch.float64).cpu()) @ original_affine).to(device)
+    rotation, translation = transform[:3, :3].float(), transform[:3, 3].float()
+    size = torch.tensor(values.shape[1:], device=device)
+
+    result = torch.zeros(
+        (values.shape[0], *original_shape),
+        dtype=torch.uint8 if threshold is not None else torch.float32,
+        device=device,
+    )
+    axes = [torch.arange(length, device=device, dtype=torch.float32) for length in original_shape]
+    for start in range(0, original_shape[0], slab_size):
+        grid = torch.stack(
+            torch.meshgrid(axes[0][start : start + slab_size], axes[1], axes[2], indexing="ij"), dim=-1
+        )
+        coordinates = grid @ rotation.T + translation
+        # voxels outside of the network grid (cropped away) are background
+        inside = ((coordinates >= -0.5) & (coordinates <= size - 0.5)).all(dim=-1)
+        if not inside.any():
+            continue
+
+        # read only the part of the prediction covered by the slab
+        lower = coordinates[inside].amin(dim=0).floor().clamp(min=0).long()
+        upper = (coordinates[inside].amax(dim=0).ceil().long() + 1).minimum(size)
+        crop = values[:, lower[0] : upper[0], lower[1] : upper[1], lower[2] : upper[2]]
+        crop = crop.to(device=device, dtype=torch.float32)
+        extent = (upper - lower - 1).clamp(min=1)
+        # grid_sample expects the coordinates in [-1, 1] and in reversed axis order
+        normalized = ((coordinates - lower) / extent * 2 - 1).flip(-1)
+        sampled = torch.nn.functional.grid_sample(
+            crop[None], normalized[None], mode="bilinear", padding_mode="border", align_corners=True
+        )[0]
+        if threshold is not None:
+            sampled = sampled >= threshold
+        result[:, start : start + slab_size] = torch.where(inside, sampled, 0)
+
+    meta = {key: value for key, value in output.meta.items() if key != "affine"}
+    return MetaTensor(result, affine=original_affine, meta=meta)
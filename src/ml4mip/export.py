@@ -0,0 +1,133 @@
+import logging
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+
+import hydra
+import torch
+from hydra.core.config_store import ConfigStore
+from omegaconf import MISSING, OmegaConf
+from torch import nn
+
+from ml4mip.models import ModelConfig, ModelType, get_model
+
+logger = logging.getLogger(__name__)
+
+# batch and spatial axes of the ONNX models are dynamic
+DYNAMIC_AXES = {
+    "image": {0: "batch", 2: "height", 3: "width", 4: "depth"},
+    "logits": {0: "batch", 2: "height", 3: "width", 4: "depth"},
+}
+
+
+class ExportFormat(Enum):
+    TORCHSCRIPT = "torchscript"
+    ONNX = "onnx"
+
+
+@dataclass
+class ExportConfig:
+    model: ModelConfig = field(default_factory=ModelConfig)
+    output_dir: str = MISSING
+    name: str = "model"
+    formats: list[ExportFormat] = field(default_factory=lambda: [ExportFormat.TORCHSCRIPT, ExportFormat.ONNX])
+    # size of the example input the models are traced with
+    example_size: tuple[int, int, int] = (96, 96, 96)
+    opset_version: int = 17
+    # compare the exported models with the eager model on an input of another size
+    check_size: tuple[int, int, int] | None = (64, 96, 128)
+    atol: float = 1e-3
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_export_config",
+    node=ExportConfig,
+)
+
+
+def export_torchscript(model: nn.Module, path: str | Path, example_inputs: torch.Tensor) -> None:
+    """Trace and freeze a model, it is loaded by `get_model` with `ModelType.TORCHSCRIPT`."""
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model.eval(), example_inputs))
+    torch.jit.save(traced, str(path))
+
+
+def export_onnx(model: nn.Module, path: str | Path, example_inputs: torch.Tensor, opset_version: int = 17) -> None:
+    """Export a model to ONNX with dynamic batch and spatial axes (`ModelType.ONNX`)."""
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(),
+            (example_inputs,),
+            str(path),
+            input_names=["image"],
+            output_names=["logits"],
+            dynamic_axes=DYNAMIC_AXES,
+            opset_version=opset_version,
+        )
+
+
+def max_abs_difference(model: nn.Module, exported: nn.Module, inputs: torch.Tensor) -> float:
+    with torch.no_grad():
+        return (model(inputs) - exported(inputs)).abs().max().item()
+
+
+def export_model(
+    model: nn.Module,
+    output_dir: str | Path,
+    formats: list[ExportFormat],
+    name: str = "model",
+    example_size: tuple[int, int, int] = (96, 96, 96),
+    opset_version: int = 17,
+) -> dict[ExportFormat, ModelConfig]:
+    """Export a model (on the CPU) to the formats.
+
+    Returns:
+        The configs loading the exported models with `get_model`.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    model = model.cpu().eval()
+    example_inputs = torch.rand(1, 1, *example_size)
+    configs = {}
+    for export_format in formats:
+        match export_format:
+            case ExportFormat.TORCHSCRIPT:
+                path = output_dir / f"{name}.pt"
+                export_torchscript(model, path, example_inputs)
+                configs[export_format] = ModelConfig(model_type=ModelType.TORCHSCRIPT, base_model_jit_path=str(path))
+            case ExportFormat.ONNX:
+                path = output_dir / f"{name}.onnx"
+                export_onnx(model, path, example_inputs, opset_version=opset_version)
+                configs[export_format] = ModelConfig(model_type=ModelType.ONNX, onnx_path=str(path))
+            case _:
+                msg = f"Invalid export format: {export_format}"
+                raise ValueError(msg)
+        logger.info("Exported %s model to %s", export_format.value, path)
+    return configs
+
+
+@hydra.main(version_base=None, config_name="base_export_config")
+def main(cfg: ExportConfig) -> None:
+    logger.info(OmegaConf.to_yaml(cfg))
+    cfg = OmegaConf.to_object(cfg)
+
+    model = get_model(cfg.model).cpu().eval()
+    configs = export_model(
+        model,
+        cfg.output_dir,
+        cfg.formats,
+        name=cfg.name,
+        example_size=cfg.example_size,
+        opset_version=cfg.opset_version,
+    )
+    if cfg.check_size is None:
+        return
+
+    inputs = torch.rand(1, 1, *cfg.check_size)
+    for export_format, model_cfg in configs.items():
+        difference = max_abs_difference(model, get_model(model_cfg).cpu().eval(), inputs)
+        logger.info("%s: max abs difference to the eager model %.2e", export_format.value, difference)
+        if difference > cfg.atol:
+            msg = f"The {export_format.value} model differs from the eager model by {difference:.2e} > {cfg.atol}."
+            raise RuntimeError(msg)
@@ -439,11 +439,17 @@ def convert_numpy_types(obj):
 
 
 def translate_to_world_coords(graph: nx.Graph, affine: np.ndarray):
-    for node in graph.nodes:
-        voxel_coord = np.array(graph.nodes[node]["coordinate"])
+    """Map the node and edge skeleton coordinates from voxel to world coordinates."""
+
+    def transform(voxel_coord):
         homogeneous_voxel = np.append(voxel_coord, 1)  # [x, y, z, 1]
-        world_coord = affine @ homogeneous_voxel
-        graph.nodes[node]["coordinate"] = tuple(world_coord[:3])  # Store as a tuple
+        return tuple((affine @ homogeneous_voxel)[:3])  # Store as a tuple
+
+    for node in graph.nodes:
+        graph.nodes[node]["coordinate"] = transform(graph.nodes[node]["coordinate"])
+    for edge in graph.edges:
+        for skeleton in graph.edges[edge].get("skeletons", []):
+            skeleton["coordinate"] = transform(skeleton["coordinate"])
     return graph
 
 
@@ -5,6 +5,10 @@ import torch
 import torch.nn.functional as F
 from monai.losses import DiceCELoss, DiceLoss, FocalLoss, TverskyLoss
 from torch import nn
+from torch.utils.checkpoint import checkpoint
+
+# iterations of the soft skeletonization in the clDice losses
+SKELETON_ITER = 10
 
 
 class LossType(Enum):
@@ -23,24 +27,39 @@ class LossConfig:
     lambda_ce: float = 0.3
     cedice_batch: bool = False
     alpha: float = 0.5
+    # recompute the soft skeletonization iterations in the backward pass to save memory
+    skeleton_checkpoint: bool = False
     sigmoid = True
 
 
 class SoftSkeletonize(torch.nn.Module):
-    def __init__(self, num_iter=40):
+    """Soft skeletonization by iterated soft morphological opening (clDice).
+
+    The erosion of every iteration is reused as input of the next one, so each iteration needs a
+    single erosion. Without gradients the intermediate buffers are updated in place. With
+    `checkpoint` only the state between the iterations is kept for the backward pass and the
+    iterations are recomputed, which reduces the activation memory per iteration to two tensors.
+    """
+
+    def __init__(self, num_iter=40, checkpoint=False):
         super(SoftSkeletonize, self).__init__()
         self.num_iter = num_iter
+        self.checkpoint = checkpoint
 
     def soft_erode(self, img):
+        # the negated input is shared by the axis-wise pools: min(-a, -b) = -max(a, b)
+        # (pairwise maximum, so ties split the gradient like the pairwise minimum)
         if len(img.shape) == 4:
-            p1 = -F.max_pool2d(-img, (3, 1), (1, 1), (1, 0))
-            p2 = -F.max_pool2d(-img, (1, 3), (1, 1), (0, 1))
-            return torch.min(p1, p2)
+            neg = -img
+            p1 = F.max_pool2d(neg, (3, 1), (1, 1), (1, 0))
+            p2 = F.max_pool2d(neg, (1, 3), (1, 1), (0, 1))
+            return -torch.maximum(p1, p2)
         if len(img.shape) == 5:
-            p1 = -F.max_pool3d(-img, (3, 1, 1), (1, 1, 1), (1, 0, 0))
-            p2 = -F.max_pool3d(-img, (1, 3, 1), (1, 1, 1), (0, 1, 0))
-            p3 = -F.max_pool3d(-img, (1, 1, 3), (1, 1, 1), (0, 0, 1))
-            return torch.min(torch.min(p1, p2), p3)
+            neg = -img
+            p1 = F.max_pool3d(neg, (3, 1, 1), (1, 1, 1), (1, 0, 0))
+            p2 = F.max_pool3d(neg, (1, 3, 1), (1, 1, 1), (0, 1, 0))
+            p3 = F.max_pool3d(neg, (1, 1, 3), (1, 1, 1), (0, 0, 1))
+            return -torch.maximum(torch.maximum(p1, p2), p3)
         return None
 
     def soft_dilate(self, img):
@@ -53,41 +72,87 @@ class SoftSkeletonize(torch.nn.Module):
     def soft_open(self, img):
         return self.soft_dilate(self.soft_erode(img))
 
-    def soft_skel(self, img):
-        img1 = self.soft_open(img)
-        skel = F.relu(img - img1)
-
-        for j in range(self.num_iter):
-            img = self.soft_erode(img)
-            img1 = self.soft_open(img)
-            delta = F.relu(img - img1)
-            skel = skel + F.relu(delta - skel * delta)
+    def _step(self, img, skel):
+        # img is the erosion of the previous iteration, its opening is the dilation of the next erosion
+        eroded = self.soft_erode(img)
+        delta = F.relu(img - self.soft_dilate(eroded))
+        return eroded, skel + F.relu(delta - skel * delta)
+
+    @torch.no_grad()
+    def _soft_skel_inplace(self, img):
+        eroded = self.soft_erode(img)
+        skel = self.soft_dilate(eroded)
+        torch.sub(img, skel, out=skel).relu_()
+        for _ in range(self.num_iter):
+            img = eroded
+            eroded = self.soft_erode(img)
+            delta = self.soft_dilate(eroded)
+            torch.sub(img, delta, out=delta).relu_()
+            update = torch.mul(skel, delta)
+            torch.sub(delta, update, out=update).relu_()
+            skel.add_(update)
+        return skel
 
+    def soft_skel(self, img):
+        if not (torch.is_grad_enabled() and img.requires_grad):
+            return self._soft_skel_inplace(img)
+
+        eroded = self.soft_erode(img)
+        skel = F.relu(img - self.soft_dilate(eroded))
+        for _ in range(self.num_iter):
+            if self.checkpoint:
+                eroded, skel = checkpoint(self._step, eroded, skel, use_reentrant=False)
+            else:
+                eroded, skel = self._step(eroded, skel)
         return skel
 
     def forward(self, img):
         return self.soft_skel(img)
 
 
+@torch.no_grad()
+def target_skeleton(y_true: torch.Tensor) -> torch.Tensor:
+    """Soft skeleton of a ground truth mask (C x H x W x D) as used by the clDice losses."""
+    return SoftSkeletonize(num_iter=SKELETON_ITER)(y_true[None].float())[0]
+
+
+def split_target_skeleton(
+    y_pred: torch.Tensor, y_true: torch.Tensor
+) -> tuple[torch.Tensor, torch.Tensor | None]:
+    """Split the precomputed skeleton channels (see `DatasetConfig.target_skeleton`) off the target.
+
+    Returns:
+        The target with as many channels as the prediction and the skeleton (None if not present).
+    """
+    num_channels = y_pred.shape[1]
+    if y_true.shape[1] == 2 * num_channels:
+        return y_true[:, :num_channels], y_true[:, num_channels:]
+    return y_true, None
+
+
 class soft_cldice(nn.Module):
-    def __init__(self, iter_=3, smooth=1.0, exclude_background=False, sigmoid=True):
+    def __init__(self, iter_=3, smooth=1.0, exclude_background=False, sigmoid=True, checkpoint=False):
         super(soft_cldice, self).__init__()
         self.iter = iter_
         self.smooth = smooth
-        self.soft_skeletonize = SoftSkeletonize(num_iter=10)
+        self.soft_skeletonize = SoftSkeletonize(num_iter=SKELETON_ITER, checkpoint=checkpoint)
         self.exclude_background = exclude_background
         self.sigmoid = sigmoid
 
-    def forward(self, y_true, y_pred):
+    def forward(self, y_pred, y_true, skel_true=None):
+        """Compute the loss, the skeleton of `y_true` is only computed if `skel_true` isn't given."""
         if self.exclude_background:
             y_true = y_true[:, 1:, :, :]
             y_pred = y_pred[:, 1:, :, :]
+            if skel_true is not None:
+                skel_true = skel_true[:, 1:, :, :]
 
         if self.sigmoid:
             y_pred = torch.sigmoid(y_pred)
 
         skel_pred = self.soft_skeletonize(y_pred)
-        skel_true = self.soft_skeletonize(y_true)
+        if skel_true is None:
+            skel_true = self.soft_skeletonize(y_true)
         tprec = (torch.sum(torch.multiply(skel_pred, y_true)) + self.smooth) / (
             torch.sum(skel_pred) + self.smooth
         )
@@ -115,21 +180,25 @@ def soft_dice(y_true, y_pred):
 
 
 class soft_dice_cldice(nn.Module):
-    def __init__(self, iter_=3, alpha=0.5, smooth=1.0, exclude_background=False):
+    def __init__(self, iter_=3, alpha=0.5, smooth=1.0, exclude_background=False, checkpoint=False):
         super(soft_dice_cldice, self).__init__()
         self.iter = iter_
         self.smooth = smooth
         self.alpha = alpha
-        self.soft_skeletonize = SoftSkeletonize(num_iter=10)
+        self.soft_skeletonize = SoftSkeletonize(num_iter=SKELETON_ITER, checkpoint=checkpoint)
         self.exclude_background = exclude_background
 
-    def forward(self, y_true, y_pred):
+    def forward(self, y_pred, y_true, skel_true=None):
+        """Compute the loss, the skeleton of `y_true` is only computed if `skel_true` isn't given."""
         if self.exclude_background:
             y_true = y_true[:, 1:, :, :]
             y_pred = y_pred[:, 1:, :, :]
+            if skel_true is not None:
+                skel_true = skel_true[:, 1:, :, :]
         dice = soft_dice(y_true, y_pred)
         skel_pred = self.soft_skeletonize(y_pred)
-        skel_true = self.soft_skeletonize(y_true)
+        if skel_true is None:
+            skel_true = self.soft_skeletonize(y_true)
         tprec = (torch.sum(torch.multiply(skel_pred, y_true)) + self.smooth) / (
             torch.sum(skel_pred) + self.smooth
         )
@@ -159,9 +228,23 @@ def get_loss(cfg: LossConfig):
         case LossType.TVERSKY:
             return TverskyLoss(sigmoid=cfg.sigmoid)
         case LossType.SOFT_CL_DICE:
-            return soft_cldice()
+            return soft_cldice(checkpoint=cfg.skeleton_checkpoint)
         case LossType.SOFT_DICE_CL_DICE:
-            return soft_dice_cldice(alpha=cfg.alpha)
+            return soft_dice_cldice(alpha=cfg.alpha, checkpoint=cfg.skeleton_checkpoint)
         case _:
             msg = f"Loss type {cfg.loss_type} not supported"
             raise ValueError(msg)
+
+
+def compute_loss(
+    loss_fn: nn.Module, y_pred: torch.Tensor, y_true: torch.Tensor
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Compute the loss, passing a precomputed target skeleton to the clDice losses.
+
+    Returns:
+        The loss and the target without the skeleton channels.
+    """
+    y_true, skel_true = split_target_skeleton(y_pred, y_true)
+    if skel_true is not None and isinstance(loss_fn, soft_cldice | soft_dice_cldice):
+        return loss_fn(y_pred, y_true, skel_true=skel_true), y_true
+    return loss_fn(y_pred, y_true), y_true
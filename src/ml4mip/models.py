@@ -1,5 +1,7 @@
+import hashlib
 import logging
 import pathlib
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
 
@@ -22,6 +24,11 @@ class ModelType(Enum):
     UNETMONAI2_LEAKYRELU = "unet_monai_2_lr"
     UNETMONAI3 = "unet_monai_3"
     MEDSAM = "medsam"
+    # int8 TorchScript model written by `quantize` (CPU only)
+    QUANTIZED = "quantized"
+    # models written by `export`
+    TORCHSCRIPT = "torchscript"
+    ONNX = "onnx"
 
 
 @dataclass
@@ -34,6 +41,8 @@ class ModelConfig:
     # TODO add more config values for other model classes:
     # maybe nested classes are better for model specific config values
     checkpoint_path: str | None = None
+    # ONNX file of an exported model, run with ONNX Runtime on the CPU
+    onnx_path: str | None = None
 
 
 _cs = ConfigStore.instance()
@@ -57,6 +66,80 @@ class UnetrPtrJitWrapper(torch.nn.Module):
         return full_output[:, self.selected_channels, ...]  # BS x C x D x H x W
 
 
+def file_digest(path: str | pathlib.Path) -> str:
+    """Digest of the content of a (model) file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with pathlib.Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_digest(model: torch.nn.Module) -> str | None:
+    """Digest of the file an exported model was loaded from, None for the models built in Python.
+
+    The weights of exported (frozen TorchScript, ONNX) models are part of the graph instead of the
+    state dict, so the file identifies them.
+    """
+    return getattr(model, "source_digest", None)
+
+
+class CPUModelWrapper(torch.nn.Module, ABC):
+    """Base of the models that only run on the CPU, for inputs on any device.
+
+    Moves to another device (e.g. `.to(device)`, `.cuda()`) are ignored, other conversions such as
+    `.double()` are applied. The inputs are moved to the CPU (as float tensors) and the outputs back
+    to the device of the inputs.
+    """
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.forward_cpu(x.detach().as_subclass(torch.Tensor).float().cpu()).to(x.device)
+
+    @abstractmethod
+    def forward_cpu(self, x: torch.Tensor) -> torch.Tensor:
+        """Run the model on a float tensor on the CPU."""
+
+    def _apply(self, fn, *args, **kwargs):
+        # the conversion function is opaque, a probe tensor tells whether it moves to another device
+        if fn(torch.zeros(())).device != torch.device("cpu"):
+            return self
+        return super()._apply(fn, *args, **kwargs)
+
+
+class QuantizedJitWrapper(CPUModelWrapper):
+    """Run a quantized model, the quantized kernels only exist on the CPU."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward_cpu(self, x: torch.Tensor) -> torch.Tensor:
+        return self.model(x)
+
+
+class OnnxRuntimeWrapper(CPUModelWrapper):
+    """Run an exported ONNX model with ONNX Runtime on the CPU."""
+
+    def __init__(self, path: str | pathlib.Path, num_threads: int | None = None):
+        super().__init__()
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            msg = "ONNX Runtime is required to run ONNX models, install it with `pip install ML4MIP[onnx]`."
+            raise ImportError(msg) from e
+
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.source_digest = file_digest(path)
+
+    def forward_cpu(self, x: torch.Tensor) -> torch.Tensor:
+        (outputs,) = self.session.run(None, {self.input_name: x.numpy()})
+        return torch.from_numpy(outputs)
+
+
 class UNetWrapper(torch.nn.Module):
     def __init__(self):
         super(UNetWrapper, self).__init__()
@@ -225,6 +308,15 @@ def get_model(cfg: ModelConfig) -> torch.nn.Module:
         case ModelType.UNETR_PTR:
             model = torch.jit.load(cfg.base_model_jit_path, map_location=device)
             model = UnetrPtrJitWrapper(model)
+        case ModelType.QUANTIZED:
+            model = torch.jit.load(cfg.base_model_jit_path, map_location="cpu")
+            model = QuantizedJitWrapper(model)
+            model.source_digest = file_digest(cfg.base_model_jit_path)
+        case ModelType.TORCHSCRIPT:
+            model = torch.jit.load(cfg.base_model_jit_path, map_location=device)
+            model.source_digest = file_digest(cfg.base_model_jit_path)
+        case ModelType.ONNX:
+            model = OnnxRuntimeWrapper(cfg.onnx_path)
         case ModelType.UNET:
             model = UNetWrapper()
         case ModelType.UNETMONAI1:
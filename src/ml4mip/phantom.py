@@ -0,0 +1,216 @@
+import json
+import logging
+from dataclasses import dataclass
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+
+import hydra
+import networkx as nx
+import nibabel as nib
+import numpy as np
+from hydra.core.config_store import ConfigStore
+from omegaconf import OmegaConf
+from scipy.ndimage import gaussian_filter
+from tqdm import tqdm
+
+from ml4mip.dataset import TARGET_PIXEL_DIM
+from ml4mip.graph_extraction import convert_numpy_types, export2json, translate_to_world_coords
+
+logger = logging.getLogger(__name__)
+
+# distance of the sampled centerline points in mm
+STEP_MM = 0.25
+
+
+@dataclass
+class PhantomConfig:
+    output_dir: str = str(Path.cwd() / "phantoms")
+    num_cases: int = 10
+    # the cases are deterministic per (seed, case index)
+    seed: int = 0
+    num_workers: int = 1
+    # skip cases whose files already exist
+    overwrite: bool = False
+    size: tuple[int, int, int] = (512, 512, 256)
+    spacing: tuple[float, float, float] = TARGET_PIXEL_DIM
+    # number of branches of each of the two (left and right) trees
+    branches_per_tree: int = 15
+    # vessel radius in mm at the roots, the radius shrinks at every bifurcation
+    root_radius: float = 2.0
+    min_radius: float = 0.6
+    radius_decay: float = 0.8
+    # length of a branch in mm
+    branch_length: tuple[float, float] = (15.0, 40.0)
+    # how much the direction of a vessel wanders per mm
+    tortuosity: float = 0.05
+    # intensities in HU
+    background: float = -100.0
+    vessel: float = 350.0
+    noise_std: float = 40.0
+    # distance of the skeleton points stored per edge of the graph in mm
+    skeleton_spacing: float = 3.0
+    image_affix: tuple[str, str] = ("", ".img.nii.gz")
+    mask_affix: tuple[str, str] = ("", ".label.nii.gz")
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="phantom_config",
+    node=PhantomConfig,
+)
+
+
+def _random_unit(rng: np.random.Generator) -> np.ndarray:
+    vector = rng.normal(size=3)
+    return vector / np.linalg.norm(vector)
+
+
+def _grow_branch(
+    rng: np.random.Generator,
+    start: np.ndarray,
+    direction: np.ndarray,
+    length: float,
+    tortuosity: float,
+    extent: np.ndarray,
+) -> np.ndarray:
+    """Sample the centerline of a branch in mm, it ends early at the border of the volume."""
+    points = [start]
+    for _ in range(int(length / STEP_MM)):
+        direction = direction + rng.normal(scale=tortuosity * STEP_MM**0.5, size=3)
+        direction /= np.linalg.norm(direction)
+        point = points[-1] + STEP_MM * direction
+        if np.any(point < 0) or np.any(point >= extent):
+            break
+        points.append(point)
+    return np.stack(points)
+
+
+def _grow_tree(
+    rng: np.random.Generator,
+    root: np.ndarray,
+    direction: np.ndarray,
+    extent: np.ndarray,
+    cfg: PhantomConfig,
+) -> list[tuple[int, np.ndarray, float]]:
+    """Grow a binary tree of branches breadth first.
+
+    Returns:
+        The branches as (parent branch index or -1, centerline in mm, radius in mm).
+    """
+    branches = []
+    pending = [(-1, root, direction, cfg.root_radius)]
+    while pending and len(branches) < cfg.branches_per_tree:
+        parent, start, direction, radius = pending.pop(0)
+        centerline = _grow_branch(
+            rng, start, direction, rng.uniform(*cfg.branch_length), cfg.tortuosity, extent
+        )
+        if len(centerline) < 2:
+            continue
+        branches.append((parent, centerline, radius))
+        child_radius = radius * cfg.radius_decay
+        if child_radius < cfg.min_radius:
+            continue
+        end_direction = centerline[-1] - centerline[-2]
+        end_direction /= np.linalg.norm(end_direction)
+        for _ in range(2):
+            child_direction = end_direction + rng.uniform(0.35, 1.2) * _random_unit(rng)
+            child_direction /= np.linalg.norm(child_direction)
+            pending.append((len(branches) - 1, centerline[-1], child_direction, child_radius))
+    return branches
+
+
+def _draw_tube(mask: np.ndarray, centerline: np.ndarray, radius: float, spacing: np.ndarray) -> None:
+    """Fill the voxels within `radius` (mm) of the centerline points (mm)."""
+    shape = np.array(mask.shape)
+    extent = np.ceil(radius / spacing).astype(int) + 1
+    for point in centerline:
+        center = point / spacing
+        lower = np.maximum(np.floor(center).astype(int) - extent, 0)
+        upper = np.minimum(np.floor(center).astype(int) + extent + 1, shape)
+        if np.any(lower >= upper):
+            continue
+        grid = np.ogrid[tuple(slice(lo, up) for lo, up in zip(lower, upper, strict=True))]
+        distance = sum(((axis - c) * s) ** 2 for axis, c, s in zip(grid, center, spacing, strict=True))
+        mask[tuple(slice(lo, up) for lo, up in zip(lower, upper, strict=True))] |= distance <= radius**2
+
+
+def generate_phantom(
+    cfg: PhantomConfig, rng: np.random.Generator
+) -> tuple[np.ndarray, np.ndarray, nx.DiGraph]:
+    """Generate a CT-like image, its vessel mask and the ground truth graph of two branching trees.
+
+    The graph follows the format of `extract_graph`: nodes are the roots, bifurcations and endpoints
+    with voxel coordinates, edges carry their length in mm and a subset of their skeleton points.
+    """
+    spacing = np.asarray(cfg.spacing, dtype=float)
+    extent_mm = np.asarray(cfg.size) * spacing
+    mask = np.zeros(cfg.size, dtype=bool)
+    graph = nx.DiGraph()
+
+    # the roots lie in the upper part of the volume left and right of the center (cf. determine_root_nodes)
+    for side in (-1, 1):
+        root = extent_mm * np.array([0.5, 0.5 + side * 0.12, 0.85]) + rng.normal(scale=2.0, size=3)
+        direction = np.array([0.0, side * 0.5, -1.0]) + 0.3 * _random_unit(rng)
+        branches = _grow_tree(rng, root, direction / np.linalg.norm(direction), extent_mm, cfg)
+
+        # node of the start and end point of every branch, children start at the end of their parent
+        end_nodes = []
+        for parent, centerline, radius in branches:
+            _draw_tube(mask, centerline, radius, spacing)
+            if parent == -1:
+                start_node = graph.number_of_nodes()
+                graph.add_node(start_node, coordinate=tuple(centerline[0] / spacing), root=True)
+            else:
+                start_node = end_nodes[parent]
+            end_node = graph.number_of_nodes()
+            graph.add_node(end_node, coordinate=tuple(centerline[-1] / spacing), root=False)
+            end_nodes.append(end_node)
+
+            skeleton = centerline[:: max(int(cfg.skeleton_spacing / STEP_MM), 1)] / spacing
+            graph.add_edge(
+                start_node,
+                end_node,
+                length=float(np.linalg.norm(np.diff(centerline, axis=0), axis=1).sum()),
+                skeletons=[{"coordinate": tuple(point)} for point in skeleton],
+            )
+
+    # partial volume effect at the vessel walls and scanner noise
+    image = cfg.background + (cfg.vessel - cfg.background) * gaussian_filter(mask.astype(np.float32), sigma=0.7)
+    image += rng.normal(scale=cfg.noise_std, size=cfg.size).astype(np.float32)
+    return np.round(image).astype(np.int16), mask.astype(np.uint8), graph
+
+
+def write_case(case: int, cfg: PhantomConfig) -> None:
+    """Generate the phantom of a case and write the image, mask and graph files."""
+    output_dir = Path(cfg.output_dir)
+    case_id = str(case)
+    image_path = output_dir / f"{cfg.image_affix[0]}{case_id}{cfg.image_affix[1]}"
+    mask_path = output_dir / f"{cfg.mask_affix[0]}{case_id}{cfg.mask_affix[1]}"
+    graph_path = output_dir / f"{case_id}.graph.json"
+    if not cfg.overwrite and image_path.exists() and mask_path.exists() and graph_path.exists():
+        return
+
+    image, mask, graph = generate_phantom(cfg, np.random.default_rng([cfg.seed, case]))
+    affine = np.diag([*cfg.spacing, 1.0])
+    nib.save(nib.Nifti1Image(image, affine), image_path)
+    nib.save(nib.Nifti1Image(mask, affine), mask_path)
+    with graph_path.open("w") as f:
+        json.dump(export2json(translate_to_world_coords(graph, affine)), f, default=convert_numpy_types, indent=4)
+
+
+@hydra.main(version_base=None, config_name="phantom_config")
+def main(cfg: PhantomConfig) -> None:
+    logger.info(OmegaConf.to_yaml(cfg))
+    cfg = OmegaConf.to_object(cfg)
+    Path(cfg.output_dir).mkdir(parents=True, exist_ok=True)
+
+    with Pool(processes=cfg.num_workers) as pool:
+        for _ in tqdm(
+            pool.imap_unordered(partial(write_case, cfg=cfg), range(cfg.num_cases)),
+            total=cfg.num_cases,
+            desc="Generating phantoms",
+        ):
+            pass
+    msg = f"{cfg.num_cases} phantoms written to {cfg.output_dir}"
+    logger.info(msg)
@@ -0,0 +1,192 @@
+import gzip
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import torch
+from hydra.core.config_store import ConfigStore
+from monai.data import MetaTensor
+from torch import nn
+from tqdm import tqdm
+
+from ml4mip import trainer
+from ml4mip.dataset import resample_to_original, reshape_to_original
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the loader queue
+_DONE = object()
+
+
+@dataclass
+class PipelineConfig:
+    # batches loaded ahead of the model
+    prefetch: int = 2
+    # workers resampling the predictions to the original grid and writing the files
+    num_writers: int = 2
+    # use processes instead of threads for the writers
+    writer_processes: bool = False
+    # cases waiting for a writer, the model stage blocks when more are pending
+    max_pending: int = 4
+    # gzip level of the written masks (0: fastest, 9: smallest)
+    compression_level: int = 1
+    # resample the predictions to the original grid on the model's device, the writers only compress
+    resample_on_device: bool = False
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_pipeline_config",
+    node=PipelineConfig,
+)
+
+
+def case_id(prediction: MetaTensor) -> str:
+    """Id of a case from the file name of its image, e.g. `12` for `12.img.nii.gz`."""
+    return Path(str(prediction.meta["filename_or_obj"])).name.split(".")[0]
+
+
+def restore_mask(prediction: MetaTensor, resample_logits: bool = True) -> MetaTensor:
+    """Binary mask of a prediction (C x H x W x D) on the grid of the original image."""
+    if resample_logits:
+        return resample_to_original(prediction, threshold=0.5)
+    return reshape_to_original(prediction) >= 0.5
+
+
+def write_case(
+    prediction: MetaTensor,
+    output_dir: str | Path,
+    compression_level: int = 1,
+    resample: bool = True,
+    resample_logits: bool = True,
+) -> Path:
+    """Resample a prediction (C x H x W x D) to the original grid and write it as `{id}.label.nii.gz`.
+
+    Args:
+        prediction: The logits (or a binary mask if `resample_logits` is False) with meta data.
+        output_dir: Directory of the written mask.
+        compression_level: The gzip level.
+        resample: Resample to the original grid (False: the prediction is already resampled).
+        resample_logits: Resample the logits once with `resample_to_original`, otherwise the binary
+            mask with `reshape_to_original`.
+    """
+    if resample:
+        prediction = restore_mask(prediction, resample_logits=resample_logits)
+    path = Path(output_dir) / f"{case_id(prediction)}.label.nii.gz"
+    path.write_bytes(encode_mask(prediction, compression_level=compression_level))
+    return path
+
+
+def encode_mask(mask: MetaTensor, compression_level: int = 1) -> bytes:
+    """Gzip compressed NIfTI file (`.nii.gz`) of a mask (1 x H x W x D) with its affine."""
+    image = nib.Nifti1Image(
+        mask[0].detach().cpu().numpy().astype(np.uint8),
+        np.asarray(mask.affine, dtype=np.float64),
+    )
+    return gzip.compress(image.to_bytes(), compresslevel=compression_level)
+
+
+def _load(batches: Iterable, output: queue.Queue, stop: threading.Event) -> None:
+    """Loader stage: put the batches (or the raised exception) into the bounded queue."""
+    try:
+        for batch in batches:
+            while not stop.is_set():
+                try:
+                    output.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+    except Exception as e:  # re-raised by the model stage
+        logger.exception("Loading a batch failed")
+        output.put(e)
+    output.put(_DONE)
+
+
+def run_pipeline(
+    model: nn.Module,
+    batches: Iterable,
+    inference_cfg: "trainer.InferenceConfig",
+    output_dir: str | Path,
+    cfg: PipelineConfig,
+    device: torch.device,
+    resample_logits: bool = True,
+) -> dict[str, float]:
+    """Predict and write the masks of all cases with overlapping stages.
+
+    A loader thread fills a bounded queue, the model stage runs the inference continuously and a
+    pool of writers resamples the predictions to the original grid and writes the compressed files.
+
+    Returns:
+        The number of cases, the total time and the throughput in cases per minute.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    executor_cls: type[Executor] = ProcessPoolExecutor if cfg.writer_processes else ThreadPoolExecutor
+    loaded = queue.Queue(maxsize=cfg.prefetch)
+    stop = threading.Event()
+    loader = threading.Thread(target=_load, args=(batches, loaded, stop), name="pipeline_loader", daemon=True)
+    pending: deque[Future] = deque()
+    num_cases = 0
+    start = time.perf_counter()
+
+    model.to(device)
+    model.eval()
+    loader.start()
+    try:
+        with executor_cls(max_workers=cfg.num_writers) as writers, tqdm(desc="Inference", unit="case") as progress:
+            while (batch := loaded.get()) is not _DONE:
+                if isinstance(batch, Exception):
+                    raise batch
+                images = batch.to(device, non_blocking=True)
+                with torch.no_grad():
+                    if resample_logits:
+                        output = trainer.inference(images=images, model=model, cfg=inference_cfg)
+                    else:
+                        output = trainer.predict_mask(images=images, model=model, cfg=inference_cfg)
+
+                    for j in range(output.shape[0]):
+                        prediction = output[j]
+                        if cfg.resample_on_device and resample_logits:
+                            prediction = resample_to_original(prediction, threshold=0.5, device=device)
+                        # only compact copies leave the model stage
+                        prediction = prediction.cpu() if prediction.dtype == torch.uint8 else prediction.half().cpu()
+
+                        while len(pending) >= cfg.max_pending:
+                            progress.set_postfix(last=pending.popleft().result().name)
+                            progress.update()
+                        pending.append(
+                            writers.submit(
+                                write_case,
+                                prediction,
+                                output_dir,
+                                compression_level=cfg.compression_level,
+                                resample=not (cfg.resample_on_device and resample_logits),
+                                resample_logits=resample_logits,
+                            )
+                        )
+                        num_cases += 1
+                del output, images
+
+            while pending:
+                progress.set_postfix(last=pending.popleft().result().name)
+                progress.update()
+    finally:
+        stop.set()
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "cases": num_cases,
+        "seconds": elapsed,
+        "cases_per_minute": 60 * num_cases / elapsed if elapsed > 0 else 0.0,
+    }
+    logger.info("%d cases in %.1f s (%.2f cases per minute)", num_cases, elapsed, stats["cases_per_minute"])
+    return stats
@@ -0,0 +1,163 @@
+import copy
+import json
+import logging
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import hydra
+import torch
+from hydra.core.config_store import ConfigStore
+from omegaconf import MISSING, OmegaConf
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from ml4mip import trainer
+from ml4mip.dataset import NiftiDataset, TransformType, get_transform
+from ml4mip.models import ModelConfig, ModelType, get_model
+from ml4mip.utils.metrics import ConfusionMetric
+
+logger = logging.getLogger(__name__)
+
+# models built by `get_model` the quantization is tested with
+QUANTIZABLE_MODEL_TYPES = (
+    ModelType.UNET,
+    ModelType.UNETMONAI1,
+    ModelType.UNETMONAI2,
+    ModelType.UNETMONAI2_LEAKYRELU,
+    ModelType.UNETMONAI3,
+)
+
+
+@dataclass
+class QuantizationConfig:
+    model: ModelConfig = field(default_factory=ModelConfig)
+    inference: trainer.InferenceConfig = field(default_factory=trainer.InferenceConfig)
+    data_dir: str = MISSING
+    # TorchScript file of the quantized model, load it with `model_type=quantized base_model_jit_path=...`
+    output: str = MISSING
+    # quantized engine, "x86" (fbgemm + onednn) or "qnnpack" for ARM
+    backend: str = "x86"
+    # cases of the training split the activation ranges are observed on
+    num_calibration_cases: int = 8
+    calibration_patches_per_case: int = 4
+    calibration_patch_size: tuple[int, int, int] = (96, 96, 96)
+    # cases of the validation split the accuracy and speed are compared on
+    num_eval_cases: int = 4
+    num_threads: int | None = None
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_quantization_config",
+    node=QuantizationConfig,
+)
+
+
+def quantize_model(
+    model: nn.Module,
+    calibration_batches: Iterable[torch.Tensor],
+    backend: str = "x86",
+) -> nn.Module:
+    """Post-training static INT8 quantization of a convolutional model.
+
+    The model is traced with FX, conv/batch norm/activation sequences are fused, observers record
+    the activation ranges on the calibration batches and the model is converted to quantized
+    kernels with per-channel weights. The returned model takes and returns float tensors (CPU).
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+    batches = iter(calibration_batches)
+    first = next(batches, None)
+    if first is None:
+        msg = "At least one calibration batch is required."
+        raise ValueError(msg)
+
+    # plain tensors for the tracing and the observers (no MetaTensor)
+    first = first.as_subclass(torch.Tensor).cpu().float()
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs=(first,))
+    num_batches = 0
+    with torch.no_grad():
+        for images in (first, *batches):
+            prepared(images.as_subclass(torch.Tensor).cpu().float())
+            num_batches += 1
+    logger.info("Calibrated on %d batches", num_batches)
+    return convert_fx(prepared)
+
+
+def save_quantized_model(model: nn.Module, path: str | Path, example_inputs: torch.Tensor) -> None:
+    """Save a quantized model as TorchScript, it is loaded by `get_model` with `ModelType.QUANTIZED`."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with torch.no_grad():
+        torch.jit.save(torch.jit.trace(model, example_inputs.cpu().float()), str(path))
+
+
+def calibration_batches(
+    dataset: NiftiDataset, num_cases: int, patches_per_case: int
+) -> Iterable[torch.Tensor]:
+    """Batches of the randomly cropped patches of the first cases."""
+    for idx in range(min(num_cases, len(dataset))):
+        patches = [dataset[idx][0] for _ in range(patches_per_case)]
+        yield torch.stack(patches)
+
+
+def compare_models(
+    models: dict[str, nn.Module],
+    dataset: NiftiDataset,
+    inference_cfg: trainer.InferenceConfig,
+    num_cases: int,
+) -> dict[str, float]:
+    """Dice against the masks and the CPU throughput (cases per hour) of each model."""
+    report = {}
+    for name, model in models.items():
+        metric = ConfusionMetric(scores=("dice",))
+        seconds = 0.0
+        num = min(num_cases, len(dataset))
+        for idx in range(num):
+            image, mask = dataset[idx]
+            start = time.perf_counter()
+            with torch.no_grad():
+                output = trainer.inference(image[None], model, inference_cfg)
+            seconds += time.perf_counter() - start
+            metric(y_pred=(torch.sigmoid(output) > 0.5).float(), y=mask[None])
+        report[f"dice_{name}"] = metric.aggregate()["dice"]
+        report[f"cases_per_hour_{name}"] = 3600 * num / seconds if seconds > 0 else 0.0
+    return report
+
+
+@hydra.main(version_base=None, config_name="base_quantization_config")
+def main(cfg: QuantizationConfig) -> None:
+    logger.info(OmegaConf.to_yaml(cfg))
+    cfg = OmegaConf.to_object(cfg)
+    if cfg.num_threads is not None:
+        torch.set_num_threads(cfg.num_threads)
+    if cfg.model.model_type not in QUANTIZABLE_MODEL_TYPES:
+        msg = f"Quantization of {cfg.model.model_type} is not supported, use one of {QUANTIZABLE_MODEL_TYPES}."
+        raise ValueError(msg)
+
+    model = get_model(cfg.model).cpu().eval()
+    calibration_ds = NiftiDataset(
+        cfg.data_dir,
+        transform=get_transform(TransformType.PATCH_POS_CENTER, size=cfg.calibration_patch_size),
+        train=True,
+    )
+    quantized = quantize_model(
+        model,
+        calibration_batches(calibration_ds, cfg.num_calibration_cases, cfg.calibration_patches_per_case),
+        backend=cfg.backend,
+    )
+    save_quantized_model(quantized, cfg.output, torch.rand(1, 1, *cfg.calibration_patch_size))
+    logger.info("Quantized model written to %s", cfg.output)
+
+    # the saved model is compared, as it will be loaded for the inference
+    int8 = get_model(ModelConfig(model_type=ModelType.QUANTIZED, base_model_jit_path=cfg.output))
+    eval_ds = NiftiDataset(cfg.data_dir, transform=get_transform(TransformType.STD), train=False)
+    report = compare_models({"fp32": model, "int8": int8}, eval_ds, cfg.inference, cfg.num_eval_cases)
+    report["dice_delta"] = report["dice_int8"] - report["dice_fp32"]
+    report["speedup"] = report["cases_per_hour_int8"] / report["cases_per_hour_fp32"]
+    logger.info("\n%s", json.dumps(report, indent=4))
+
+    with Path(cfg.output).with_suffix(".json").open("w") as f:
+        json.dump(report, f, indent=4)
@@ -0,0 +1,434 @@
+import contextlib
+import json
+import logging
+import queue
+import socketserver
+import statistics
+import tempfile
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import hydra
+import torch
+from hydra.core.config_store import ConfigStore
+from monai.data import MetaTensor, list_data_collate
+from monai.transforms import LoadImage
+from omegaconf import OmegaConf
+from torch import nn
+
+from ml4mip import trainer
+from ml4mip.dataset import get_inference_transform
+from ml4mip.models import ModelConfig, get_model
+from ml4mip.pipeline import encode_mask, restore_mask
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ServerConfig:
+    model: ModelConfig = field(default_factory=ModelConfig)
+    inference: trainer.InferenceConfig = field(default_factory=trainer.InferenceConfig)
+    host: str = "127.0.0.1"
+    port: int = 8765
+    # serve on a unix socket instead of host:port
+    socket_path: str | None = None
+    # requests arriving within the latency budget of the first one are predicted in one batch
+    max_batch_size: int = 4
+    max_wait_ms: float = 20.0
+    # requests in progress (loading, preprocessing, waiting for the model), further requests are rejected (503)
+    max_queue: int = 32
+    # JSON requests may only read images below input_dir and write masks below output_dir (unset: no paths)
+    input_dir: str | None = None
+    output_dir: str | None = None
+    # see `RunInferenceConfig.resample_logits`
+    resample_logits: bool = True
+    compression_level: int = 1
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_server_config",
+    node=ServerConfig,
+)
+
+
+@dataclass
+class _Request:
+    image: MetaTensor
+    future: Future = field(default_factory=Future)
+    submitted: float = field(default_factory=time.perf_counter)
+
+
+class InferenceServer:
+    """Keep a model warm and predict the submitted images in micro batches.
+
+    A single worker thread owns the model. It waits for a request, collects further requests of the
+    same shape until the batch is full or `max_wait_ms` passed since the first one was submitted,
+    and runs `trainer.inference` on the batch. The preprocessing and the resampling to the original
+    grid run in the calling threads, so they overlap with the model.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        inference_cfg: trainer.InferenceConfig,
+        device: torch.device | None = None,
+        max_batch_size: int = 4,
+        max_wait_ms: float = 20.0,
+        max_queue: int = 32,
+        resample_logits: bool = True,
+        compression_level: int = 1,
+        transform: Callable | None = None,
+    ):
+        self.device = device if device is not None else torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = model.to(self.device).eval()
+        self.inference_cfg = inference_cfg
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.resample_logits = resample_logits
+        self.compression_level = compression_level
+        self.transform = transform if transform is not None else get_inference_transform()
+        self.loader = LoadImage(ensure_channel_first=True)
+
+        self._requests: queue.Queue[_Request | None] = queue.Queue(maxsize=max_queue)
+        # admission of the predict calls, taken before the (memory intensive) loading and preprocessing
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._deferred: deque[_Request] = deque()
+        # set by the worker once the stop request was received
+        self._closing = False
+        # set by `close`, new requests are rejected
+        self._closed = False
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=1000)
+        self._counts = {"requests": 0, "batches": 0, "batched_requests": 0, "errors": 0, "rejected": 0}
+        self._started = time.perf_counter()
+        self._worker = threading.Thread(target=self._run, name="inference_server", daemon=True)
+        self._worker.start()
+
+    def submit(self, image: MetaTensor) -> Future:
+        """Queue a preprocessed image (C x H x W x D), the future returns the network output.
+
+        Raises:
+            queue.Full: If `max_queue` requests are waiting.
+            RuntimeError: If the server is closed.
+        """
+        request = _Request(image)
+        # queued under the lock, so no request is queued behind the stop request of `close`
+        with self._lock:
+            if self._closed:
+                msg = "The inference server is closed."
+                raise RuntimeError(msg)
+            try:
+                self._requests.put_nowait(request)
+            except queue.Full:
+                self._counts["rejected"] += 1
+                raise
+        return request.future
+
+    @contextlib.contextmanager
+    def _admitted(self):
+        """Hold one of the `max_queue` slots until the prediction is done.
+
+        Raises:
+            queue.Full: If `max_queue` predictions are in progress.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counts["rejected"] += 1
+            msg = "Too many requests in progress."
+            raise queue.Full(msg)
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _predict(self, load: Callable[[], MetaTensor]) -> MetaTensor:
+        start = time.perf_counter()
+        try:
+            prediction = self.submit(self.transform(load())).result()
+            mask = restore_mask(prediction, resample_logits=self.resample_logits)
+        except queue.Full:
+            # counted as rejected
+            raise
+        except Exception:
+            with self._lock:
+                self._counts["errors"] += 1
+            raise
+        with self._lock:
+            self._counts["requests"] += 1
+            self._latencies.append(time.perf_counter() - start)
+        return mask
+
+    def predict(self, image: MetaTensor) -> MetaTensor:
+        """Predict the binary mask of a loaded image on its original grid."""
+        with self._admitted():
+            return self._predict(lambda: image)
+
+    def predict_file(self, path: str | Path) -> MetaTensor:
+        with self._admitted():
+            return self._predict(lambda: self.loader(path))
+
+    def predict_bytes(self, data: bytes, suffix: str = ".nii.gz") -> MetaTensor:
+        """Predict the mask of an image given as the content of a NIfTI file."""
+        with self._admitted(), tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / f"request{suffix}"
+            path.write_bytes(data)
+            return self._predict(lambda: self.loader(path))
+
+    def metrics(self) -> dict[str, float]:
+        """Queue depth, batching and latency (predict calls, incl. pre- and postprocessing) statistics."""
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = sorted(self._latencies)
+        metrics = {
+            **counts,
+            "queue_depth": self._requests.qsize() + len(self._deferred),
+            "mean_batch_size": counts["batched_requests"] / counts["batches"] if counts["batches"] else 0.0,
+            "uptime_s": time.perf_counter() - self._started,
+        }
+        if latencies:
+            metrics["latency_ms_mean"] = 1000 * statistics.mean(latencies)
+            metrics["latency_ms_p50"] = 1000 * latencies[len(latencies) // 2]
+            metrics["latency_ms_p95"] = 1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        return metrics
+
+    def close(self) -> None:
+        """Predict the queued requests and stop the worker."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._requests.put(None)
+        self._worker.join()
+
+    def _next_batch(self) -> list[_Request] | None:
+        if self._deferred:
+            first = self._deferred.popleft()
+        elif self._closing or (first := self._requests.get()) is None:
+            return None
+        batch = [first]
+        for request in list(self._deferred):
+            if len(batch) < self.max_batch_size and request.image.shape == first.image.shape:
+                self._deferred.remove(request)
+                batch.append(request)
+        while len(batch) < self.max_batch_size and not self._closing:
+            # the latency budget starts with the submission of the first request
+            timeout = first.submitted + self.max_wait - time.perf_counter()
+            try:
+                request = self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # predict the deferred requests before stopping
+                self._closing = True
+            elif request.image.shape != first.image.shape:
+                self._deferred.append(request)
+            else:
+                batch.append(request)
+        return batch
+
+    def _run(self) -> None:
+        while (batch := self._next_batch()) is not None:
+            try:
+                images = list_data_collate([request.image for request in batch]).to(self.device)
+                with torch.no_grad():
+                    if self.resample_logits:
+                        output = trainer.inference(images=images, model=self.model, cfg=self.inference_cfg)
+                    else:
+                        output = trainer.predict_mask(images=images, model=self.model, cfg=self.inference_cfg)
+                for j, request in enumerate(batch):
+                    prediction = output[j]
+                    prediction = prediction.cpu() if prediction.dtype == torch.uint8 else prediction.half().cpu()
+                    request.future.set_result(prediction)
+            except Exception as e:  # raised in the requesting threads
+                logger.exception("Inference of a batch of %d requests failed", len(batch))
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+            with self._lock:
+                self._counts["batches"] += 1
+                self._counts["batched_requests"] += len(batch)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """HTTP interface of an `InferenceServer`.
+
+    - `GET /health`, `GET /metrics`: JSON.
+    - `POST /predict` with a NIfTI file (`application/octet-stream`): returns the mask as `.nii.gz`.
+    - `POST /predict` with JSON `{"path": ..., "output": ...}`: predicts the image at `path` (within the
+      input directory of the server) and writes the mask to `output` (within its output directory),
+      or returns it if no output is given.
+    """
+
+    server: "HTTPInferenceServer | UnixInferenceServer"
+
+    def do_GET(self) -> None:
+        match self.path:
+            case "/health":
+                self._send_json({"status": "ok"})
+            case "/metrics":
+                self._send_json(self.server.inference.metrics())
+            case _:
+                self._send_json({"error": f"Unknown path: {self.path}"}, status=404)
+
+    def do_POST(self) -> None:
+        if self.path != "/predict":
+            self._send_json({"error": f"Unknown path: {self.path}"}, status=404)
+            return
+        inference = self.server.inference
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        output = None
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                request = json.loads(body)
+                path = resolve_within(request["path"], self.server.input_dir)
+                if request.get("output") is not None:
+                    output = resolve_within(request["output"], self.server.output_dir)
+                mask = inference.predict_file(path)
+            else:
+                # a gzip stream starts with 0x1f8b
+                mask = inference.predict_bytes(body, suffix=".nii.gz" if body[:2] == b"\x1f\x8b" else ".nii")
+        except queue.Full:
+            self._send_json({"error": "Too many queued requests"}, status=503)
+            return
+        except PermissionError as e:
+            self._send_json({"error": str(e)}, status=403)
+            return
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            self._send_json({"error": repr(e)}, status=400)
+            return
+        except Exception as e:  # reported to the client
+            logger.exception("Prediction failed")
+            self._send_json({"error": repr(e)}, status=500)
+            return
+
+        data = encode_mask(mask, compression_level=inference.compression_level)
+        if output is not None:
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.write_bytes(data)
+            self._send_json({"output": str(output)})
+        else:
+            self._send(data, "application/gzip")
+
+    def _send_json(self, content: dict, status: int = 200) -> None:
+        self._send(json.dumps(content).encode(), "application/json", status=status)
+
+    def _send(self, data: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, message_format: str, *args) -> None:
+        logger.debug("%s - %s", self.address_string(), message_format % args)
+
+
+def resolve_within(path: str | Path, directory: str | Path | None) -> Path:
+    """Resolve a path of a request (relative to `directory`), it must not leave the directory.
+
+    Raises:
+        PermissionError: If no directory is configured or the path is outside of it.
+    """
+    if directory is None:
+        msg = "File paths are not enabled on this server."
+        raise PermissionError(msg)
+    base = Path(directory).resolve()
+    resolved = (base / path).resolve()
+    if not resolved.is_relative_to(base):
+        msg = f"{path} is outside of {base}."
+        raise PermissionError(msg)
+    return resolved
+
+
+class HTTPInferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        inference: InferenceServer,
+        input_dir: str | Path | None = None,
+        output_dir: str | Path | None = None,
+    ):
+        super().__init__(address, _Handler)
+        self.inference = inference
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+
+
+class UnixInferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        path: str | Path,
+        inference: InferenceServer,
+        input_dir: str | Path | None = None,
+        output_dir: str | Path | None = None,
+    ):
+        Path(path).unlink(missing_ok=True)
+        super().__init__(str(path), _Handler)
+        self.inference = inference
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+
+
+def make_server(
+    inference: InferenceServer,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: str | Path | None = None,
+    input_dir: str | Path | None = None,
+    output_dir: str | Path | None = None,
+) -> HTTPInferenceServer | UnixInferenceServer:
+    """HTTP server of an `InferenceServer`, on a unix socket if a path is given (port 0: any free port).
+
+    JSON requests may only read below `input_dir` and write below `output_dir`.
+    """
+    if socket_path is not None:
+        return UnixInferenceServer(socket_path, inference, input_dir=input_dir, output_dir=output_dir)
+    return HTTPInferenceServer((host, port), inference, input_dir=input_dir, output_dir=output_dir)
+
+
+@hydra.main(version_base=None, config_name="base_server_config")
+def main(cfg: ServerConfig) -> None:
+    logger.info(OmegaConf.to_yaml(cfg))
+    cfg = OmegaConf.to_object(cfg)
+
+    inference = InferenceServer(
+        get_model(cfg.model),
+        cfg.inference,
+        max_batch_size=cfg.max_batch_size,
+        max_wait_ms=cfg.max_wait_ms,
+        max_queue=cfg.max_queue,
+        resample_logits=cfg.resample_logits,
+        compression_level=cfg.compression_level,
+    )
+    server = make_server(
+        inference,
+        host=cfg.host,
+        port=cfg.port,
+        socket_path=cfg.socket_path,
+        input_dir=cfg.input_dir,
+        output_dir=cfg.output_dir,
+    )
+    address = cfg.socket_path or f"http://{cfg.host}:{server.server_address[1]}"
+    logger.info("Serving on %s", address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.server_close()
+        inference.close()
@@ -0,0 +1,487 @@
+import functools
+import itertools
+import math
+import tempfile
+import time
+from collections.abc import Callable, Iterator, Sequence
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from monai.data import MetaTensor
+from monai.losses import DiceCELoss, DiceLoss
+from torch import nn
+
+from ml4mip.loss import split_target_skeleton
+from ml4mip.utils.metrics import MetricsManager, confusion_counts
+
+if TYPE_CHECKING:
+    from ml4mip.trainer import InferenceConfig
+
+
+class BlendMode(Enum):
+    # average the overlapping windows
+    CONSTANT = "constant"
+    # weight the voxels of each window by a gaussian around its center
+    GAUSSIAN = "gaussian"
+
+
+def window_starts(size: int, roi: int, overlap: float) -> list[int]:
+    """Start positions of the windows along an axis, as in MONAI's `sliding_window_inference`."""
+    interval = roi if roi == size else max(int(roi * (1 - overlap)), 1)
+    return sorted({min(i * interval, size - roi) for i in range(math.ceil(size / interval))})
+
+
+@functools.lru_cache(maxsize=16)
+def importance_map(
+    roi_size: tuple[int, ...],
+    blend: BlendMode,
+    sigma_scale: float,
+    device: torch.device,
+    dtype: torch.dtype,
+) -> torch.Tensor:
+    """Weights of the voxels of a window for the stitching, cached per window size and device.
+
+    The gaussian has a standard deviation of `sigma_scale` times the window size per axis, it's
+    normalized to 1 at the center and clamped at 1e-3 so the borders still contribute.
+    """
+    if blend == BlendMode.CONSTANT:
+        return torch.ones(roi_size, device=device, dtype=dtype)
+    weights = None
+    for roi in roi_size:
+        x = torch.arange(roi, dtype=torch.float64) - (roi - 1) / 2
+        gaussian = torch.exp(-0.5 * (x / (sigma_scale * roi)) ** 2)
+        weights = gaussian if weights is None else weights[..., None] * gaussian
+    weights = (weights / weights.max()).clamp(min=1e-3)
+    return weights.to(device=device, dtype=dtype)
+
+
+def memmap_tensor(shape: Sequence[int], dtype: torch.dtype, directory: str | Path | None = None) -> torch.Tensor:
+    """Zero initialized CPU tensor backed by a memory-mapped temporary file.
+
+    The file has no name and is removed by the OS once the tensor is freed.
+    """
+    with tempfile.TemporaryFile(dir=directory) as f:
+        array = np.memmap(f, dtype=torch.empty(0, dtype=dtype).numpy().dtype, mode="w+", shape=tuple(shape))
+    return torch.from_numpy(array)
+
+
+def copy_meta(output: torch.Tensor, reference: torch.Tensor) -> torch.Tensor:
+    """Attach the meta data of a MetaTensor reference (e.g. the input images) to the output."""
+    if not isinstance(reference, MetaTensor):
+        return output
+    output = MetaTensor(output, meta=reference.meta, applied_operations=reference.applied_operations)
+    output.is_batch = reference.is_batch
+    return output
+
+
+def _pad_to_roi(
+    inputs: torch.Tensor, roi_size: Sequence[int]
+) -> tuple[torch.Tensor, list[int], list[int]]:
+    """Pad inputs smaller than the window symmetrically (non-positive window sizes span the axis).
+
+    Returns:
+        The padded inputs, the window size and the padding before each spatial axis.
+    """
+    spatial_size = inputs.shape[2:]
+    roi_size = [roi if roi > 0 else size for roi, size in zip(roi_size, spatial_size, strict=True)]
+    diffs = [max(roi - size, 0) for roi, size in zip(roi_size, spatial_size, strict=True)]
+    if any(diffs):
+        pad = []
+        for diff in reversed(diffs):
+            pad.extend([diff // 2, diff - diff // 2])
+        inputs = F.pad(inputs, pad)
+    return inputs, roi_size, [diff // 2 for diff in diffs]
+
+
+def _window_region_counts(region: torch.Tensor, starts: list[list[int]], roi_size: list[int]) -> torch.Tensor:
+    """Number of region voxels (of any sample) in every window of the grid of `starts`.
+
+    The first axis is summed per window position, the others with prefix sums, so the memory stays
+    at the size of a few planes.
+    """
+    region = region.amax(dim=(0, 1))
+    counts = torch.stack([region[start : start + roi_size[0]].sum(dim=0, dtype=torch.int32) for start in starts[0]])
+    for axis in range(1, counts.ndim):
+        cumsum = counts.cumsum(dim=axis, dtype=torch.int32)
+        cumsum = torch.cat([torch.zeros_like(cumsum.narrow(axis, 0, 1)), cumsum], dim=axis)
+        index = torch.tensor(starts[axis], device=counts.device)
+        counts = cumsum.index_select(axis, index + roi_size[axis]) - cumsum.index_select(axis, index)
+    return counts
+
+
+class SlidingWindow:
+    """Sliding window inference with window skipping and weighted stitching.
+
+    The windows are placed as in MONAI's `sliding_window_inference` (including the padding of
+    small inputs). Windows without a voxel of the region of interest are skipped, by default the
+    region are the voxels above `skip_threshold` (e.g. the body instead of air and padding). The
+    windows of a batch are gathered and scattered with single indexing operations.
+
+    The windows are processed in slabs along the first axis of `order`, a slab is final (and
+    yielded by `stream`) as soon as no remaining window overlaps it.
+    """
+
+    def __init__(
+        self,
+        roi_size: Sequence[int],
+        sw_batch_size: int = 4,
+        overlap: float = 0.25,
+        blend: BlendMode = BlendMode.CONSTANT,
+        sigma_scale: float = 0.125,
+        order: Sequence[int] = (0, 1, 2),
+        skip_threshold: float | None = None,
+        skip_min_voxels: int = 1,
+        skip_fill: float = -20.0,
+        accumulate_dtype: torch.dtype | None = None,
+        memmap_dir: str | Path | None = None,
+    ):
+        """Initialize the sliding window.
+
+        Args:
+            roi_size: The window size.
+            sw_batch_size: Number of windows per model call.
+            overlap: Overlap of neighboring windows.
+            blend: Weighting of the overlapping windows.
+            sigma_scale: Standard deviation of the gaussian weights relative to the window size.
+            order: Spatial axes from the outermost to the innermost loop over the windows.
+            skip_threshold: Skip the windows with less than `skip_min_voxels` voxels above this
+                intensity (None: evaluate all windows).
+            skip_min_voxels: Minimum number of region voxels of an evaluated window.
+            skip_fill: Output of the voxels that aren't covered by an evaluated window.
+            accumulate_dtype: Data type of the stitching buffers and the output (default: the data type
+                of the model outputs), e.g. float16 halves their memory.
+            memmap_dir: Write the output slab by slab to a memory-mapped temporary file in this
+                directory (on the CPU) instead of allocating it in the memory of the inputs' device.
+        """
+        if sorted(order) != list(range(len(roi_size))):
+            msg = f"order must be a permutation of the spatial axes, got {order}"
+            raise ValueError(msg)
+        self.roi_size = tuple(roi_size)
+        self.sw_batch_size = sw_batch_size
+        self.overlap = overlap
+        self.blend = BlendMode(blend)
+        self.sigma_scale = sigma_scale
+        self.order = tuple(order)
+        self.skip_threshold = skip_threshold
+        self.skip_min_voxels = skip_min_voxels
+        self.skip_fill = skip_fill
+        self.accumulate_dtype = accumulate_dtype
+        self.memmap_dir = memmap_dir
+
+    @classmethod
+    def from_config(cls, cfg: "InferenceConfig") -> "SlidingWindow":
+        return cls(
+            roi_size=cfg.sw_size,
+            sw_batch_size=cfg.sw_batch_size,
+            overlap=cfg.sw_overlap,
+            blend=cfg.sw_blend,
+            sigma_scale=cfg.sw_sigma_scale,
+            order=cfg.sw_order,
+            skip_threshold=cfg.sw_skip_threshold,
+            skip_min_voxels=cfg.sw_skip_min_voxels,
+            skip_fill=cfg.sw_skip_fill,
+            accumulate_dtype=torch.float16 if cfg.sw_fp16_accumulation else None,
+            memmap_dir=cfg.sw_memmap_dir,
+        )
+
+    def stream(
+        self,
+        inputs: torch.Tensor,
+        predictor: Callable[[torch.Tensor], torch.Tensor],
+        region: torch.Tensor | None = None,
+        fill: torch.Tensor | None = None,
+        stats: dict[str, float] | None = None,
+    ) -> Iterator[tuple[tuple[slice, ...], torch.Tensor]]:
+        """Run the inference and yield the stitched output slab by slab.
+
+        Only a buffer of one window along the slab axis is kept instead of the whole output.
+
+        Args:
+            inputs: The images (BS x C x ...).
+            predictor: The model.
+            region: Evaluate only the windows with voxels of this mask (BS x 1 x ..., nonzero
+                inside) instead of the thresholded inputs.
+            fill: Output of the voxels that aren't covered by an evaluated window (BS x C_out x ...,
+                default: `skip_fill`).
+            stats: Filled with the number of evaluated windows (`sw_windows`), the fraction of the
+                skipped windows (`sw_skipped_windows`) and the throughput (`sw_windows_per_sec`).
+
+        Yields:
+            The position of the slab (spatial slices) and its output (BS x C_out x slab).
+        """
+        start_time = time.perf_counter()
+        # the meta data tracking of MetaTensors only slows down the indexing
+        inputs, region, fill = (
+            tensor.as_tensor() if isinstance(tensor, MetaTensor) else tensor for tensor in (inputs, region, fill)
+        )
+        spatial_size = inputs.shape[2:]
+        # work in the permuted orientation in which the slab axis comes first
+        perm = (0, 1, *(2 + axis for axis in self.order))
+        inverse = tuple(perm.index(dim) for dim in range(len(perm)))
+        if region is None and self.skip_threshold is not None:
+            region = (inputs > self.skip_threshold).any(dim=1, keepdim=True)
+        inputs, roi_size, pad_before = _pad_to_roi(inputs.permute(perm), [self.roi_size[a] for a in self.order])
+        if region is not None:
+            region, _, _ = _pad_to_roi(region.to(torch.uint8).permute(perm), roi_size)
+        if fill is not None:
+            fill, _, _ = _pad_to_roi(fill.permute(perm), roi_size)
+        size = [spatial_size[a] for a in self.order]
+        padded_size = inputs.shape[2:]
+        batch_size = inputs.shape[0]
+        device = inputs.device
+
+        starts = [window_starts(length, roi, self.overlap) for length, roi in zip(padded_size, roi_size, strict=True)]
+        windows = torch.tensor(list(itertools.product(*starts)), device=device)
+        if region is not None:
+            selected = _window_region_counts(region, starts, roi_size).flatten() >= self.skip_min_voxels
+            # at least one window is evaluated to determine the output channels
+            selected[0] = True
+        else:
+            selected = torch.ones(len(windows), dtype=torch.bool, device=device)
+        # a single synchronization for all windows
+        selected = selected.tolist()
+        windows_per_slab = len(windows) // len(starts[0])
+
+        offsets = [torch.arange(roi, device=device) for roi in roi_size]
+        origin = 0
+        output = count = weights = None
+        for index in range(len(starts[0])):
+            slab_windows = [
+                i for i in range(index * windows_per_slab, (index + 1) * windows_per_slab) if selected[i]
+            ]
+            for first in range(0, len(slab_windows), self.sw_batch_size):
+                chunk = windows[slab_windows[first : first + self.sw_batch_size]]
+                # voxel indices of the windows along each axis (windows x size)
+                index0, index1, index2 = (chunk[:, axis, None] + offsets[axis] for axis in range(3))
+                crops = inputs[:, :, index0[:, :, None, None], index1[:, None, :, None], index2[:, None, None, :]]
+                crops = crops.movedim(2, 0).reshape(len(chunk) * batch_size, inputs.shape[1], *roi_size)
+                predictions = predictor(crops.permute(inverse)).permute(perm)
+                if output is None:
+                    channels = predictions.shape[1]
+                    dtype = self.accumulate_dtype or predictions.dtype
+                    buffer_shape = (batch_size * channels, roi_size[0], *padded_size[1:])
+                    output = torch.zeros(buffer_shape, dtype=dtype, device=device)
+                    count = torch.zeros(buffer_shape[1:], dtype=dtype, device=device)
+                    weights = importance_map(tuple(roi_size), self.blend, self.sigma_scale, device, dtype)
+                values = (predictions.to(dtype) * weights).reshape(len(chunk), batch_size * channels, *roi_size)
+                local0 = index0 - origin
+                output.index_put_(
+                    (
+                        torch.arange(batch_size * channels, device=device)[:, None, None, None, None],
+                        local0[None, :, :, None, None],
+                        index1[None, :, None, :, None],
+                        index2[None, :, None, None, :],
+                    ),
+                    values.movedim(0, 1),
+                    accumulate=True,
+                )
+                count.index_put_(
+                    (local0[:, :, None, None], index1[:, None, :, None], index2[:, None, None, :]),
+                    weights.expand(len(chunk), *roi_size),
+                    accumulate=True,
+                )
+
+            # everything before the next window is final
+            end = starts[0][index + 1] if index + 1 < len(starts[0]) else padded_size[0]
+            final = end - origin
+            lower = max(origin, pad_before[0])
+            upper = min(end, pad_before[0] + size[0])
+            if lower < upper:
+                crop = (
+                    slice(lower - origin, upper - origin),
+                    *(slice(pad_before[i], pad_before[i] + size[i]) for i in range(1, len(size))),
+                )
+                slab = output[(slice(None), *crop)] / count[crop].clamp(min=1e-8)
+                slab = slab.reshape(batch_size, channels, *slab.shape[1:])
+                if fill is None:
+                    slab = torch.where(count[crop] > 0, slab, self.skip_fill)
+                else:
+                    fill_crop = (slice(lower, upper), *crop[1:])
+                    slab = torch.where(
+                        count[crop] > 0, slab, fill[(slice(None), slice(None), *fill_crop)].to(dtype)
+                    )
+                position = [slice(None)] * len(size)
+                position[self.order[0]] = slice(lower - pad_before[0], upper - pad_before[0])
+                yield tuple(position), slab.permute(inverse)
+
+            # shift the buffer to the next window
+            output = torch.cat([output[:, final:], torch.zeros_like(output[:, :final])], dim=1)
+            count = torch.cat([count[final:], torch.zeros_like(count[:final])], dim=0)
+            origin = end
+
+        if stats is not None:
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            evaluated = sum(selected)
+            stats["sw_windows"] = evaluated
+            stats["sw_skipped_windows"] = 1 - evaluated / len(selected)
+            stats["sw_windows_per_sec"] = evaluated / (time.perf_counter() - start_time)
+
+    def __call__(
+        self,
+        inputs: torch.Tensor,
+        predictor: Callable[[torch.Tensor], torch.Tensor],
+        region: torch.Tensor | None = None,
+        fill: torch.Tensor | None = None,
+        stats: dict[str, float] | None = None,
+    ) -> torch.Tensor:
+        """Run the inference and return the stitched output (BS x C_out x ...), see `stream`.
+
+        The output keeps the meta data of MetaTensor inputs.
+        """
+        output = None
+        for position, slab in self.stream(inputs, predictor, region=region, fill=fill, stats=stats):
+            if output is None:
+                shape = (*slab.shape[:2], *inputs.shape[2:])
+                if self.memmap_dir is not None:
+                    output = memmap_tensor(shape, slab.dtype, self.memmap_dir)
+                else:
+                    output = torch.zeros(shape, dtype=slab.dtype, device=slab.device)
+            output[(slice(None), slice(None), *position)] = slab.to(output.device)
+        return copy_meta(output, inputs)
+
+
+class StreamingLoss:
+    """Dice (and BCE) loss accumulated from its per sample sums over the slabs of a volume.
+
+    Mirrors MONAI's `DiceLoss` and `DiceCELoss` (single channel, mean reduction), the losses of the
+    `dice` and `ce_dice` loss types.
+    """
+
+    def __init__(
+        self,
+        sigmoid: bool = True,
+        squared_pred: bool = False,
+        jaccard: bool = False,
+        smooth_nr: float = 1e-5,
+        smooth_dr: float = 1e-5,
+        batch: bool = False,
+        lambda_dice: float = 1.0,
+        lambda_ce: float = 0.0,
+        pos_weight: torch.Tensor | None = None,
+    ):
+        self.sigmoid = sigmoid
+        self.squared_pred = squared_pred
+        self.jaccard = jaccard
+        self.smooth_nr = smooth_nr
+        self.smooth_dr = smooth_dr
+        self.batch = batch
+        self.lambda_dice = lambda_dice
+        self.lambda_ce = lambda_ce
+        self.pos_weight = pos_weight
+        self.reset()
+
+    @classmethod
+    def from_loss(cls, loss_fn: nn.Module) -> "StreamingLoss":
+        match loss_fn:
+            case DiceCELoss():
+                kwargs = {
+                    "lambda_dice": loss_fn.lambda_dice,
+                    "lambda_ce": loss_fn.lambda_ce,
+                    "pos_weight": loss_fn.binary_cross_entropy.pos_weight,
+                }
+                dice = loss_fn.dice
+            case DiceLoss():
+                kwargs = {}
+                dice = loss_fn
+            case _:
+                msg = f"Streaming validation supports the dice and ce_dice losses, got {type(loss_fn).__name__}"
+                raise ValueError(msg)
+        if dice.reduction != "mean" or dice.softmax or dice.other_act is not None:
+            msg = "Streaming validation requires a dice loss with sigmoid and mean reduction"
+            raise ValueError(msg)
+        return cls(
+            sigmoid=dice.sigmoid,
+            squared_pred=dice.squared_pred,
+            jaccard=dice.jaccard,
+            smooth_nr=dice.smooth_nr,
+            smooth_dr=dice.smooth_dr,
+            batch=dice.batch,
+            **kwargs,
+        )
+
+    def reset(self) -> None:
+        self.intersection = self.pred_sum = self.target_sum = None
+        self.ce_sum = 0.0
+        self.num_voxels = 0
+
+    def update(self, logits: torch.Tensor, target: torch.Tensor) -> None:
+        """Add a slab of the logits (BS x C x ...) and the target."""
+        if logits.shape[1] != 1 and self.lambda_ce > 0:
+            msg = f"Streaming validation supports a single output channel, got {logits.shape[1]}"
+            raise ValueError(msg)
+        target = target.to(logits.dtype)
+        pred = torch.sigmoid(logits) if self.sigmoid else logits
+        axes = tuple(range(2, logits.ndim))
+        sums = (
+            torch.sum(pred * target, dim=axes, dtype=torch.float64),
+            torch.sum(pred * pred if self.squared_pred else pred, dim=axes, dtype=torch.float64),
+            torch.sum(target * target if self.squared_pred else target, dim=axes, dtype=torch.float64),
+        )
+        if self.intersection is None:
+            self.intersection, self.pred_sum, self.target_sum = sums
+        else:
+            self.intersection += sums[0]
+            self.pred_sum += sums[1]
+            self.target_sum += sums[2]
+        if self.lambda_ce > 0:
+            self.ce_sum += F.binary_cross_entropy_with_logits(
+                logits, target, pos_weight=self.pos_weight, reduction="sum"
+            ).double()
+            self.num_voxels += target.numel()
+
+    def compute(self) -> torch.Tensor:
+        intersection, pred_sum, target_sum = self.intersection, self.pred_sum, self.target_sum
+        if self.batch:
+            intersection, pred_sum, target_sum = intersection.sum(0), pred_sum.sum(0), target_sum.sum(0)
+        denominator = pred_sum + target_sum
+        if self.jaccard:
+            denominator = 2.0 * (denominator - intersection)
+        dice = 1.0 - (2.0 * intersection + self.smooth_nr) / (denominator + self.smooth_dr)
+        loss = self.lambda_dice * dice.mean()
+        if self.lambda_ce > 0:
+            loss = loss + self.lambda_ce * self.ce_sum / self.num_voxels
+        return loss.float()
+
+
+def streaming_validation_step(
+    images: torch.Tensor,
+    masks: torch.Tensor,
+    model: nn.Module,
+    loss: StreamingLoss,
+    metrics: MetricsManager,
+    window: SlidingWindow,
+    keep_mask: bool = True,
+) -> tuple[torch.Tensor, torch.Tensor | None, torch.Tensor]:
+    """Run sliding window inference and accumulate the loss and confusion counts slab by slab.
+
+    The full resolution logits are never materialized. Only a binary (uint8) prediction is kept if
+    `keep_mask` is set, for the metrics that need the whole volume (surface distances, clDice).
+
+    Returns:
+        The loss, the binary prediction (or None) and the target without the skeleton channels.
+    """
+    loss.reset()
+    counts = None
+    binary = None
+    for position, logits in window.stream(images, model):
+        if counts is None:
+            masks, _ = split_target_skeleton(logits, masks)
+        target = masks[(slice(None), slice(None), *position)]
+        loss.update(logits, target)
+
+        probs = torch.sigmoid(logits) if metrics.sigmoid else logits
+        slab = (probs > metrics.binary_threshold).to(torch.uint8)
+        slab_counts = confusion_counts(slab, target)
+        counts = slab_counts if counts is None else counts + slab_counts
+        if keep_mask:
+            if binary is None:
+                binary = torch.zeros((*logits.shape[:2], *masks.shape[2:]), dtype=torch.uint8, device=logits.device)
+            binary[(slice(None), slice(None), *position)] = slab
+
+    metrics.update_counts(counts, y_pred=binary, y=masks if keep_mask else None)
+    return loss.compute(), binary, masks
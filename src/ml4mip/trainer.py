@@ -1,24 +1,41 @@
 import cProfile
+import dataclasses
 import gc
 import logging
 import pstats
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import torch
 import torch.nn.functional as F
 from hydra.core.config_store import ConfigStore
-from monai.inferers import sliding_window_inference
 from torch import nn, optim
 from torch.profiler import ProfilerActivity, profile, record_function
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler
 from tqdm import tqdm
 
+from ml4mip.autotune import autotuned
 from ml4mip.dataset import GroupedNifitDataset
+from ml4mip.loss import compute_loss
+from ml4mip.sliding_window import (
+    BlendMode,
+    SlidingWindow,
+    StreamingLoss,
+    copy_meta,
+    streaming_validation_step,
+)
+from ml4mip.utils.checkpoint import CheckpointConfig, CheckpointManager
+from ml4mip.utils.distributed import all_reduce_metrics, is_main_process, unwrap_model
+from ml4mip.utils.inference_cache import InferenceCacheConfig, get_inference_cache
 from ml4mip.utils.logging import log_metrics
 from ml4mip.utils.metrics import MetricsManager
-from ml4mip.utils.torch import save_checkpoint
+from ml4mip.utils.profiling import ProfilerConfig, StepProfiler
+from ml4mip.utils.timing import PhaseTimer
+
+if TYPE_CHECKING:
+    from ml4mip.async_validation import AsyncValidator
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +51,8 @@ def train_one_epoch(
     metrics: MetricsManager,
     device: torch.device,
     batch_idx: int,
+    timer: PhaseTimer | None = None,
+    profiler: StepProfiler | None = None,
 ) -> float:
     """Train the model for one epoch.
 
@@ -43,59 +62,79 @@ def train_one_epoch(
         optimizer: The optimizer for training.
         loss_fn: The loss function.
         device: The device to run training on.
+        timer: Collects the duration of each phase of the training steps (optional).
+        profiler: Scheduled profiler that is stepped after every batch (optional).
 
     Returns:
         float: The average training loss for the epoch.
     """
+    timer = timer if timer is not None else PhaseTimer()
     model.to(device)
     model.train()
     epoch_loss = 0.0
     metrics.reset()
     batch_metric = metrics.copy()
     batch_metric.reset()
-    progress_bar = tqdm(train_loader, desc="Training", unit="batch")
+    progress_bar = tqdm(train_loader, desc="Training", unit="batch", disable=not is_main_process())
 
-    for batch in progress_bar:
-        images, masks = batch
-        images, masks = images.to(device), masks.to(device)
+    for batch in timer.time_iter(progress_bar, "data_wait"):
+        with timer.phase("host_to_device"):
+            images, masks = batch
+            images, masks = images.to(device), masks.to(device)
         optimizer.zero_grad()
-        outputs = model(images)
+        with timer.phase("forward"):
+            outputs = model(images)
+
+        with timer.phase("loss"):
+            # also drops the precomputed skeleton channels from the masks
+            loss, masks = compute_loss(loss_fn, outputs, masks)
 
         if outputs.shape != masks.shape:
             msg = f"Output shape: {outputs.shape} | Mask shape: {masks.shape}"
             logger.warning(msg)
 
-        loss = loss_fn(outputs, masks)
-        metrics(y_pred=outputs, y=masks)
-        batch_metric(y_pred=outputs, y=masks)
+        with timer.phase("metrics"):
+            metrics(y_pred=outputs, y=masks)
+            batch_metric(y_pred=outputs, y=masks)
 
         # Backward pass
-        loss.backward()
-        optimizer.step()
-
-        epoch_loss += loss.item()
-        batch_metrics = {
-            "loss": loss.item(),
-            **(batch_metric.aggregate()),
-        }
-        log_metrics(
-            "train_batch",
-            batch_metrics,
-            step=batch_idx,
-            logger=logger,
-        )
-        batch_idx += 1
-        batch_metric.reset()
-        progress_bar.set_postfix({"Batch Loss": loss.item()})
+        with timer.phase("backward"):
+            loss.backward()
+        with timer.phase("optimizer_step"):
+            optimizer.step()
+
+        with timer.phase("logging"):
+            epoch_loss += loss.item()
+            batch_metrics = {
+                "loss": loss.item(),
+                **(batch_metric.aggregate()),
+            }
+            log_metrics(
+                "train_batch",
+                batch_metrics,
+                step=batch_idx,
+                logger=logger,
+            )
+            batch_idx += 1
+            batch_metric.reset()
+            progress_bar.set_postfix({"Batch Loss": loss.item()})
+        timer.count(images)
 
         # run python garbage collection and empty gpu cache to prevent full memory training stops
-        gc.collect()
-        torch.cuda.empty_cache()
-
-    return {
-        "loss": epoch_loss / len(train_loader),
-        **(metrics.aggregate()),
-    }
+        with timer.phase("cleanup"):
+            gc.collect()
+            torch.cuda.empty_cache()
+
+        if profiler is not None:
+            profiler.step()
+
+    # average over all ranks when training with DDP (no-op otherwise)
+    return all_reduce_metrics(
+        {
+            "loss": epoch_loss / len(train_loader),
+            **(metrics.aggregate()),
+        }
+    )
 
 
 class InferenceMode(Enum):
@@ -103,6 +142,8 @@ class InferenceMode(Enum):
     RESCALE_BINARY = "rescale_binary"
     RESCALE_PROBS = "rescale_probs"
     RESCALE = "rescale_logits"  # by default rescale logits to original size
+    # sliding window only around the vessels found at low resolution
+    CASCADE = "cascade"
     STD = "standard"
 
 
@@ -112,7 +153,37 @@ class InferenceConfig:
     sw_size: tuple[int, int, int] = (96, 96, 96)
     sw_batch_size: int = 4
     sw_overlap: float = 0.25
+    # weighting of the overlapping windows
+    sw_blend: BlendMode = BlendMode.CONSTANT
+    # standard deviation of the gaussian weights relative to the window size
+    sw_sigma_scale: float = 0.125
+    # spatial axes from the outermost to the innermost loop over the windows
+    sw_order: tuple[int, int, int] = (0, 1, 2)
+    # skip the windows with less than sw_skip_min_voxels voxels above this intensity (null: evaluate all)
+    sw_skip_threshold: float | None = None
+    sw_skip_min_voxels: int = 1
+    # logit of the voxels that aren't covered by an evaluated window
+    sw_skip_fill: float = -20.0
+    # stitch and return the sliding window output in float16
+    sw_fp16_accumulation: bool = False
+    # write the sliding window output slab by slab to a memory-mapped temporary file in this directory
+    sw_memmap_dir: str | None = None
     model_input_size: tuple[int, int, int] = (96, 96, 96)
+    # validate sliding window inference slab by slab: the loss (dice, ce_dice) and the confusion counts
+    # are accumulated while the windows are stitched, the full resolution logits are never materialized
+    sw_streaming: bool = False
+    # keep a binary prediction of the whole volume for the metrics that need it (surface distances, clDice)
+    sw_streaming_keep_mask: bool = True
+    # cascade: probability threshold of the coarse (rescaled) prediction, low values favor recall
+    cascade_threshold: float = 0.3
+    # cascade: dilation of the coarse mask in voxels, the windows intersecting it are evaluated
+    cascade_dilation: int = 8
+    # replace sw_size and sw_batch_size by the values tuned for the model, device and precision
+    # (see `autotune`), the tuning runs on first use if the cache has no result
+    sw_autotune: bool = False
+    sw_autotune_cache: str | None = None
+    # reuse the outputs of previous runs with the same weights, config and input (not in streaming validation)
+    cache: InferenceCacheConfig = field(default_factory=InferenceCacheConfig)
 
 
 _cs = ConfigStore.instance()
@@ -122,26 +193,67 @@ _cs.store(
 )
 
 
+def _rescale_probs(images: torch.Tensor, model: nn.Module, model_input_size: tuple[int, int, int]) -> torch.Tensor:
+    """Predict the probabilities at the model input size and rescale them to the image size."""
+    # Rescale the input image to the model input size
+    rescaled_images = F.interpolate(
+        images,
+        size=model_input_size,
+        mode="trilinear",
+        align_corners=False,
+    )
+    rescaled_outputs = model(rescaled_images)
+    probs = torch.sigmoid(rescaled_outputs)
+    original_size = images.shape[2:]
+    return F.interpolate(
+        probs,
+        size=original_size,
+        mode="trilinear",
+        align_corners=False,
+    )
+
+
+def _autotune(cfg: InferenceConfig, model: nn.Module, device: torch.device) -> InferenceConfig:
+    if not cfg.sw_autotune or cfg.mode not in (InferenceMode.SLIDING_WINDOW, InferenceMode.CASCADE):
+        return cfg
+    result = autotuned(model, device, cache_path=cfg.sw_autotune_cache)
+    return dataclasses.replace(cfg, sw_size=result.sw_size, sw_batch_size=result.sw_batch_size)
+
+
 def inference(
     images: torch.Tensor,
     model: nn.Module,
     cfg: InferenceConfig,
+    stats: dict[str, float] | None = None,
 ) -> torch.Tensor:
+    """Run the inference of the configured mode.
+
+    Args:
+        images: The images (B, C, H, W, D).
+        model: The model.
+        cfg: The inference configuration.
+        stats: Filled with statistics of the inference (optional), the sliding window modes report
+            the evaluated and skipped windows and the windows per second (see `SlidingWindow.stream`).
+    """
+    cfg = _autotune(cfg, model, images.device)
+    if cfg.cache.enabled:
+        uncached = dataclasses.replace(cfg, cache=InferenceCacheConfig())
+        return get_inference_cache(cfg.cache)(
+            images,
+            model,
+            uncached,
+            infer=lambda inputs: inference(inputs, model, uncached, stats=stats),
+            # these modes return probabilities
+            logits=cfg.mode not in (InferenceMode.RESCALE_PROBS, InferenceMode.RESCALE_BINARY),
+            stats=stats,
+        )
     match cfg.mode:
         case InferenceMode.SLIDING_WINDOW:
-            # sliding_window_inference divides the input image into smaller overlapping windows
-            # of the specified size (sw_size). It processes each window independently, allowing
-            # for efficient inference on large images that may not fit in memory.
-            # The predictions from all windows are then stitched together to reconstruct
-            # the full-size output, averaging overlapping regions to ensure smooth transitions
-            # and reduce artifacts.
-            outputs = sliding_window_inference(
-                inputs=images,
-                roi_size=cfg.sw_size,
-                sw_batch_size=cfg.sw_batch_size,
-                predictor=model,
-                overlap=cfg.sw_overlap,
-            )
+            # The input image is divided into overlapping windows of the specified size (sw_size),
+            # which are processed independently (windows without foreground above sw_skip_threshold
+            # are skipped). The predictions are stitched together to reconstruct the full-size output,
+            # averaging (or gaussian weighting) overlapping regions to ensure smooth transitions.
+            outputs = SlidingWindow.from_config(cfg)(images, model, stats=stats)
         case InferenceMode.RESCALE:
             # Rescale the input image to the model input size
             rescaled_images = F.interpolate(
@@ -162,21 +274,23 @@ def inference(
                 align_corners=False,
             )
         case InferenceMode.RESCALE_PROBS:
-            # Rescale the input image to the model input size
-            rescaled_images = F.interpolate(
-                images,
-                size=cfg.model_input_size,
-                mode="trilinear",
-                align_corners=False,
+            outputs = _rescale_probs(images, model, cfg.model_input_size)
+        case InferenceMode.CASCADE:
+            coarse_probs = _rescale_probs(images, model, cfg.model_input_size)
+            # dilate the coarse mask, so the windows also cover vessels the coarse pass missed nearby
+            region = F.max_pool3d(
+                (coarse_probs[:, :1] >= cfg.cascade_threshold).float(),
+                kernel_size=2 * cfg.cascade_dilation + 1,
+                stride=1,
+                padding=cfg.cascade_dilation,
             )
-            rescaled_outputs = model(rescaled_images)
-            probs = torch.sigmoid(outputs)
-            original_size = images.shape[2:]
-            outputs = F.interpolate(
-                probs,
-                size=original_size,
-                mode="trilinear",
-                align_corners=False,
+            outputs = SlidingWindow.from_config(cfg)(
+                images,
+                model,
+                region=region,
+                # logits of the coarse probabilities, like the outputs of the windows
+                fill=torch.logit(coarse_probs, eps=1e-6),
+                stats=stats,
             )
         case InferenceMode.RESCALE_BINARY:
             rescaled_images = F.interpolate(
@@ -200,6 +314,28 @@ def inference(
     return outputs
 
 
+def predict_mask(
+    images: torch.Tensor,
+    model: nn.Module,
+    cfg: InferenceConfig,
+    threshold: float = 0.5,
+) -> torch.Tensor:
+    """Run the inference and threshold the outputs to a uint8 mask (keeps the meta data of the images).
+
+    The sliding window output is thresholded slab by slab, so the full resolution float output is
+    never materialized.
+    """
+    cfg = _autotune(cfg, model, images.device)
+    if cfg.mode != InferenceMode.SLIDING_WINDOW or cfg.cache.enabled:
+        return (inference(images, model, cfg) >= threshold).to(torch.uint8)
+    mask = None
+    for position, slab in SlidingWindow.from_config(cfg).stream(images, model):
+        if mask is None:
+            mask = torch.zeros((*slab.shape[:2], *images.shape[2:]), dtype=torch.uint8, device=slab.device)
+        mask[(slice(None), slice(None), *position)] = slab >= threshold
+    return copy_meta(mask, images)
+
+
 # --- VALIDATION FUNCTION ---
 @torch.no_grad()
 def validate(
@@ -209,6 +345,7 @@ def validate(
     metrics: MetricsManager,
     device: torch.device,
     inference_cfg: InferenceConfig,
+    timer: PhaseTimer | None = None,
 ) -> tuple[float, float]:
     """Validate the model on the validation dataset.
 
@@ -222,48 +359,100 @@ def validate(
         sw_size: Sliding window size for inference. If not None, use sliding window inference.
         sw_batch_size: Sliding window batch size. Default is 4.
         model_input_size: Used for rescale inference. Doesn't require Channel Dimension. (H, W, D)
+        timer: Collects the duration of each phase of the validation steps (optional).
 
     Returns:
         Average validation loss and Dice score.
     """
+    timer = timer if timer is not None else PhaseTimer()
+    # no gradients are synchronized here, so skip the DDP wrapper and its buffer broadcasts
+    model = unwrap_model(model)
     model.to(device)
     model.eval()
     val_loss = 0.0
     metrics.reset()
-    progress_bar = tqdm(val_loader, desc="Validation", unit="batch")
-
-    for batch in progress_bar:
-        images, masks = batch
-        images, masks = images.to(device), masks.to(device)
-        outputs = inference(
-            images=images,
-            model=model,
-            cfg=inference_cfg,
-        )
-        loss = loss_fn(outputs, masks)
-        val_loss += loss.item()
-        metrics(y_pred=outputs, y=masks)
+    progress_bar = tqdm(val_loader, desc="Validation", unit="batch", disable=not is_main_process())
+    streaming = inference_cfg.sw_streaming and inference_cfg.mode == InferenceMode.SLIDING_WINDOW
+    streaming_loss = StreamingLoss.from_loss(loss_fn) if streaming else None
+    # summed statistics of the inference, e.g. the skipped windows of the sliding window
+    inference_stats = {}
+
+    for batch in timer.time_iter(progress_bar, "data_wait"):
+        with timer.phase("host_to_device"):
+            images, masks = batch
+            images, masks = images.to(device), masks.to(device)
+        if streaming:
+            # loss and metrics are accumulated during the inference
+            with timer.phase("forward"):
+                loss, _, _ = streaming_validation_step(
+                    images,
+                    masks,
+                    model,
+                    loss=streaming_loss,
+                    metrics=metrics,
+                    window=SlidingWindow.from_config(inference_cfg),
+                    keep_mask=inference_cfg.sw_streaming_keep_mask,
+                )
+                val_loss += loss.item()
+            progress_bar.set_postfix({"Batch Loss": loss.item()})
+            timer.count(images)
+            continue
+        with timer.phase("forward"):
+            stats = {}
+            outputs = inference(
+                images=images,
+                model=model,
+                cfg=inference_cfg,
+                stats=stats,
+            )
+            for key, value in stats.items():
+                inference_stats[key] = inference_stats.get(key, 0.0) + value
+        with timer.phase("loss"):
+            loss, masks = compute_loss(loss_fn, outputs, masks)
+            val_loss += loss.item()
+        with timer.phase("metrics"):
+            metrics(y_pred=outputs, y=masks)
         progress_bar.set_postfix({"Batch Loss": loss.item()})
+        timer.count(images)
 
-    return {
-        "loss": val_loss / len(val_loader),
-        **(metrics.aggregate()),
-    }
-
+    return all_reduce_metrics(
+        {
+            "loss": val_loss / len(val_loader),
+            **(metrics.aggregate()),
+            **{key: value / len(val_loader) for key, value in inference_stats.items()},
+        }
+    )
+
+
+def profile_epoch(
+    train_fn,
+    *args,
+    epoch: int,
+    torch_profiling=False,
+    cpython_profiling=False,
+    profiler_cfg: ProfilerConfig | None = None,
+    **kwargs,
+):
+    """Profiles a training epoch using either torch profiler or cProfile.
+
+    With an enabled `profiler_cfg` only the scheduled windows of steps are recorded
+    (`train_fn` has to accept a `profiler` that is stepped after every batch).
+    """
+    if profiler_cfg is not None and profiler_cfg.enabled and epoch in profiler_cfg.epochs:
+        with StepProfiler.from_config(profiler_cfg, prefix=f"epoch_{epoch}_") as prof:
+            train_metrics = train_fn(*args, profiler=prof, **kwargs)
 
-def profile_epoch(train_fn, *args, torch_profiling=False, cpython_profiling=False, **kwargs):
-    """Profiles a training epoch using either torch profiler or cProfile."""
-    if torch_profiling:
+    elif torch_profiling:
         with profile(activities=activities, record_shapes=True) as prof, record_function("epoch"):
             train_metrics = train_fn(*args, **kwargs)
         logger.info(prof.key_averages().table())
-        prof.export_chrome_trace(f"trace_epoch_{kwargs['epoch']}.json")
+        prof.export_chrome_trace(f"trace_epoch_{epoch}.json")
 
     elif cpython_profiling:
         with cProfile.Profile() as pr:
             train_metrics = train_fn(*args, **kwargs)
         stats = pstats.Stats(pr)
-        stats.dump_stats(f"cpython_trace_epoch_{kwargs['epoch']}.prof")
+        stats.dump_stats(f"cpython_trace_epoch_{epoch}.prof")
 
     else:
         train_metrics = train_fn(*args, **kwargs)
@@ -288,6 +477,9 @@ def train(
     scheduler: torch.optim.lr_scheduler._LRScheduler | None = None,
     torch_profiling: bool = False,
     cpython_profiling: bool = False,
+    profiler_cfg: ProfilerConfig | None = None,
+    checkpoint_cfg: CheckpointConfig | None = None,
+    async_validator: "AsyncValidator | None" = None,
 ) -> None:
     """Fine-tune the model for several epochs.
 
@@ -304,11 +496,67 @@ def train(
         checkpoint_dir: Directory to save checkpoints.
         val_loader: DataLoader for validation dataset (optional).
         scheduler: Learning rate scheduler (optional).
+        profiler_cfg: Scheduled profiling of a few windows of training steps (optional).
+        checkpoint_cfg: Retention and writing behaviour of the checkpoints (optional).
+        async_validator: Validate weight snapshots in a worker process instead of blocking the
+            training after every epoch (optional). Replaces the validation with `val_loader`, the
+            results still select the best checkpoint when they arrive.
     """
+    checkpoint_manager = CheckpointManager.from_config(
+        checkpoint_dir, checkpoint_cfg or CheckpointConfig()
+    )
+    try:
+        _train_epochs(
+            model=model,
+            train_loader=train_loader,
+            optimizer=optimizer,
+            loss_fn=loss_fn,
+            metrics=metrics,
+            metrics_val=metrics_val,
+            device=device,
+            current_epoch=current_epoch,
+            num_epochs=num_epochs,
+            inference_cfg=inference_cfg,
+            checkpoint_manager=checkpoint_manager,
+            val_loader=val_loader,
+            scheduler=scheduler,
+            torch_profiling=torch_profiling,
+            cpython_profiling=cpython_profiling,
+            profiler_cfg=profiler_cfg,
+            async_validator=async_validator,
+        )
+    finally:
+        # make sure the last checkpoint reaches the disk
+        checkpoint_manager.close()
+
+
+def _train_epochs(
+    model: nn.Module,
+    train_loader: DataLoader,
+    optimizer: optim.Optimizer,
+    loss_fn: nn.Module,
+    metrics: MetricsManager,
+    metrics_val: MetricsManager,
+    device: torch.device,
+    current_epoch: int,
+    num_epochs: int,
+    inference_cfg: InferenceConfig,
+    checkpoint_manager: CheckpointManager,
+    val_loader: DataLoader | None = None,
+    scheduler: torch.optim.lr_scheduler._LRScheduler | None = None,
+    torch_profiling: bool = False,
+    cpython_profiling: bool = False,
+    profiler_cfg: ProfilerConfig | None = None,
+    async_validator: "AsyncValidator | None" = None,
+) -> None:
     global_batch_idx = 0
     for epoch in range(current_epoch, num_epochs):
         logger.info("Epoch %d/%d: training...", epoch + 1, num_epochs)
+        # reshuffle the shards of every rank
+        if isinstance(train_loader.sampler, DistributedSampler):
+            train_loader.sampler.set_epoch(epoch)
 
+        train_timer = PhaseTimer(sync_cuda=device.type == "cuda")
         train_metrics = profile_epoch(
             train_one_epoch,
             model=model,
@@ -318,21 +566,18 @@ def train(
             loss_fn=loss_fn,
             device=device,
             batch_idx=global_batch_idx,
+            timer=train_timer,
+            epoch=epoch,
             torch_profiling=torch_profiling,
             cpython_profiling=cpython_profiling,
+            profiler_cfg=profiler_cfg,
         )
+        log_metrics("train_timing", train_timer.summary(), step=epoch)
 
         if isinstance(train_loader.dataset, GroupedNifitDataset):
             train_loader.dataset.next_epoch()
 
         global_batch_idx += len(train_loader)
-        save_checkpoint(
-            model=model,
-            optimizer=optimizer,
-            scheduler=scheduler,
-            epoch=epoch,
-            checkpoint_dir=checkpoint_dir,
-        )
         log_metrics(
             "train",
             {"lr": optimizer.param_groups[0]["lr"]} | train_metrics,
@@ -343,10 +588,15 @@ def train(
             ),
             logger=logger,
         )
-        if val_loader is not None:
+        val_result = None
+        if async_validator is not None:
+            # the worker logs the results itself, training continues immediately
+            async_validator.submit(model, epoch=epoch, num_epochs=num_epochs)
+        elif val_loader is not None:
             msg = f"Epoch {epoch + 1}/{num_epochs}: validation..."
             logger.info(msg)
             # Validate
+            val_timer = PhaseTimer(sync_cuda=device.type == "cuda")
             val_result = validate(
                 model=model,
                 val_loader=val_loader,
@@ -354,7 +604,9 @@ def train(
                 metrics=metrics_val,
                 device=device,
                 inference_cfg=inference_cfg,
+                timer=val_timer,
             )
+            log_metrics("val_timing", val_timer.summary(), step=epoch)
             log_metrics(
                 "val",
                 val_result,
@@ -366,6 +618,19 @@ def train(
                 logger=logger,
             )
 
+        # saved after validation, so the best checkpoint can be selected by a validation metric
+        if is_main_process():
+            if async_validator is not None:
+                # results of earlier epochs, recorded before the retention may delete their checkpoints
+                _record_async_results(async_validator, checkpoint_manager)
+            checkpoint_manager.save(
+                model=model,
+                optimizer=optimizer,
+                scheduler=scheduler,
+                epoch=epoch,
+                metrics=val_result,
+            )
+
         # Scheduler step (if applicable)
         if scheduler:
             scheduler.step()
@@ -375,3 +640,13 @@ def train(
             f"| CUDA Memory cached {torch.cuda.memory_reserved()/(1024**2)}MB"
         )
         logger.info(msg)
+
+    if async_validator is not None:
+        # wait for the remaining validations, they may select the best checkpoint
+        async_validator.close()
+        _record_async_results(async_validator, checkpoint_manager)
+
+
+def _record_async_results(async_validator: "AsyncValidator", checkpoint_manager: CheckpointManager) -> None:
+    for epoch, val_result in async_validator.results():
+        checkpoint_manager.update_metrics(epoch, val_result)
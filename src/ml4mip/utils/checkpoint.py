@@ -0,0 +1,282 @@
+import json
+import logging
+import math
+import os
+import queue
+import threading
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Any
+
+import torch
+from hydra.core.config_store import ConfigStore
+
+from ml4mip.utils.distributed import unwrap_model
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "checkpoints.json"
+
+
+class MonitorMode(Enum):
+    MAX = "max"
+    MIN = "min"
+
+
+@dataclass
+class CheckpointConfig:
+    # number of most recent checkpoints to keep on disk (the best one is kept additionally)
+    keep_last: int = 3
+    # validation metric used to select the best checkpoint, e.g. "dice" or "loss"
+    monitor: str | None = "dice"
+    mode: MonitorMode = MonitorMode.MAX
+    # write checkpoints in a background thread
+    async_write: bool = True
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_checkpoint_config",
+    node=CheckpointConfig,
+)
+
+
+def to_cpu(obj: Any) -> Any:
+    """Recursively copy all tensors of a (state dict) structure to CPU memory.
+
+    The tensors are always copied, so the snapshot is not affected by later in-place updates.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, list | tuple):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def atomic_torch_save(obj: Any, path: str | Path) -> None:
+    """Save with `torch.save` to a temporary file and rename it, so `path` is never partial."""
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with tmp_path.open("wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(path)
+
+
+def atomic_write_json(obj: Any, path: str | Path) -> None:
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with tmp_path.open("w") as f:
+        json.dump(obj, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(path)
+
+
+def read_index(checkpoint_dir: str | Path) -> dict[str, Any] | None:
+    """Read the checkpoint index of a directory (None if there is no readable index)."""
+    path = Path(checkpoint_dir) / INDEX_FILE
+    if not path.is_file():
+        return None
+    try:
+        with path.open() as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        msg = f"Ignoring unreadable checkpoint index {path}: {e}"
+        logger.warning(msg)
+        return None
+
+
+class CheckpointManager:
+    """Write training checkpoints asynchronously and apply a retention policy.
+
+    The state is snapshotted to CPU memory in `save`, the (slow) disk write happens in a
+    background thread via temp-file-plus-rename. After each write the last `keep_last`
+    checkpoints and the best one w.r.t. the monitored validation metric are kept, all others
+    are deleted. An index file records the checkpoints and is used by `load_checkpoint` on resume.
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir: str | Path,
+        keep_last: int = 3,
+        monitor: str | None = None,
+        mode: MonitorMode = MonitorMode.MAX,
+        async_write: bool = True,
+    ):
+        if keep_last < 1:
+            msg = f"keep_last must be at least 1, got {keep_last}"
+            raise ValueError(msg)
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.keep_last = keep_last
+        self.monitor = monitor
+        self.mode = mode
+        self.async_write = async_write
+
+        self.index = read_index(self.checkpoint_dir) or {
+            "latest": None,
+            "best": None,
+            "checkpoints": [],
+        }
+        self._error: BaseException | None = None
+        self._queue: queue.Queue | None = None
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_config(cls, checkpoint_dir: str | Path, cfg: CheckpointConfig) -> "CheckpointManager":
+        return cls(
+            checkpoint_dir=checkpoint_dir,
+            keep_last=cfg.keep_last,
+            monitor=cfg.monitor,
+            mode=cfg.mode,
+            async_write=cfg.async_write,
+        )
+
+    def _start_writer(self) -> None:
+        # a single pending snapshot bounds the memory used by queued checkpoints
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._writer_loop, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def _writer_loop(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                write, args = job
+                write(*args)
+            except Exception as e:  # re-raised in the training thread
+                logger.exception("Writing checkpoint failed")
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_pending_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            msg = "A previous asynchronous checkpoint write failed"
+            raise RuntimeError(msg) from error
+
+    def save(
+        self,
+        model: torch.nn.Module,
+        optimizer: torch.optim.Optimizer,
+        epoch: int,
+        scheduler=None,
+        metrics: dict[str, float] | None = None,
+    ) -> None:
+        """Snapshot the training state and write it (asynchronously if enabled)."""
+        self._raise_pending_error()
+        state = to_cpu(
+            {
+                "model_state_dict": unwrap_model(model).state_dict(),
+                "optimizer_state_dict": optimizer.state_dict(),
+                "scheduler_state_dict": scheduler.state_dict() if scheduler else None,
+                "epoch": epoch,
+            }
+        )
+        metrics = dict(metrics or {})
+
+        self._submit(self._write, state, epoch, metrics)
+
+    def update_metrics(self, epoch: int, metrics: dict[str, float]) -> None:
+        """Record validation metrics of an already saved epoch, e.g. of an asynchronous validation.
+
+        The checkpoint of the epoch becomes the best one if the monitored metric improved, as long
+        as it wasn't deleted by the retention policy yet.
+        """
+        self._raise_pending_error()
+        self._submit(self._update_metrics, epoch, dict(metrics))
+
+    def _submit(self, write, *args) -> None:
+        if not self.async_write:
+            write(*args)
+            return
+
+        if self._thread is None:
+            self._start_writer()
+        # blocks only if the previous checkpoint is still being written
+        self._queue.put((write, args))
+
+    def _is_better(self, value: float) -> bool:
+        best = self.index["best"]
+        if best is None:
+            return True
+        if self.mode == MonitorMode.MAX:
+            return value > best["value"]
+        return value < best["value"]
+
+    def _write(self, state: dict[str, Any], epoch: int, metrics: dict[str, float]) -> None:
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        name = f"checkpoint_{epoch}.pt"
+        atomic_torch_save(state, self.checkpoint_dir / name)
+
+        entries = [entry for entry in self.index["checkpoints"] if entry["file"] != name]
+        entries.append({"epoch": epoch, "file": name, "metrics": metrics})
+        entries.sort(key=lambda entry: entry["epoch"])
+        self.index["checkpoints"] = entries
+        self.index["latest"] = name
+
+        self._update_best(name, epoch, metrics)
+        self._apply_retention()
+        atomic_write_json(self.index, self.checkpoint_dir / INDEX_FILE)
+        msg = f"Checkpoint saved to {self.checkpoint_dir / name}"
+        logger.info(msg)
+
+    def _update_metrics(self, epoch: int, metrics: dict[str, float]) -> None:
+        name = f"checkpoint_{epoch}.pt"
+        entry = next((entry for entry in self.index["checkpoints"] if entry["file"] == name), None)
+        if entry is None:
+            if self._improves(metrics):
+                msg = f"The best checkpoint {name} was already deleted by the retention policy, increase keep_last"
+                logger.warning(msg)
+            return
+        entry["metrics"] = metrics
+        self._update_best(name, epoch, metrics)
+        self._apply_retention()
+        atomic_write_json(self.index, self.checkpoint_dir / INDEX_FILE)
+
+    def _improves(self, metrics: dict[str, float]) -> bool:
+        value = metrics.get(self.monitor) if self.monitor else None
+        return value is not None and not math.isnan(value) and self._is_better(value)
+
+    def _update_best(self, name: str, epoch: int, metrics: dict[str, float]) -> None:
+        if self._improves(metrics):
+            self.index["best"] = {"file": name, "epoch": epoch, "metric": self.monitor, "value": metrics[self.monitor]}
+
+    def _apply_retention(self) -> None:
+        entries = self.index["checkpoints"]
+        keep = {entry["file"] for entry in entries[-self.keep_last :]}
+        if self.index["best"] is not None:
+            keep.add(self.index["best"]["file"])
+
+        for entry in entries:
+            if entry["file"] not in keep:
+                (self.checkpoint_dir / entry["file"]).unlink(missing_ok=True)
+        self.index["checkpoints"] = [entry for entry in entries if entry["file"] in keep]
+
+    def wait(self) -> None:
+        """Block until all queued checkpoints are written."""
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_pending_error()
+
+    def close(self) -> None:
+        """Flush the pending checkpoint and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+        self._raise_pending_error()
+
+    def __enter__(self) -> "CheckpointManager":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
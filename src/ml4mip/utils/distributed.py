@@ -0,0 +1,122 @@
+import logging
+import os
+from dataclasses import dataclass
+from datetime import timedelta
+
+import torch
+import torch.distributed as dist
+from torch import nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Dataset, DistributedSampler
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DistributedConfig:
+    # launch with `torchrun --nproc_per_node=N --no-python train distributed.enabled=true ...` to enable DDP
+    enabled: bool = False
+    # gloo works on CPU-only machines, use nccl for multi-GPU nodes
+    backend: str = "gloo"
+    timeout_min: int = 30
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    """Only rank 0 writes checkpoints and logs to MLflow."""
+    return get_rank() == 0
+
+
+def init_distributed(cfg: DistributedConfig) -> torch.device:
+    """Initialize the default process group from the environment set by `torchrun`.
+
+    Returns:
+        The device this rank should train on.
+    """
+    if "RANK" not in os.environ or "WORLD_SIZE" not in os.environ:
+        msg = "Distributed training requires RANK and WORLD_SIZE to be set. Launch with torchrun."
+        raise RuntimeError(msg)
+
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank)
+        device = torch.device("cuda", local_rank)
+    else:
+        device = torch.device("cpu")
+
+    dist.init_process_group(backend=cfg.backend, timeout=timedelta(minutes=cfg.timeout_min))
+    logger.info(
+        "Initialized process group (backend=%s, rank=%d/%d, device=%s)",
+        cfg.backend,
+        get_rank(),
+        get_world_size(),
+        device,
+    )
+    return device
+
+
+def cleanup_distributed() -> None:
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def wrap_model(model: nn.Module, device: torch.device) -> nn.Module:
+    """Wrap the model in DDP if a process group is initialized."""
+    if not is_distributed():
+        return model
+    device_ids = [device.index] if device.type == "cuda" else None
+    return DistributedDataParallel(model, device_ids=device_ids)
+
+
+def unwrap_model(model: nn.Module) -> nn.Module:
+    """Return the underlying module so state dicts don't carry the `module.` prefix."""
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def get_sampler(dataset: Dataset, shuffle: bool) -> DistributedSampler | None:
+    """Return a sampler that shards the dataset over all ranks (None if not distributed)."""
+    if not is_distributed():
+        return None
+    return DistributedSampler(dataset, shuffle=shuffle)
+
+
+def _reduction_device() -> torch.device:
+    # nccl can only reduce cuda tensors, gloo handles both
+    if dist.get_backend() == dist.Backend.NCCL:
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
+
+def all_reduce_metrics(metrics: dict[str, float], weight: float = 1.0) -> dict[str, float]:
+    """Average aggregated metrics over all ranks.
+
+    Args:
+        metrics: Metrics aggregated on this rank.
+        weight: Weight of this rank's values, e.g. the number of samples it processed.
+
+    Returns:
+        The weighted mean of every metric over all ranks.
+    """
+    if not is_distributed() or not metrics:
+        return metrics
+
+    names = sorted(metrics)
+    values = torch.tensor(
+        [float(metrics[name]) * weight for name in names] + [weight],
+        dtype=torch.float64,
+        device=_reduction_device(),
+    )
+    dist.all_reduce(values, op=dist.ReduceOp.SUM)
+    total_weight = values[-1].item()
+    return {name: (values[i] / total_weight).item() for i, name in enumerate(names)}
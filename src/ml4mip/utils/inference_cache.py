@@ -0,0 +1,218 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import tempfile
+import threading
+import weakref
+from collections.abc import Callable
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import torch
+from torch import nn
+
+from ml4mip.models import source_digest
+from ml4mip.sliding_window import copy_meta
+
+logger = logging.getLogger(__name__)
+
+# logits of the probabilities 0 and 1 of the cached outputs
+LOGIT_EPS = 1e-4
+
+
+class CacheDtype(Enum):
+    # probabilities as float16 (2 bytes per voxel)
+    FLOAT16 = "float16"
+    # probabilities quantized to 0..255 (1 byte per voxel)
+    UINT8 = "uint8"
+
+
+@dataclass
+class InferenceCacheConfig:
+    # reuse the outputs of identical (weights, inference config, input) combinations
+    enabled: bool = False
+    directory: str = str(Path.home() / ".cache" / "ml4mip" / "inference")
+    # the least recently used outputs are deleted beyond this size
+    max_bytes: int = 20 * 2**30
+    dtype: CacheDtype = CacheDtype.FLOAT16
+
+
+def _digest(*parts: bytes) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def tensor_digest(tensor: torch.Tensor) -> str:
+    tensor = tensor.detach().as_subclass(torch.Tensor).cpu().contiguous()
+    return _digest(str(tensor.dtype).encode(), str(tuple(tensor.shape)).encode(), tensor.numpy().tobytes())
+
+
+def config_digest(cfg: Any) -> str:
+    """Digest of a dataclass config, enums by value."""
+    fields = json.dumps(
+        dataclasses.asdict(cfg),
+        sort_keys=True,
+        default=lambda value: getattr(value, "value", str(value)),
+    )
+    return _digest(fields.encode())
+
+
+# weight digests per model, recomputed when a parameter was modified (in-place updates bump the version)
+_weight_digests: "weakref.WeakKeyDictionary[nn.Module, tuple[tuple[int, ...], str]]" = weakref.WeakKeyDictionary()
+
+
+def weights_digest(model: nn.Module) -> str | None:
+    """Digest of the weights (and the file of exported models), None if the model can't be identified."""
+    state = list(model.state_dict().items())
+    source = source_digest(model)
+    if not state and source is None:
+        return None
+    # the version counter of a tensor is the only way to detect in-place updates without hashing it
+    versions = tuple(tensor._version for _, tensor in state)  # noqa: SLF001
+    cached = _weight_digests.get(model)
+    if cached is not None and cached[0] == versions:
+        return cached[1]
+    digest = _digest(
+        type(model).__name__.encode(),
+        (source or "").encode(),
+        *(name.encode() + bytes.fromhex(tensor_digest(tensor)) for name, tensor in state),
+    )
+    _weight_digests[model] = (versions, digest)
+    return digest
+
+
+class InferenceCache:
+    """Content addressed store of inference outputs with LRU eviction by disk size.
+
+    The outputs are stored per sample as probabilities (float16 or uint8 `.npy` files) under the
+    digest of the model weights, the inference config and the input. A hit touches the file, so
+    the files with the oldest modification time are evicted first.
+    """
+
+    def __init__(self, directory: str | Path, max_bytes: int, dtype: CacheDtype = CacheDtype.FLOAT16):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npy"
+
+    def get(self, key: str) -> torch.Tensor | None:
+        """The cached probabilities (float32) or None."""
+        path = self._path(key)
+        try:
+            array = np.load(path)
+            path.touch()
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        if array.dtype == np.uint8:
+            return torch.from_numpy(array).float() / 255
+        return torch.from_numpy(array).float()
+
+    def put(self, key: str, probabilities: torch.Tensor) -> None:
+        probabilities = probabilities.detach().as_subclass(torch.Tensor).float().cpu()
+        match self.dtype:
+            case CacheDtype.FLOAT16:
+                array = probabilities.half().numpy()
+            case CacheDtype.UINT8:
+                array = (probabilities * 255).round().to(torch.uint8).numpy()
+            case _:
+                msg = f"Invalid cache dtype: {self.dtype}"
+                raise ValueError(msg)
+        # write atomically, other processes may read the same key
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            np.save(f, array)
+        Path(f.name).replace(self._path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used outputs until the cache fits into `max_bytes`."""
+        with self._lock:
+            files = []
+            for path in self.directory.glob("*.npy"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+    def __call__(
+        self,
+        images: torch.Tensor,
+        model: nn.Module,
+        cfg: Any,
+        infer: Callable[[torch.Tensor], torch.Tensor],
+        logits: bool = True,
+        stats: dict[str, float] | None = None,
+    ) -> torch.Tensor:
+        """Run `infer` on the samples of the batch that are not cached.
+
+        Args:
+            images: The images (B, C, H, W, D).
+            model: The model, its weights are part of the key.
+            cfg: The inference config (dataclass), part of the key.
+            infer: The inference of a batch of images.
+            logits: The outputs are logits (sigmoid before storing, logit after loading), otherwise
+                probabilities.
+            stats: Filled with the fraction of cached samples (`inference_cache_hits`).
+        """
+        weights = weights_digest(model)
+        if weights is None:
+            # e.g. a TorchScript model with inlined weights loaded without `get_model`
+            logger.warning("The weights of %s can't be identified, the outputs are not cached.", type(model).__name__)
+            return infer(images)
+        prefix = _digest(weights.encode(), config_digest(cfg).encode())
+        keys = [_digest(prefix.encode(), tensor_digest(image).encode()) for image in images]
+        results: list[torch.Tensor | None] = []
+        for key in keys:
+            probabilities = self.get(key)
+            if probabilities is not None and logits:
+                probabilities = torch.logit(probabilities, eps=LOGIT_EPS)
+            results.append(probabilities)
+        missing = [idx for idx, output in enumerate(results) if output is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if stats is not None:
+            stats["inference_cache_hits"] = 1 - len(missing) / len(keys)
+
+        device, dtype = images.device, torch.float32
+        if missing:
+            partial = len(missing) < len(keys)
+            outputs = infer(images.as_subclass(torch.Tensor)[missing] if partial else images)
+            for idx, output in zip(missing, outputs, strict=True):
+                self.put(keys[idx], torch.sigmoid(output.float()) if logits else output)
+                results[idx] = output.as_subclass(torch.Tensor)
+            if not partial:
+                return outputs
+            device, dtype = outputs.device, outputs.dtype
+
+        return copy_meta(torch.stack([output.to(device=device, dtype=dtype) for output in results]), images)
+
+
+_caches: dict[str, InferenceCache] = {}
+
+
+def get_inference_cache(cfg: InferenceCacheConfig) -> InferenceCache:
+    """The cache of a directory (shared by the calls with the same config)."""
+    key = str(Path(cfg.directory).expanduser().resolve())
+    if key not in _caches:
+        _caches[key] = InferenceCache(key, cfg.max_bytes, cfg.dtype)
+    _caches[key].max_bytes = cfg.max_bytes
+    _caches[key].dtype = cfg.dtype
+    return _caches[key]
@@ -1,7 +1,169 @@
-from dataclasses import asdict
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from http import HTTPStatus
 from logging import Logger
 
 import mlflow
+from mlflow.entities import Metric, Param
+from mlflow.exceptions import MlflowException
+from mlflow.tracking import MlflowClient
+from mlflow.utils.validation import MAX_METRICS_PER_BATCH, MAX_PARAMS_TAGS_PER_BATCH
+
+from ml4mip.utils.distributed import is_main_process
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MlflowLoggingConfig:
+    # buffer metrics and params in memory and send them with `log_batch` in the background
+    buffered: bool = True
+    flush_interval: float = 10.0
+    # a batch is dropped after this many failed attempts (at once if MLflow rejects it)
+    max_attempts: int = 5
+
+
+class BufferedMlflowLogger:
+    """Buffer MLflow metrics and params in memory and flush them with `MlflowClient.log_batch`.
+
+    A background thread flushes the buffer every `flush_interval` seconds, `close` flushes the
+    rest. Entries are sent in the order they were logged. If a flush fails, the unsent entries
+    are kept and retried with the next flush. A batch MLflow rejects (e.g. a param logged again
+    with another value) or that failed `max_attempts` times is dropped, so it doesn't block the
+    later entries.
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        flush_interval: float = 10.0,
+        client: MlflowClient | None = None,
+        max_attempts: int = 5,
+    ):
+        self.run_id = run_id
+        self.flush_interval = flush_interval
+        self.client = client or MlflowClient()
+        self.max_attempts = max_attempts
+        # failed attempts of the first unsent batch
+        self._failures = 0
+        self._metrics: list[Metric] = []
+        self._params: list[Param] = []
+        self._lock = threading.Lock()
+        # only one flush at a time, otherwise batches could overtake each other
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="mlflow-flush", daemon=True)
+        self._thread.start()
+
+    def log_metrics(self, metrics: dict[str, float], step: int) -> None:
+        timestamp = int(time.time() * 1000)
+        entries = [Metric(name, float(value), timestamp, step) for name, value in metrics.items()]
+        with self._lock:
+            self._metrics.extend(entries)
+
+    def log_params(self, params: dict[str, str | int | float | bool]) -> None:
+        entries = [Param(name, str(value)) for name, value in params.items()]
+        with self._lock:
+            self._params.extend(entries)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                metrics, self._metrics = self._metrics, []
+                params, self._params = self._params, []
+            try:
+                # params first, the run's configuration should be present before its metrics
+                while params:
+                    self._send(params=params[:MAX_PARAMS_TAGS_PER_BATCH])
+                    params = params[MAX_PARAMS_TAGS_PER_BATCH:]
+                while metrics:
+                    self._send(metrics=metrics[:MAX_METRICS_PER_BATCH])
+                    metrics = metrics[MAX_METRICS_PER_BATCH:]
+            finally:
+                # keep everything that wasn't sent in front of newer entries
+                with self._lock:
+                    self._metrics = metrics + self._metrics
+                    self._params = params + self._params
+
+    def _send(self, metrics: list[Metric] | None = None, params: list[Param] | None = None) -> None:
+        """Send a batch, raise if it should be retried and drop it otherwise."""
+        try:
+            self.client.log_batch(self.run_id, metrics=metrics or [], params=params or [])
+        except Exception as e:
+            self._failures += 1
+            if _is_retryable(e) and self._failures < self.max_attempts:
+                raise
+            logger.exception(
+                "Dropping %d MLflow metrics and %d params after %d attempts",
+                len(metrics or []),
+                len(params or []),
+                self._failures,
+            )
+        self._failures = 0
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:  # retried with the next flush
+                logger.exception("Flushing MLflow logs failed")
+
+    def close(self) -> None:
+        """Stop the background thread and flush everything that is left.
+
+        A failure is logged, not raised, so it doesn't replace an exception the training ended with.
+        """
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception:  # the unsent entries are lost
+            logger.exception(
+                "Flushing MLflow logs failed, %d metrics and %d params were not logged",
+                len(self._metrics),
+                len(self._params),
+            )
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether sending a batch may succeed later, i.e. it isn't rejected by MLflow (4xx except 429)."""
+    if not isinstance(error, MlflowException):
+        return True
+    status = error.get_http_status_code()
+    if status == HTTPStatus.TOO_MANY_REQUESTS:
+        return True
+    return not HTTPStatus.BAD_REQUEST <= status < HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+# backend used by `log_metrics` and `log_hydra_config_to_mlflow` while it is set
+_buffered_logger: BufferedMlflowLogger | None = None
+
+
+@contextmanager
+def buffered_mlflow_logging(
+    flush_interval: float = 10.0, max_attempts: int = 5
+) -> Iterator[BufferedMlflowLogger | None]:
+    """Buffer all metrics and params logged for the active MLflow run within the context.
+
+    The buffer is flushed on exit, also if the context is left by an exception such as a
+    `KeyboardInterrupt`. Without an active run (e.g. on DDP ranks other than 0) this is a no-op.
+    """
+    global _buffered_logger
+    run = mlflow.active_run()
+    if run is None or _buffered_logger is not None:
+        yield _buffered_logger
+        return
+
+    _buffered_logger = BufferedMlflowLogger(run.info.run_id, flush_interval=flush_interval, max_attempts=max_attempts)
+    try:
+        yield _buffered_logger
+    finally:
+        buffered_logger, _buffered_logger = _buffered_logger, None
+        buffered_logger.close()
 
 
 def get_log_message(
@@ -21,8 +183,27 @@ def get_log_message(
     return metrics_info
 
 
-def mlflow_log_metrics(label: str, metrics: dict[str, float], step: int) -> None:
-    """Log metrics to MLflow with a specific label."""
+def mlflow_log_metrics(
+    label: str, metrics: dict[str, float], step: int, run_id: str | None = None
+) -> None:
+    """Log metrics to MLflow with a specific label.
+
+    If `run_id` is given, the metrics are logged to that run instead of the active one, e.g.
+    from a worker process that must not start or end the run itself.
+    """
+    if run_id is not None:
+        timestamp = int(time.time() * 1000)
+        MlflowClient().log_batch(
+            run_id,
+            metrics=[
+                Metric(f"{label}_{name}", float(value), timestamp, step)
+                for name, value in metrics.items()
+            ],
+        )
+        return
+    if _buffered_logger is not None:
+        _buffered_logger.log_metrics({f"{label}_{name}": value for name, value in metrics.items()}, step)
+        return
     for name, value in metrics.items():
         mlflow.log_metric(f"{label}_{name}", value, step=step)
 
@@ -33,9 +214,12 @@ def log_metrics(
     step: int,
     epochs: tuple[int, int] | None = None,
     logger: Logger | None = None,
+    run_id: str | None = None,
 ) -> None:
     """Log metrics to the console and MLflow."""
-    mlflow_log_metrics(label, metrics, step)
+    if not is_main_process():
+        return
+    mlflow_log_metrics(label, metrics, step, run_id=run_id)
     if logger is not None:
         msg = get_log_message(
             label,
@@ -47,6 +231,8 @@ def log_metrics(
 
 def log_hydra_config_to_mlflow(config, prefix: str = "") -> None:
     """Log every parameter from a Hydra DictConfig object to MLflow."""
+    if not is_main_process():
+        return
 
     def flatten_structure(d, parent_key="", sep="."):
         """Flatten nested dictionaries and lists into a single-level dictionary."""
@@ -69,9 +255,12 @@ def log_hydra_config_to_mlflow(config, prefix: str = "") -> None:
     # Flatten the structure
     flat_config = flatten_structure(asdict(config))
 
-    # Log each parameter to MLflow
-    for key, value in flat_config.items():
-        # Convert non-stringable objects to strings for logging
-        if not isinstance(value, str | int | float | bool):
-            value = str(value)
-        mlflow.log_param(f"{prefix}{key}", value)
+    # Convert non-stringable objects to strings for logging
+    params = {
+        f"{prefix}{key}": (value if isinstance(value, str | int | float | bool) else str(value))
+        for key, value in flat_config.items()
+    }
+    if _buffered_logger is not None:
+        _buffered_logger.log_params(params)
+    else:
+        mlflow.log_params(params)
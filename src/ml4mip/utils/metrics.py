@@ -1,57 +1,244 @@
 import copy
+import hashlib
+import math
 import statistics
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from enum import Enum
 from typing import Any
 
 import numpy as np
 import torch
-from monai.losses import DiceLoss
-from monai.metrics import DiceMetric, HausdorffDistanceMetric, Metric
+from hydra.core.config_store import ConfigStore
+from monai.data import MetaTensor
+from monai.metrics import Metric
 from skimage.morphology import skeletonize
 
+from ml4mip.utils.surface_distance import bounding_box, surface_distances
+
 
 class MetricType(Enum):
     DICE = "dice"
     JACCARD_INDEX = "jaccard_index"
+    PRECISION = "precision"
+    RECALL = "recall"
     HAUSDORFF_DISTANCE = "hausdorff_distance"
     CENTERLINE_LOSS = "centerline_loss"
 
 
-class JaccardIndex(Metric):
-    def __init__(self):
+class ConfusionReduction(Enum):
+    # mean of the scores of the individual cases
+    CASE = "case"
+    # scores of the counts summed over all cases
+    GLOBAL = "global"
+
+
+@dataclass
+class MetricsConfig:
+    # skeletonize the samples of the clDice metric in a pool of worker processes (0: no pool)
+    cldice_num_workers: int = 0
+    # reuse the target skeletons of the clDice metric across epochs (keyed by case id)
+    cldice_cache_targets: bool = True
+    # compute the surface distances in mm (from the affine of the targets) instead of voxels
+    surface_distance_in_mm: bool = True
+    # aggregate dice, jaccard index, precision and recall per case or over the summed confusion counts
+    confusion_reduction: ConfusionReduction = ConfusionReduction.CASE
+    # update the CPU metrics (surface distances, clDice) in background threads during validation
+    async_update: bool = False
+    # maximum number of batches queued per metric in async mode
+    max_pending: int = 4
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_metrics_config",
+    node=MetricsConfig,
+)
+
+
+CONFUSION_SCORES = ("dice", "jaccard_index", "precision", "recall")
+
+
+def confusion_counts(y_pred: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    """Count the true positives, false positives, false negatives and true negatives per sample.
+
+    The inputs are binarized at 0.5 and all channels of a sample are counted together.
+
+    Returns:
+        int64 tensor of shape (BS x 4) with the columns TP, FP, FN, TN.
+    """
+    if y_pred.shape != y.shape:
+        msg = f"Shape mismatch: y_pred {y_pred.shape}, y_true {y.shape}"
+        raise ValueError(msg)
+    pred = (y_pred > 0.5).reshape(y_pred.shape[0], -1)
+    target = (y > 0.5).reshape(y.shape[0], -1)
+    # TP, FP and FN follow from the intersection and the two foreground counts
+    tp = (pred & target).sum(dim=1)
+    fp = pred.sum(dim=1) - tp
+    fn = target.sum(dim=1) - tp
+    tn = pred.shape[1] - tp - fp - fn
+    return torch.stack([tp, fp, fn, tn], dim=1)
+
+
+def confusion_scores(
+    counts: torch.Tensor, scores: tuple[str, ...] = CONFUSION_SCORES, zero_division: float = 1.0
+) -> dict[str, torch.Tensor]:
+    """Derive the scores from confusion counts (... x 4), F1 equals the Dice score.
+
+    Args:
+        counts: TP, FP, FN and TN in the last dimension.
+        scores: Names of the scores to compute, a subset of `CONFUSION_SCORES`.
+        zero_division: Score if the denominator is 0, e.g. the Dice score of two empty masks.
+    """
+    tp, fp, fn, _ = counts.double().unbind(dim=-1)
+    fractions = {
+        "dice": (2 * tp, 2 * tp + fp + fn),
+        "jaccard_index": (tp, tp + fp + fn),
+        "precision": (tp, tp + fp),
+        "recall": (tp, tp + fn),
+    }
+    results = {}
+    for name in scores:
+        if name not in fractions:
+            msg = f"Unknown confusion score: {name}"
+            raise ValueError(msg)
+        numerator, denominator = fractions[name]
+        results[name] = torch.where(
+            denominator > 0, numerator / denominator.clamp(min=1), torch.full_like(numerator, zero_division)
+        )
+    return results
+
+
+class ConfusionMetric(Metric):
+    def __init__(
+        self,
+        scores: tuple[str, ...] = CONFUSION_SCORES,
+        reduction: ConfusionReduction = ConfusionReduction.CASE,
+        zero_division: float = 1.0,
+    ):
+        """Overlap scores of binary segmentations derived from a single set of confusion counts.
+
+        Only running totals are kept on the device of the inputs (the summed counts and the summed
+        per case scores), so the memory doesn't grow with the number of cases and updating doesn't
+        synchronize with the host.
+
+        Args:
+            scores: Names of the scores to report, a subset of `CONFUSION_SCORES`.
+            reduction: Aggregate the mean of the per case scores or the scores of the summed counts.
+            zero_division: Score if the denominator is 0, e.g. the Dice score of two empty masks.
+        """
         super().__init__()
-        self.values = []
+        self.scores = tuple(scores)
+        self.reduction = ConfusionReduction(reduction)
+        self.zero_division = zero_division
+        self.reset()
 
-    def __call__(self, y_pred: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
-        """Compute the Jaccard Index for a batch and store it."""
-        # Initialize DiceLoss to compute Jaccard Index
-        jaccard_loss = DiceLoss(jaccard=True, include_background=True, reduction="mean")
+    def update(self, y_pred: torch.Tensor, y: torch.Tensor) -> dict[str, torch.Tensor]:
+        """Add a batch to the totals.
 
-        # Compute the Jaccard Index
-        jaccard_index = 1 - jaccard_loss(y_pred, y)
+        Returns:
+            The scores of the cases in the batch (BS).
+        """
+        return self.update_counts(confusion_counts(y_pred, y))
+
+    def update_counts(self, counts: torch.Tensor) -> dict[str, torch.Tensor]:
+        """Add the confusion counts (BS x 4) of whole cases, e.g. accumulated window by window."""
+        case_scores = confusion_scores(counts, self.scores, self.zero_division)
+        if self.counts is None:
+            self.counts = torch.zeros(4, dtype=torch.int64, device=counts.device)
+            self.score_sums = torch.zeros(len(self.scores), dtype=torch.float64, device=counts.device)
+        self.counts += counts.sum(dim=0)
+        self.score_sums += torch.stack([case_scores[name].sum() for name in self.scores])
+        self.num_cases += counts.shape[0]
+        return case_scores
+
+    def __call__(self, y_pred: torch.Tensor, y: torch.Tensor) -> dict[str, torch.Tensor]:
+        return self.update(y_pred, y)
 
-        # Append to internal state
-        self.values.append(jaccard_index)
-        return jaccard_index
+    def reset(self):
+        self.counts: torch.Tensor | None = None
+        self.score_sums: torch.Tensor | None = None
+        self.num_cases = 0
 
-    def aggregate(self) -> torch.Tensor:
-        """Aggregate the stored Jaccard Index values."""
-        if len(self.values) == 0:
+    def aggregate(self) -> dict[str, float]:
+        if self.num_cases == 0:
             msg = "No values have been computed. Call the metric before aggregating."
             raise ValueError(msg)
-        # Compute the mean of the stored values
-        return torch.mean(torch.stack(self.values))
-
-    def reset(self):
-        """Reset the stored values."""
-        self.values = []
+        match self.reduction:
+            case ConfusionReduction.CASE:
+                means = (self.score_sums / self.num_cases).tolist()
+                return dict(zip(self.scores, means, strict=True))
+            case ConfusionReduction.GLOBAL:
+                results = confusion_scores(self.counts, self.scores, self.zero_division)
+                return {name: value.item() for name, value in results.items()}
+
+
+def _skeleton_coords(mask: np.ndarray) -> np.ndarray:
+    """Coordinates of the skeleton voxels, skeletonized within the bounding box of the mask.
+
+    The box keeps a background margin, so the skeleton is identical to the one of the whole mask.
+    """
+    box = bounding_box(mask)
+    if box is None:
+        return np.zeros((0, mask.ndim), dtype=np.int64)
+    return np.argwhere(skeletonize(mask[box])) + [s.start for s in box]
+
+
+def _target_digest(target: np.ndarray) -> str:
+    """Digest of a target mask, computed on its own bounding box (independent of the prediction)."""
+    box = bounding_box(target)
+    offset = np.array([s.start for s in box] if box is not None else [], dtype=np.int64)
+    cropped = target[box] if box is not None else target[:0]
+    return hashlib.blake2b(
+        np.packbits(cropped).tobytes()
+        + np.array(cropped.shape).tobytes()
+        + offset.tobytes()
+        + np.array(target.shape).tobytes()
+    ).hexdigest()
+
+
+def _cldice_sample(
+    pred: np.ndarray, target: np.ndarray, target_skeleton: np.ndarray | None
+) -> tuple[float, np.ndarray]:
+    """Compute clDice of a sample (skeletons given as coordinates), runs in the worker processes.
+
+    Returns:
+        The score and the coordinates of the target skeleton.
+    """
+    if target_skeleton is None:
+        target_skeleton = _skeleton_coords(target)
+    pred_skeleton = _skeleton_coords(pred)
+    tprec = pred[tuple(target_skeleton.T)].sum() / (len(target_skeleton) + 1e-8)
+    tsens = target[tuple(pred_skeleton.T)].sum() / (len(pred_skeleton) + 1e-8)
+    return 2 * tprec * tsens / (tprec + tsens + 1e-8), target_skeleton
 
 
 class ClDiceMetric(Metric):
-    def __init__(self):
-        """Initialize the clDice metric."""
+    def __init__(self, num_workers: int = 0, cache_targets: bool = True):
+        """Initialize the clDice metric.
+
+        Args:
+            num_workers: Skeletonize the samples in a pool of worker processes (0: in this process).
+            cache_targets: Cache the target skeletons per case id (`filename_or_obj` meta data),
+                the cached skeleton is only used if the target is unchanged.
+        """
         super().__init__()
+        self.num_workers = num_workers
+        self.cache_targets = cache_targets
         self.cldice_scores = []
+        # case id -> (digest of the target, skeleton coordinates)
+        self._target_cache: dict[str, tuple[str, np.ndarray]] = {}
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending: list[tuple[Future, str | None, str | None, np.ndarray]] = []
+
+    def __getstate__(self):
+        # the pool and the pending results can't be copied
+        self._collect()
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_pending"] = []
+        return state
 
     @staticmethod
     def _tensor_to_numpy(tensor: torch.Tensor) -> np.ndarray:
@@ -70,15 +257,43 @@ class ClDiceMetric(Metric):
         tsens = ClDiceMetric._cl_score(target, skeletonize(pred))
         return 2 * tprec * tsens / (tprec + tsens + 1e-8)
 
+    @staticmethod
+    def _case_ids(y: torch.Tensor) -> list[str | None]:
+        batch_size = y.shape[0]
+        names = y.meta.get("filename_or_obj") if isinstance(y, MetaTensor) else None
+        if isinstance(names, str):
+            names = [names]
+        if names is None or len(names) != batch_size:
+            return [None] * batch_size
+        return [str(name) for name in names]
+
+    def _submit(self, *args) -> Future:
+        if self.num_workers == 0:
+            future = Future()
+            future.set_result(_cldice_sample(*args))
+            return future
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        return self._executor.submit(_cldice_sample, *args)
+
+    def _collect(self) -> None:
+        """Wait for the pending samples and cache their target skeletons."""
+        for future, case_id, digest, offset in self._pending:
+            score, target_skeleton = future.result()
+            self.cldice_scores.append(score)
+            if case_id is not None:
+                self._target_cache[case_id] = (digest, target_skeleton + offset)
+        self._pending = []
+
     def update(self, y_pred: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
         """Compute the clDice metric for the given predictions and ground truths.
 
+        The samples are cropped to the bounding box of prediction and target and skeletonized
+        asynchronously if workers are used, the scores are available after `aggregate`.
+
         Args:
             y_pred: Predicted binary tensor of shape (BS x 1 x S^3).
             y_true: Ground truth binary tensor of shape (BS x 1 x S^3).
-
-        Returns:
-            torch.Tensor: clDice metric for each batch element.
         """
         if y_pred.shape != y.shape:
             msg = f"Shape mismatch: y_pred {y_pred.shape}, y_true {y.shape}"
@@ -88,28 +303,119 @@ class ClDiceMetric(Metric):
             msg = f"Expected y_pred to have 1 channel, got {y_pred.shape[1]}"
             raise ValueError(msg)
 
-        batch_size = y_pred.shape[0]
-
-        for i in range(batch_size):
-            pred_np = self._tensor_to_numpy(
-                y_pred[i, 0]
-            )  # Convert to NumPy, remove batch and channel dims
+        case_ids = self._case_ids(y) if self.cache_targets else [None] * y.shape[0]
+        for i, case_id in enumerate(case_ids):
+            pred_np = self._tensor_to_numpy(y_pred[i, 0])  # remove batch and channel dims
             true_np = self._tensor_to_numpy(y[i, 0])
-            cldice_score = self._clDice_single(pred_np, true_np)
-            self.cldice_scores.append(cldice_score)
+            box = bounding_box(pred_np | true_np)
+            if box is None:
+                # both empty
+                self.cldice_scores.append(0.0)
+                continue
+
+            offset = np.array([s.start for s in box])
+            digest = None
+            target_skeleton = None
+            if case_id is not None:
+                # random crops or augmentations change the target of a case, the prediction doesn't
+                digest = _target_digest(true_np)
+                cached = self._target_cache.get(case_id)
+                if cached is not None and cached[0] == digest:
+                    target_skeleton = cached[1] - offset
+
+            future = self._submit(pred_np[box], true_np[box], target_skeleton)
+            self._pending.append((future, case_id, digest, offset))
 
     def __call__(self, y_pred: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
         """Compute the clDice metric for the given predictions and ground truths."""
         self.update(y_pred, y)
 
     def reset(self):
-        """Reset the clDice scores."""
+        """Reset the clDice scores (the cached target skeletons are kept)."""
+        self._collect()
         self.cldice_scores = []
 
     def aggregate(self) -> torch.Tensor:
         """Compute the mean clDice score."""
+        self._collect()
         return torch.tensor(statistics.mean(self.cldice_scores))
 
+    def close(self) -> None:
+        """Shut down the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class SurfaceDistanceMetric(Metric):
+    def __init__(self, use_spacing: bool = True, percentile: float = 95):
+        """Hausdorff distance, its percentile and average surface distance per sample.
+
+        Args:
+            use_spacing: Measure in physical units using the affine of the (MetaTensor) targets.
+            percentile: Percentile of the robust Hausdorff distance.
+        """
+        super().__init__()
+        self.use_spacing = use_spacing
+        self.percentile = percentile
+        self.values = []
+
+    def _spacings(self, y: torch.Tensor) -> list[np.ndarray | None]:
+        batch_size = y.shape[0]
+        if not self.use_spacing or not isinstance(y, MetaTensor):
+            return [None] * batch_size
+        affine = y.affine.detach().cpu().numpy()
+        if affine.ndim == 2:
+            affine = np.broadcast_to(affine, (batch_size, *affine.shape))
+        # length of the columns of the affine, i.e. the voxel size along each axis
+        return list(np.linalg.norm(affine[:, :3, :3], axis=1))
+
+    def update(self, y_pred: torch.Tensor, y: torch.Tensor) -> None:
+        if y_pred.shape != y.shape:
+            msg = f"Shape mismatch: y_pred {y_pred.shape}, y_true {y.shape}"
+            raise ValueError(msg)
+
+        if y_pred.shape[1] != 1:
+            msg = f"Expected y_pred to have 1 channel, got {y_pred.shape[1]}"
+            raise ValueError(msg)
+
+        for i, spacing in enumerate(self._spacings(y)):
+            self.values.append(
+                surface_distances(
+                    y_pred[i, 0].detach().cpu().numpy(),
+                    y[i, 0].detach().cpu().numpy(),
+                    spacing=spacing,
+                    percentile=self.percentile,
+                )
+            )
+
+    def __call__(self, y_pred: torch.Tensor, y: torch.Tensor) -> None:
+        self.update(y_pred, y)
+
+    def reset(self):
+        self.values = []
+
+    def aggregate(self) -> dict[str, float]:
+        """Mean of the distances over the samples with finite distances.
+
+        The distances are infinite if only one of prediction and target is empty (e.g. early in
+        training), these samples are skipped (as by MONAI) and counted in `surface_distance_empty`.
+        """
+        if len(self.values) == 0:
+            msg = "No values have been computed. Call the metric before aggregating."
+            raise ValueError(msg)
+        finite = [value for value in self.values if math.isfinite(value["hd"])]
+
+        def mean(key: str) -> float:
+            return statistics.mean(value[key] for value in finite) if finite else math.nan
+
+        return {
+            "hausdorff_distance": mean("hd"),
+            f"hausdorff_distance_{self.percentile:g}": mean("hd95"),
+            "average_surface_distance": mean("asd"),
+            "surface_distance_empty": len(self.values) - len(finite),
+        }
+
 
 class MetricsManager:
     def __init__(
@@ -118,8 +424,21 @@ class MetricsManager:
         sigmoid: bool = True,
         binary: bool = True,
         binary_threshold: float = 0.5,
+        async_update: bool = False,
+        max_pending: int = 4,
     ):
-        """Initialize the MetricsManager with a dictionary of metric objects."""
+        """Initialize the MetricsManager with a dictionary of metric objects.
+
+        Args:
+            metrics: The metrics by name.
+            sigmoid: Apply a sigmoid to the predictions.
+            binary: Threshold the predictions.
+            binary_threshold: Threshold of the binary predictions.
+            async_update: Update the CPU metrics in background threads (one per metric, so each metric
+                sees the batches in order) with compact uint8 copies of the batches, while the caller
+                continues with the next batch. The results are gathered in `aggregate`.
+            max_pending: Maximum number of queued batches per metric in async mode, bounds the memory.
+        """
         # check that 'loss' isn't in the metrics
         if "loss" in metrics:
             msg = (
@@ -127,20 +446,55 @@ class MetricsManager:
                 "should not be included in the metrics."
             )
             raise ValueError(msg)
+        if async_update and not binary:
+            msg = "Asynchronous metric updates require binary predictions"
+            raise ValueError(msg)
         self.metrics = metrics
         self.results = {name: None for name in metrics}
         self.sigmoid = sigmoid
         self.binary = binary
         self.binary_threshold = binary_threshold
+        self.async_update = async_update
+        self.max_pending = max_pending
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+        self._pending: dict[str, deque[Future]] = {name: deque() for name in metrics}
+
+    def __getstate__(self):
+        # the threads can't be copied
+        self.wait()
+        state = self.__dict__.copy()
+        state["_executors"] = {}
+        state["_pending"] = {name: deque() for name in self.metrics}
+        return state
+
+    @staticmethod
+    def _is_async(metric: Metric) -> bool:
+        # the confusion counts are cheap and accumulate on the device without synchronization
+        return not isinstance(metric, ConfusionMetric)
+
+    def wait(self) -> None:
+        """Wait until the pending updates are done (and raise their errors)."""
+        for pending in self._pending.values():
+            while pending:
+                pending.popleft().result()
 
     def reset(self):
         """Reset all metrics."""
+        self.wait()
         for metric in self.metrics.values():
             metric.reset()
 
     def __repr__(self):
         return f"MetricsManager({list(self.metrics.keys())})"
 
+    def _submit(self, name: str, y_pred: torch.Tensor, y: torch.Tensor) -> None:
+        pending = self._pending[name]
+        while len(pending) >= self.max_pending:
+            pending.popleft().result()
+        if name not in self._executors:
+            self._executors[name] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"metric_{name}")
+        pending.append(self._executors[name].submit(self.metrics[name], y_pred=y_pred, y=y))
+
     def update(self, y_pred: torch.Tensor, y: torch.Tensor):
         """Update all metrics with the predictions and ground truth."""
         if self.sigmoid:
@@ -149,44 +503,111 @@ class MetricsManager:
         if self.binary:
             y_pred = (y_pred > self.binary_threshold).float()
 
-        for metric in self.metrics.values():
-            metric(y_pred=y_pred, y=y)
+        if not self.async_update:
+            for metric in self.metrics.values():
+                metric(y_pred=y_pred, y=y)
+            return
+
+        host_batch = None
+        for name, metric in self.metrics.items():
+            if not self._is_async(metric):
+                metric(y_pred=y_pred, y=y)
+                continue
+            if host_batch is None:
+                # (meta data of MetaTensors like the affine and the file names is kept)
+                host_batch = (y_pred.detach().to(torch.uint8).cpu(), y.detach().to(torch.uint8).cpu())
+            self._submit(name, *host_batch)
 
     def __call__(self, y_pred, y):
         """Update all metrics with the predictions and ground truth."""
         self.update(y_pred, y)
 
+    def update_counts(
+        self, counts: torch.Tensor, y_pred: torch.Tensor | None = None, y: torch.Tensor | None = None
+    ) -> None:
+        """Update the metrics with precomputed confusion counts (BS x 4) and binary predictions.
+
+        The confusion metrics only use the counts, the other metrics need the binary prediction
+        and the ground truth of the whole volumes.
+        """
+        for name, metric in self.metrics.items():
+            if isinstance(metric, ConfusionMetric):
+                metric.update_counts(counts)
+            elif y_pred is None or y is None:
+                msg = f"The metric {name} requires the binary prediction of the whole volume"
+                raise ValueError(msg)
+            elif self.async_update:
+                self._submit(name, y_pred.detach().cpu(), y.detach().to(torch.uint8).cpu())
+            else:
+                metric(y_pred=y_pred, y=y)
+
     def aggregate(self) -> dict[str, Any]:
-        """Compute the final results for all metrics."""
-        self.results = {name: metric.aggregate().item() for name, metric in self.metrics.items()}
+        """Compute the final results for all metrics.
+
+        Metrics that compute several values return them as dict, these are added with their own names.
+        """
+        self.wait()
+        self.results = {}
+        for name, metric in self.metrics.items():
+            result = metric.aggregate()
+            if isinstance(result, dict):
+                self.results.update({key: float(value) for key, value in result.items()})
+            else:
+                self.results[name] = result.item()
         return self.results
 
     def copy(self):
         return copy.deepcopy(self)
 
+    def close(self) -> None:
+        """Stop the background threads and worker processes of the metrics."""
+        self.wait()
+        for executor in self._executors.values():
+            executor.shutdown()
+        self._executors = {}
+        for metric in self.metrics.values():
+            if hasattr(metric, "close"):
+                metric.close()
+
 
 def get_metrics(
     metric_types: tuple[MetricType] = (
         MetricType.DICE,
         MetricType.JACCARD_INDEX,
+        MetricType.PRECISION,
+        MetricType.RECALL,
         MetricType.HAUSDORFF_DISTANCE,
         MetricType.CENTERLINE_LOSS,
     ),
+    cfg: MetricsConfig | None = None,
 ) -> MetricsManager:
     """Get a dictionary of metrics based on the given metric types."""
+    cfg = cfg or MetricsConfig()
     metric_types = set(metric_types)
     metrics = {}
+    # the overlap scores share a single pass over the volumes
+    confusion_types = [
+        metric_type
+        for metric_type in MetricType
+        if metric_type in metric_types and metric_type.value in CONFUSION_SCORES
+    ]
+    if confusion_types:
+        metrics["confusion"] = ConfusionMetric(
+            scores=tuple(metric_type.value for metric_type in confusion_types),
+            reduction=cfg.confusion_reduction,
+        )
     for metric_type in metric_types:
         match metric_type:
-            case MetricType.DICE:
-                metrics["dice"] = DiceMetric(include_background=True, reduction="mean")
-            case MetricType.JACCARD_INDEX:
-                metrics["jaccard_index"] = JaccardIndex()
+            case MetricType.DICE | MetricType.JACCARD_INDEX | MetricType.PRECISION | MetricType.RECALL:
+                pass
             case MetricType.HAUSDORFF_DISTANCE:
-                metrics["hausdorff_distance"] = HausdorffDistanceMetric(
-                    include_background=True, reduction="mean"
+                metrics["hausdorff_distance"] = SurfaceDistanceMetric(
+                    use_spacing=cfg.surface_distance_in_mm
                 )
             case MetricType.CENTERLINE_LOSS:
-                metrics["centerline_loss"] = ClDiceMetric()
+                metrics["centerline_loss"] = ClDiceMetric(
+                    num_workers=cfg.cldice_num_workers,
+                    cache_targets=cfg.cldice_cache_targets,
+                )
 
-    return MetricsManager(metrics)
+    return MetricsManager(metrics, async_update=cfg.async_update, max_pending=cfg.max_pending)
@@ -0,0 +1,149 @@
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import mlflow
+import torch
+from hydra.core.config_store import ConfigStore
+from torch.profiler import ProfilerActivity, profile, schedule
+
+from ml4mip.utils.distributed import is_main_process
+
+logger = logging.getLogger(__name__)
+
+# number of allocation events kept for the CUDA memory snapshot
+MEMORY_HISTORY_ENTRIES = 100_000
+
+
+@dataclass
+class ProfilerConfig:
+    # profile a few scheduled windows of steps instead of whole epochs
+    enabled: bool = False
+    # epochs in which the profiler runs
+    epochs: list[int] = field(default_factory=lambda: [0])
+    # schedule per window: skip `wait` steps, warm up for `warmup` steps, record `active` steps
+    wait: int = 1
+    warmup: int = 1
+    active: int = 3
+    # number of windows per epoch (0: until the epoch ends)
+    repeat: int = 1
+    record_shapes: bool = False
+    profile_memory: bool = False
+    with_stack: bool = False
+    # export the memory timeline of every window as html (implies record_shapes, profile_memory and with_stack)
+    memory_timeline: bool = False
+    # dump a CUDA allocation snapshot after every window, see https://pytorch.org/memory_viz
+    memory_snapshot: bool = False
+    output_dir: str = "profiler"
+    # log the exported files as MLflow artifacts of the active run
+    log_artifacts: bool = True
+
+
+_cs = ConfigStore.instance()
+_cs.store(
+    name="base_profiler_config",
+    node=ProfilerConfig,
+)
+
+
+class StepProfiler:
+    """Torch profiler driven by a wait/warmup/active/repeat schedule over the training steps.
+
+    `step` must be called after every batch. At the end of each active window the trace (and
+    optionally the memory timeline and allocation snapshot) is written to its own files in
+    `output_dir` and logged as MLflow artifacts, so the traces stay small and the remaining steps
+    of the epoch run without profiling overhead.
+    """
+
+    def __init__(
+        self,
+        output_dir: str | Path = "profiler",
+        prefix: str = "",
+        wait: int = 1,
+        warmup: int = 1,
+        active: int = 3,
+        repeat: int = 1,
+        record_shapes: bool = False,
+        profile_memory: bool = False,
+        with_stack: bool = False,
+        memory_timeline: bool = False,
+        memory_snapshot: bool = False,
+        log_artifacts: bool = True,
+    ):
+        if active < 1:
+            msg = f"active must be at least 1, got {active}"
+            raise ValueError(msg)
+        self.output_dir = Path(output_dir)
+        self.prefix = prefix
+        self.memory_timeline = memory_timeline
+        self.memory_snapshot = memory_snapshot and torch.cuda.is_available()
+        self.log_artifacts = log_artifacts
+        self.window = 0
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self._profile = profile(
+            activities=activities,
+            schedule=schedule(wait=wait, warmup=warmup, active=active, repeat=repeat),
+            on_trace_ready=self._on_trace_ready,
+            # the memory timeline is computed from the shapes, allocations and stacks
+            record_shapes=record_shapes or memory_timeline,
+            profile_memory=profile_memory or memory_timeline,
+            with_stack=with_stack or memory_timeline,
+        )
+
+    @classmethod
+    def from_config(cls, cfg: ProfilerConfig, prefix: str = "") -> "StepProfiler":
+        return cls(
+            output_dir=cfg.output_dir,
+            prefix=prefix,
+            wait=cfg.wait,
+            warmup=cfg.warmup,
+            active=cfg.active,
+            repeat=cfg.repeat,
+            record_shapes=cfg.record_shapes,
+            profile_memory=cfg.profile_memory,
+            with_stack=cfg.with_stack,
+            memory_timeline=cfg.memory_timeline,
+            memory_snapshot=cfg.memory_snapshot,
+            log_artifacts=cfg.log_artifacts,
+        )
+
+    def step(self) -> None:
+        """Mark the end of a training step."""
+        self._profile.step()
+
+    def _on_trace_ready(self, prof: profile) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{self.prefix}window_{self.window}"
+        self.window += 1
+
+        logger.info(prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=20))
+        paths = [self.output_dir / f"{stem}_trace.json"]
+        prof.export_chrome_trace(str(paths[-1]))
+        if self.memory_timeline:
+            paths.append(self.output_dir / f"{stem}_memory_timeline.html")
+            prof.export_memory_timeline(str(paths[-1]))
+        if self.memory_snapshot:
+            paths.append(self.output_dir / f"{stem}_memory_snapshot.pickle")
+            torch.cuda.memory._dump_snapshot(str(paths[-1]))
+
+        msg = f"Profiler window written to {', '.join(str(path) for path in paths)}"
+        logger.info(msg)
+        if self.log_artifacts and is_main_process() and mlflow.active_run() is not None:
+            for path in paths:
+                mlflow.log_artifact(str(path), artifact_path="profiler")
+
+    def __enter__(self) -> "StepProfiler":
+        if self.memory_snapshot:
+            torch.cuda.memory._record_memory_history(max_entries=MEMORY_HISTORY_ENTRIES)
+        self._profile.__enter__()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        try:
+            self._profile.__exit__(*exc_info)
+        finally:
+            if self.memory_snapshot:
+                torch.cuda.memory._record_memory_history(enabled=None)
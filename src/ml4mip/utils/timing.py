@@ -0,0 +1,86 @@
+import time
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+import torch
+from torch.profiler import record_function
+
+
+def _range(name: str):
+    # record_function is only needed (and only worth its overhead) while the profiler records
+    return record_function(name) if torch.autograd._profiler_enabled() else nullcontext()
+
+
+class PhaseTimer:
+    """Lightweight wall-clock timers for the phases of a training or validation step.
+
+    The durations of every phase are collected per batch and summarized into percentiles
+    once per epoch. Besides a `perf_counter` call per phase boundary there is no overhead.
+
+    CUDA kernels run asynchronously, so with `sync_cuda` the device is synchronized at the
+    end of each phase to attribute the GPU time to the phase that launched it. The training
+    loop synchronizes every batch anyway (`loss.item()`), so this barely changes the step time.
+
+    While a torch profiler is recording, every phase is also marked as a `record_function` range.
+    """
+
+    def __init__(self, sync_cuda: bool = False, percentiles: tuple[int, ...] = (50, 90, 99)):
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.percentiles = percentiles
+        self.reset()
+
+    def reset(self) -> None:
+        self.durations: dict[str, list[float]] = defaultdict(list)
+        self.samples = 0
+        self.voxels = 0
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            with _range(name):
+                yield
+        finally:
+            if self.sync_cuda:
+                torch.cuda.synchronize()
+            self.durations[name].append(time.perf_counter() - start)
+
+    def time_iter(self, iterable: Iterable, name: str = "data_wait") -> Iterator:
+        """Iterate and record the time spent waiting for each item (e.g. the next batch)."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                with _range(name):
+                    item = next(iterator)
+            except StopIteration:
+                return
+            self.durations[name].append(time.perf_counter() - start)
+            yield item
+
+    def count(self, images: torch.Tensor) -> None:
+        """Count the samples and voxels of a batch (B x C x H x W x D) for the throughput."""
+        self.samples += images.shape[0]
+        self.voxels += images.shape[0] * images[0, 0].numel()
+
+    def summary(self) -> dict[str, float]:
+        """Summarize the epoch: percentiles and share of each phase, samples/sec and voxels/sec.
+
+        Durations are reported in milliseconds, `epoch_time` in seconds.
+        """
+        elapsed = time.perf_counter() - self._start
+        results = {}
+        for name, durations in self.durations.items():
+            values = np.asarray(durations) * 1000
+            for q, value in zip(self.percentiles, np.percentile(values, self.percentiles), strict=True):
+                results[f"{name}_p{q}_ms"] = float(value)
+            # a high data_wait share means the run is input bound
+            results[f"{name}_share"] = float(values.sum() / 1000 / elapsed) if elapsed > 0 else 0.0
+
+        results["epoch_time"] = elapsed
+        results["samples_per_sec"] = self.samples / elapsed if elapsed > 0 else 0.0
+        results["voxels_per_sec"] = self.voxels / elapsed if elapsed > 0 else 0.0
+        return results
@@ -1,10 +1,14 @@
 import logging
+import pickle
 from pathlib import Path
 
 import mlflow
 import torch
 from torch import nn
 
+from ml4mip.utils.checkpoint import read_index
+from ml4mip.utils.distributed import unwrap_model
+
 logger = logging.getLogger(__name__)
 
 
@@ -44,7 +48,7 @@ def save_model(model, model_path: str | Path):
         # create a new file name
         model_path = model_path.with_name(new_name + model_path.suffix)
 
-    torch.save(model.state_dict(), model_path)
+    torch.save(unwrap_model(model).state_dict(), model_path)
     msg = f"Model saved to {model_path}"
     logger.info(msg)
 
@@ -57,41 +61,53 @@ def save_model(model, model_path: str | Path):
             logger.exception(msg)
 
 
-def save_checkpoint(model, optimizer, epoch, checkpoint_dir: str | Path, scheduler=None):
-    checkpoint_dir = Path(checkpoint_dir)
-    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+def find_checkpoints(checkpoint_dir: str | Path) -> list[Path]:
+    """Return the checkpoints of a directory, newest first.
 
-    path = checkpoint_dir / f"checkpoint_{epoch}.pt"
-    if path.exists():
-        msg = f"Checkpoint {path} already exists. Overwriting..."
-        logger.warning(msg)
+    The index written by the `CheckpointManager` is preferred. Directories without an index
+    fall back to the modification time of the checkpoint files.
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    index = read_index(checkpoint_dir)
+    if index is not None:
+        names = [entry["file"] for entry in sorted(index["checkpoints"], key=lambda e: -e["epoch"])]
+        if index.get("latest") in names:
+            names.remove(index["latest"])
+            names.insert(0, index["latest"])
+        paths = [checkpoint_dir / name for name in names if (checkpoint_dir / name).is_file()]
+        if paths:
+            return paths
 
-    torch.save(
-        {
-            "model_state_dict": model.state_dict(),
-            "optimizer_state_dict": optimizer.state_dict(),
-            "scheduler_state_dict": scheduler.state_dict() if scheduler else None,
-            "epoch": epoch,
-        },
-        path,
-    )
+    checkpoints = list(checkpoint_dir.glob("checkpoint_*.pt"))
+    return sorted(checkpoints, key=lambda fname: fname.stat().st_mtime, reverse=True)
 
 
 # Load checkpoint
 def load_checkpoint(model, optimizer, checkpoint_dir: str | Path, scheduler=None) -> int:
     checkpoint_dir = Path(checkpoint_dir)
     # Find the latest checkpoint
-    checkpoints = list(checkpoint_dir.glob("checkpoint_*.pt"))
+    checkpoints = find_checkpoints(checkpoint_dir)
     if not checkpoints:
         msg = f"No checkpoints found in {checkpoint_dir}"
         logger.info(msg)
         return 0
 
-    path = max(checkpoints, key=lambda fname: fname.stat().st_mtime)
-    msg = f"Loading checkpoint from {path}"
-    logger.info(msg)
+    checkpoint = None
+    for path in checkpoints:
+        msg = f"Loading checkpoint from {path}"
+        logger.info(msg)
+        try:
+            checkpoint = torch.load(path, map_location=detect_device())
+            break
+        except (RuntimeError, EOFError, OSError, pickle.UnpicklingError) as e:
+            # e.g. a checkpoint that was interrupted while being written by an older version
+            msg = f"Skipping unreadable checkpoint {path}: {e}"
+            logger.warning(msg)
+
+    if checkpoint is None:
+        msg = f"None of the checkpoints in {checkpoint_dir} could be loaded"
+        raise RuntimeError(msg)
 
-    checkpoint = torch.load(path, map_location=detect_device())
     required_keys = ["model_state_dict", "optimizer_state_dict", "epoch"]
     for key in required_keys:
         if key not in checkpoint:
@@ -13,6 +13,7 @@ from torch import nn
 from torch.utils.data import DataLoader
 
 from ml4mip import trainer
+from ml4mip.loss import split_target_skeleton
 
 logger = logging.getLogger(__name__)
 
@@ -541,6 +542,7 @@ def run_inference_and_plot(
         img = img.to(device)  # Move to the correct device
         mask = mask.to(device)
         pred = inferer(img)
+        mask, _ = split_target_skeleton(pred, mask)
         if sigmoid:
             pred = torch.sigmoid(pred)
 
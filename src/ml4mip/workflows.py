@@ -1,7 +1,6 @@
-import gc
 import logging
-import resource
 import sys
+from contextlib import nullcontext
 from dataclasses import dataclass, field
 from functools import partial
 from multiprocessing import Pool
@@ -14,35 +13,44 @@ import nibabel as nib
 import torch
 from graph_extraction import connected_component_distance_filter
 from hydra.core.config_store import ConfigStore
-from monai.transforms import (
-    Compose,
-    ResizeWithPadOrCrop,
-    SaveImage,
-    ScaleIntensity,
-    Spacing,
-    ToTensor,
-)
 from omegaconf import MISSING, OmegaConf
 from torch import optim
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from ml4mip import trainer
+from ml4mip.async_validation import AsyncValidationConfig, AsyncValidator
 from ml4mip.dataset import (
-    TARGET_PIXEL_DIM,
-    TARGET_SPATIAL_SIZE,
     DataLoaderConfig,
     ImageDataset,
     UnlabeledDataset,
     get_dataset,
-    reshape_to_original,
+    get_inference_transform,
 )
 from ml4mip.graph_extraction import ExtractionConfig, extract_graph
 from ml4mip.loss import LossConfig, get_loss
 from ml4mip.models import ModelConfig, get_model
+from ml4mip.pipeline import PipelineConfig, run_pipeline
 from ml4mip.scheduler import SchedulerConfig, get_scheduler
-from ml4mip.utils.logging import log_hydra_config_to_mlflow, log_metrics
-from ml4mip.utils.metrics import MetricType, get_metrics
+from ml4mip.utils.checkpoint import CheckpointConfig
+from ml4mip.utils.distributed import (
+    DistributedConfig,
+    cleanup_distributed,
+    get_sampler,
+    get_world_size,
+    init_distributed,
+    is_main_process,
+    unwrap_model,
+    wrap_model,
+)
+from ml4mip.utils.logging import (
+    MlflowLoggingConfig,
+    buffered_mlflow_logging,
+    log_hydra_config_to_mlflow,
+    log_metrics,
+)
+from ml4mip.utils.metrics import MetricsConfig, MetricType, get_metrics
+from ml4mip.utils.profiling import ProfilerConfig
 from ml4mip.utils.torch import load_checkpoint, save_model
 from ml4mip.visualize import visualize_model
 
@@ -66,9 +74,15 @@ class Config:
     extract_graph: bool = False
     epoch_profiling_torch: bool = False
     epoch_profiling_cpy: bool = False
+    profiler: ProfilerConfig = field(default_factory=ProfilerConfig)
     inference: trainer.InferenceConfig = field(default_factory=trainer.InferenceConfig)
     loss: LossConfig = field(default_factory=LossConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
     scheduler: SchedulerConfig = field(default_factory=SchedulerConfig)
+    distributed: DistributedConfig = field(default_factory=DistributedConfig)
+    checkpoint: CheckpointConfig = field(default_factory=CheckpointConfig)
+    async_validation: AsyncValidationConfig = field(default_factory=AsyncValidationConfig)
+    mlflow_logging: MlflowLoggingConfig = field(default_factory=MlflowLoggingConfig)
 
 
 _cs = ConfigStore.instance()
@@ -78,6 +92,11 @@ _cs.store(
 )
 
 
+def _mlflow_logging(cfg: MlflowLoggingConfig):
+    """Buffer the MLflow logging of the active run if configured."""
+    return buffered_mlflow_logging(cfg.flush_interval, cfg.max_attempts) if cfg.buffered else nullcontext()
+
+
 @hydra.main(
     version_base=None,
     config_path="conf",
@@ -92,16 +111,38 @@ def run_training(cfg: Config) -> None:
 
     logger.info("Starting model training script")
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if cfg.distributed.enabled:
+        device = init_distributed(cfg.distributed)
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    try:
+        _run_training(cfg, device)
+    finally:
+        cleanup_distributed()
+
+
+def _run_training(cfg: Config, device: torch.device) -> None:
     train_ds, val_ds = get_dataset(cfg.dataset)
+    # with DDP every rank only sees its own shard of the datasets
+    train_sampler = get_sampler(train_ds, shuffle=True)
+    val_sampler = get_sampler(val_ds, shuffle=False)
     train_loader = DataLoader(
-        train_ds, batch_size=cfg.batch_size, shuffle=True, pin_memory=torch.cuda.is_available()
+        train_ds,
+        batch_size=cfg.batch_size,
+        shuffle=train_sampler is None,
+        sampler=train_sampler,
+        pin_memory=torch.cuda.is_available(),
     )
     val_loader = DataLoader(
-        val_ds, batch_size=cfg.batch_size, shuffle=False, pin_memory=torch.cuda.is_available()
+        val_ds,
+        batch_size=cfg.batch_size,
+        shuffle=False,
+        sampler=val_sampler,
+        pin_memory=torch.cuda.is_available(),
     )
 
-    msg = f"Training on {len(train_ds)} samples"
+    msg = f"Training on {len(train_ds)} samples ({get_world_size()} process(es))"
     logger.info(msg)
 
     # Model and optimizer
@@ -142,36 +183,65 @@ def run_training(cfg: Config) -> None:
         msg = f"Starting training from scratch with {current_epoch} epochs (no checkpoint found)"
         logger.info(msg)
 
+    # wrap after loading the checkpoint, so the state dict keys match
+    model = wrap_model(model, device)
+
     loss_fn = get_loss(cfg.loss)
     metrics = get_metrics(metric_types=[MetricType.DICE])
-    metrics_val = get_metrics()
+    metrics_val = get_metrics(cfg=cfg.metrics)
 
-    # Initialize MLflow
-    mlflow.set_tracking_uri(cfg.ml_flow_uri)  # Update path as needed
-    mlflow.set_experiment("model_training")
+    # Only rank 0 talks to MLflow
+    if is_main_process():
+        mlflow.set_tracking_uri(cfg.ml_flow_uri)  # Update path as needed
+        mlflow.set_experiment("model_training")
 
     try:
-        with mlflow.start_run(run_name="training_run"):
+        with (
+            mlflow.start_run(run_name="training_run") if is_main_process() else nullcontext(),
+            _mlflow_logging(cfg.mlflow_logging),
+        ):
             # Log configuration parameters
             log_hydra_config_to_mlflow(cfg)
+            async_validator = None
+            if cfg.async_validation.enabled and is_main_process():
+                # the worker validates the full (unsharded) validation set
+                async_validator = AsyncValidator.from_config(
+                    cfg.async_validation,
+                    model_cfg=cfg.model,
+                    loss_cfg=cfg.loss,
+                    metrics_cfg=cfg.metrics,
+                    dataset=val_ds,
+                    inference_cfg=cfg.inference,
+                    batch_size=cfg.batch_size,
+                    tracking_uri=mlflow.get_tracking_uri(),
+                    run_id=mlflow.active_run().info.run_id,
+                )
             # Train the model and log metrics
-            trainer.train(
-                model=model,
-                train_loader=train_loader,
-                optimizer=optimizer,
-                loss_fn=loss_fn,
-                metrics=metrics,
-                metrics_val=metrics_val,
-                device=device,
-                current_epoch=current_epoch,
-                num_epochs=cfg.num_epochs,
-                val_loader=val_loader,
-                inference_cfg=cfg.inference,
-                checkpoint_dir=checkpoint_dir,
-                scheduler=scheduler,
-                torch_profiling=cfg.epoch_profiling_torch,
-                cpython_profiling=cfg.epoch_profiling_cpy,
-            )
+            with async_validator or nullcontext():
+                trainer.train(
+                    model=model,
+                    train_loader=train_loader,
+                    optimizer=optimizer,
+                    loss_fn=loss_fn,
+                    metrics=metrics,
+                    metrics_val=metrics_val,
+                    device=device,
+                    current_epoch=current_epoch,
+                    num_epochs=cfg.num_epochs,
+                    # with async validation no rank validates in the training loop
+                    val_loader=None if cfg.async_validation.enabled else val_loader,
+                    inference_cfg=cfg.inference,
+                    checkpoint_dir=checkpoint_dir,
+                    scheduler=scheduler,
+                    torch_profiling=cfg.epoch_profiling_torch,
+                    cpython_profiling=cfg.epoch_profiling_cpy,
+                    profiler_cfg=cfg.profiler,
+                    checkpoint_cfg=cfg.checkpoint,
+                    async_validator=async_validator,
+                )
+
+            if not is_main_process():
+                return
 
             # Save and log the final model
             save_model(
@@ -181,7 +251,7 @@ def run_training(cfg: Config) -> None:
             if cfg.visualize_model:
                 visualize_model(
                     val_loader,
-                    model,
+                    unwrap_model(model),
                     device,
                     val_batches=cfg.visualize_model_val_batches,
                     sigmoid=True,
@@ -195,10 +265,15 @@ def run_training(cfg: Config) -> None:
         # Handle manual stopping
         logger.info("Manual stopping detected. Saving model state...")
         # Save and log the final model
-        save_model(
-            model,
-            checkpoint_dir / "manual_stop_model",
-        )
+        if is_main_process():
+            save_model(
+                model,
+                checkpoint_dir / "manual_stop_model",
+            )
+    finally:
+        # stop the worker processes and threads of the CPU metrics
+        metrics.close()
+        metrics_val.close()
 
 
 @hydra.main(version_base=None, config_path="conf", config_name="config")
@@ -223,63 +298,44 @@ def run_validation(cfg: Config):
     model = model.to(device)
 
     loss_fn = get_loss(cfg.loss)
-    metrics = get_metrics()
+    metrics = get_metrics(cfg=cfg.metrics)
 
     # Initialize MLflow
     mlflow.set_tracking_uri(cfg.ml_flow_uri)  # Update path as needed
     mlflow.set_experiment("model_evaluation")
 
-    with mlflow.start_run(run_name="evaluation_run"):
-        # Log configuration details as parameters
-        log_hydra_config_to_mlflow(cfg)
+    try:
+        with mlflow.start_run(run_name="evaluation_run"), _mlflow_logging(cfg.mlflow_logging):
+            # Log configuration details as parameters
+            log_hydra_config_to_mlflow(cfg)
 
-        val_result = trainer.validate(
-            model=model,
-            val_loader=val_loader,
-            loss_fn=loss_fn,
-            metrics=metrics,
-            device=device,
-            inference_cfg=cfg.inference,
-        )
-        log_metrics(
-            "val",
-            val_result,
-            step=0,
-            logger=logger,
-        )
-        if cfg.visualize_model:
-            visualize_model(
-                val_loader,
-                model,
-                device,
-                val_batches=cfg.visualize_model_val_batches,
-                sigmoid=True,
-                plot_3d=cfg.plot_3d,
-                extract_graph=(extract_graph if cfg.extract_graph else None),
+            val_result = trainer.validate(
+                model=model,
+                val_loader=val_loader,
+                loss_fn=loss_fn,
+                metrics=metrics,
+                device=device,
                 inference_cfg=cfg.inference,
             )
-
-
-def log_memory_usage():
-    """Logs the current CPU and GPU memory usage."""
-    # CPU memory usage
-    memory_usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
-    memory_usage_mb = memory_usage / 1024
-    logger.info(f"CPU memory usage: {memory_usage_mb:.2f} MB")
-
-    # GPU memory usage (if CUDA is available)
-    if torch.cuda.is_available():
-        allocated = torch.cuda.memory_allocated() / 1024**2
-        reserved = torch.cuda.memory_reserved() / 1024**2
-        max_allocated = torch.cuda.max_memory_allocated() / 1024**2
-        max_reserved = torch.cuda.max_memory_reserved() / 1024**2
-
-        logger.info(
-            f"GPU memory usage - Allocated: {allocated:.2f} MB, Reserved: {reserved:.2f} MB"
-        )
-        logger.info(
-            f"GPU memory peak - Max Allocated: {max_allocated:.2f} MB, Max Reserved: {max_reserved:.2f} MB"
-        )
+            log_metrics(
+                "val",
+                val_result,
+                step=0,
+                logger=logger,
+            )
+            if cfg.visualize_model:
+                visualize_model(
+                    val_loader,
+                    model,
+                    device,
+                    val_batches=cfg.visualize_model_val_batches,
+                    sigmoid=True,
+                    plot_3d=cfg.plot_3d,
+                    extract_graph=(extract_graph if cfg.extract_graph else None),
+                    inference_cfg=cfg.inference,
+                )
+    finally:
+        metrics.close()
 
 
 @dataclass
@@ -290,6 +346,11 @@ class RunInferenceConfig:
     input_dir: str = MISSING
     output_dir: str = MISSING
     num_workers: int = 4
+    # resample the outputs onto the original grid before thresholding (single interpolation),
+    # otherwise the thresholded masks are resampled with `reshape_to_original`
+    resample_logits: bool = True
+    # overlapping loading, inference and writing of the cases
+    pipeline: PipelineConfig = field(default_factory=PipelineConfig)
 
 
 _cs.store(
@@ -312,20 +373,7 @@ def run_inference(cfg: RunInferenceConfig):
 
     ds = ImageDataset(
         data_dir=cfg.input_dir,
-        transform=Compose(
-            [
-                Spacing(
-                    pixdim=TARGET_PIXEL_DIM,
-                    mode="bilinear",
-                ),
-                ScaleIntensity(minv=0.0, maxv=1.0),
-                ResizeWithPadOrCrop(
-                    spatial_size=TARGET_SPATIAL_SIZE,
-                    mode="edge",
-                ),
-                ToTensor(),
-            ]
-        ),
+        transform=get_inference_transform(),
     )
     dataloader = DataLoader(
         ds,
@@ -334,47 +382,16 @@ def run_inference(cfg: RunInferenceConfig):
         num_workers=cfg.num_workers,
         pin_memory=torch.cuda.is_available(),
     )
-    Path(cfg.output_dir).mkdir(parents=True, exist_ok=True)
-    save_output = SaveImage(
+    run_pipeline(
+        model=model,
+        batches=dataloader,
+        inference_cfg=cfg.inference,
         output_dir=cfg.output_dir,
-        output_ext="label.nii.gz",
-        separate_folder=False,
-        print_log=True,
+        cfg=cfg.pipeline,
+        device=device,
+        resample_logits=cfg.resample_logits,
     )
 
-    for images in tqdm(dataloader):
-        log_memory_usage()
-        images = images.to(device)
-        with torch.no_grad():
-            output = trainer.inference(
-                images=images,
-                model=model,
-                cfg=cfg.inference,
-            )
-
-            # output is of shape (bs, c, h, w, d)
-            # iterate over batch size
-            for j in range(output.shape[0]):
-                pred = output[j]
-                binary_mask = pred >= 0.5
-                reshaped_mask = reshape_to_original(binary_mask)
-                reshaped_mask = reshaped_mask >= 0.5
-                save_output(reshaped_mask.squeeze(0).cpu().detach(), meta_data=pred.meta)
-
-                del reshaped_mask, pred, binary_mask
-
-        del output, images
-        # run python garbage collection and empty gpu cache to prevent full memory training stops
-        gc.collect()
-        torch.cuda.empty_cache()
-
-    for file in Path(cfg.output_dir).glob("*_trans*"):
-        # Remove 'label_trans.' from the filename
-        new_name = file.name.replace("img_trans.", "").replace("label_trans.", "")
-        new_path = file.with_name(new_name)
-        file.rename(new_path)
-        logger.info("Renamed %s to %s", file.name, new_name)
-
 
 @dataclass
 class RunGraphExtractionConfig:
@@ -0,0 +1,18 @@
+import pytest
+import torch
+from torch import nn
+
+from ml4mip.export import export_torchscript
+from ml4mip.models import ModelConfig, ModelType, get_model
+
+
+@pytest.fixture
+def exported_models(tmp_path) -> list[nn.Module]:
+    """Two frozen TorchScript models with different weights, loaded with `get_model` (on the CPU)."""
+    torch.manual_seed(0)
+    models = []
+    for idx in range(2):
+        path = tmp_path / f"model_{idx}.pt"
+        export_torchscript(nn.Conv3d(1, 1, kernel_size=3, padding=1), path, torch.rand(1, 1, 16, 16, 16))
+        models.append(get_model(ModelConfig(model_type=ModelType.TORCHSCRIPT, base_model_jit_path=str(path))).cpu())
+    return models
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import mlflow
+import pytest
+import torch
+from mlflow.tracking import MlflowClient
+from torch.utils.data import TensorDataset
+
+from ml4mip.async_validation import AsyncValidator
+from ml4mip.loss import LossConfig
+from ml4mip.models import ModelConfig, ModelType, get_model
+from ml4mip.trainer import InferenceConfig, InferenceMode
+
+MODEL_CFG = ModelConfig(model_type=ModelType.UNETMONAI1)
+
+
+def _validator(**kwargs) -> AsyncValidator:
+    masks = torch.zeros(2, 1, 32, 32, 32)
+    masks[:, :, 8:24, 8:24, 8:24] = 1
+    dataset = TensorDataset(torch.rand(2, 1, 32, 32, 32), masks)
+    return AsyncValidator(
+        model_cfg=MODEL_CFG,
+        loss_cfg=LossConfig(),
+        dataset=dataset,
+        inference_cfg=InferenceConfig(mode=InferenceMode.STD),
+        device="cpu",
+        **kwargs,
+    )
+
+
+def test_results_are_logged_at_the_epoch_step(tmp_path):
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    mlflow.set_tracking_uri(tracking_uri)
+    with mlflow.start_run() as run:
+        run_id = run.info.run_id
+    model = get_model(MODEL_CFG)
+
+    with _validator(max_lag=2, tracking_uri=tracking_uri, run_id=run_id) as validator:
+        validator.submit(model, epoch=3, num_epochs=5)
+        validator.submit(model, epoch=4, num_epochs=5)
+    results = validator.results()
+
+    assert [epoch for epoch, _ in results] == [3, 4]
+    assert all("dice" in val_result for _, val_result in results)
+    history = MlflowClient(tracking_uri).get_metric_history(run_id, "val_dice")
+    assert sorted(metric.step for metric in history) == [3, 4]
+
+
+def test_submit_blocks_at_max_lag():
+    model = get_model(MODEL_CFG)
+    with _validator(max_lag=1) as validator:
+        # a pending validation occupies the only slot
+        assert validator._slots.acquire(timeout=10)
+        submitted = threading.Event()
+        thread = threading.Thread(target=lambda: (validator.submit(model, epoch=0, num_epochs=1), submitted.set()))
+        thread.start()
+        assert not submitted.wait(timeout=1.5)
+
+        validator._slots.release()
+        assert submitted.wait(timeout=10)
+        thread.join()
+    assert [epoch for epoch, _ in validator.results()] == [0]
+
+
+def test_dead_worker_is_reported():
+    model = get_model(MODEL_CFG)
+    validator = _validator(max_lag=1)
+    try:
+        assert validator._slots.acquire(timeout=10)
+        validator._process.kill()
+        start = time.monotonic()
+        with pytest.raises(RuntimeError, match="died"):
+            validator.submit(model, epoch=0, num_epochs=1)
+        assert time.monotonic() - start < 10
+    finally:
+        validator.terminate()
+
+    # a snapshot the worker fails on
+    validator = _validator(max_lag=1)
+    validator.submit(torch.nn.Linear(3, 1), epoch=0, num_epochs=1)
+    with pytest.raises(RuntimeError, match="failed"):
+        validator.close()
+
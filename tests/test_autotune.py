@@ -0,0 +1,81 @@
+import dataclasses
+import json
+
+import pytest
+import torch
+from torch import nn
+
+from ml4mip.autotune import AutotuneResult, autotuned, cache_key, load_cache, save_result, size_multiple, tune
+from ml4mip.models import ModelConfig, ModelType, get_model
+from ml4mip.trainer import InferenceConfig, inference
+
+
+def small_model() -> nn.Module:
+    return nn.Sequential(
+        nn.MaxPool3d(2),
+        nn.Conv3d(1, 1, kernel_size=3, padding=1),
+        nn.Upsample(scale_factor=2),
+    ).eval()
+
+
+def test_size_multiple():
+    assert size_multiple(small_model()) == 2
+    assert size_multiple(get_model(ModelConfig(model_type=ModelType.UNET))) == 8
+    assert size_multiple(get_model(ModelConfig(model_type=ModelType.UNETMONAI2))) == 32
+
+
+def test_exported_models_have_different_cache_keys(exported_models):
+    device = torch.device("cpu")
+    assert cache_key(exported_models[0], device) != cache_key(exported_models[1], device)
+
+
+def test_tune_picks_a_compatible_configuration():
+    result = tune(small_model(), torch.device("cpu"), window_sizes=[15, 16, 32], max_batch_size=4, repeats=1)
+    assert result.sw_size in [(16, 16, 16), (32, 32, 32)]
+    assert result.sw_batch_size in [1, 2, 4]
+    assert result.voxels_per_sec > 0
+
+    with pytest.raises(ValueError, match="multiple"):
+        tune(small_model(), torch.device("cpu"), window_sizes=[15])
+
+
+class AllocationFailure(nn.Module):
+    def forward(self, x):
+        if x.shape[0] > 2:
+            msg = "DefaultCPUAllocator: can't allocate memory: you tried to allocate 1099511627776 bytes."
+            raise RuntimeError(msg)
+        return x
+
+
+def test_tune_stays_within_the_memory():
+    cpu = torch.device("cpu")
+    result = tune(small_model(), cpu, window_sizes=[16], max_batch_size=16, max_voxels=2 * 16**3, repeats=1)
+    assert result.sw_batch_size <= 2
+    # the batch size before the failed allocation
+    result = tune(AllocationFailure(), cpu, window_sizes=[16], max_batch_size=16, repeats=1)
+    assert result.sw_batch_size <= 2
+
+
+def test_inference_uses_cached_result(tmp_path):
+    torch.manual_seed(0)
+    model = small_model()
+    cache_path = tmp_path / "autotune.json"
+    result = autotuned(model, torch.device("cpu"), cache_path=cache_path, window_sizes=[16, 32], repeats=1)
+    (cached,) = json.loads(cache_path.read_text()).values()
+    assert tuple(cached["sw_size"]) == result.sw_size
+
+    images = torch.rand(1, 1, 40, 36, 30)
+    cfg = InferenceConfig(sw_autotune=True, sw_autotune_cache=str(cache_path))
+    tuned_cfg = dataclasses.replace(cfg, sw_autotune=False, sw_size=result.sw_size, sw_batch_size=result.sw_batch_size)
+    with torch.no_grad():
+        assert torch.equal(inference(images, model, cfg), inference(images, model, tuned_cfg))
+
+
+def test_unreadable_cache_is_a_miss(tmp_path):
+    cache_path = tmp_path / "autotune.json"
+    # e.g. a truncated file of an older version
+    cache_path.write_text('{"key": {"sw_size": [64,')
+    assert load_cache(cache_path) == {}
+    save_result("key", AutotuneResult((64, 64, 64), 2, 1.0), cache_path)
+    assert load_cache(cache_path)["key"]["sw_batch_size"] == 2
+    assert not list(tmp_path.glob("*.tmp"))
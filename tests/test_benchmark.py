@@ -0,0 +1,26 @@
+from ml4mip.benchmark import BenchmarkConfig, compare_results, run_benchmarks
+
+
+def test_run_benchmarks_on_small_volume():
+    cfg = BenchmarkConfig(
+        only=["positive_biased_random_crop", "soft_skeletonize"],
+        repeats=2,
+        warmup=0,
+        volume_size=(64, 64, 48),
+        patch_size=(32, 32, 32),
+    )
+    results = run_benchmarks(cfg)
+    assert set(results["results"]) == {"positive_biased_random_crop", "soft_skeletonize"}
+    for result in results["results"].values():
+        assert len(result["times"]) == 2
+        assert result["min"] <= result["median"]
+
+
+def test_compare_results_flags_regressions():
+    baseline = {"results": {"a": {"median": 1.0}, "b": {"median": 1.0}, "c": {"error": "failed"}}}
+    results = {"results": {"a": {"median": 1.05}, "b": {"median": 1.5}, "c": {"median": 1.0}, "d": {"median": 1.0}}}
+    comparison = compare_results(results, baseline, tolerance=0.1)
+    assert set(comparison) == {"a", "b"}
+    assert not comparison["a"]["regression"]
+    assert comparison["b"]["regression"]
+    assert comparison["b"]["ratio"] == 1.5
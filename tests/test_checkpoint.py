@@ -0,0 +1,89 @@
+import json
+
+import pytest
+import torch
+
+from ml4mip.utils.checkpoint import INDEX_FILE, CheckpointManager, MonitorMode
+from ml4mip.utils.torch import load_checkpoint
+
+
+def _model_and_optimizer():
+    model = torch.nn.Linear(3, 1)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    return model, optimizer
+
+
+@pytest.mark.parametrize("async_write", [True, False])
+def test_retention_and_index(tmp_path, async_write):
+    model, optimizer = _model_and_optimizer()
+    dice_per_epoch = [0.2, 0.9, 0.5, 0.6, 0.4]
+
+    with CheckpointManager(
+        tmp_path, keep_last=2, monitor="dice", mode=MonitorMode.MAX, async_write=async_write
+    ) as manager:
+        for epoch, dice in enumerate(dice_per_epoch):
+            manager.save(model, optimizer, epoch=epoch, metrics={"dice": dice})
+
+    files = sorted(p.name for p in tmp_path.glob("checkpoint_*.pt"))
+    # last two plus the best one (epoch 1)
+    assert files == ["checkpoint_1.pt", "checkpoint_3.pt", "checkpoint_4.pt"]
+    assert not list(tmp_path.glob("*.tmp"))
+
+    with (tmp_path / INDEX_FILE).open() as f:
+        index = json.load(f)
+    assert index["latest"] == "checkpoint_4.pt"
+    assert index["best"]["epoch"] == 1
+    assert index["best"]["value"] == pytest.approx(0.9)
+
+
+def test_snapshot_is_independent_of_later_updates(tmp_path):
+    model, optimizer = _model_and_optimizer()
+    with CheckpointManager(tmp_path, keep_last=1) as manager:
+        expected = model.weight.detach().clone()
+        manager.save(model, optimizer, epoch=0)
+        with torch.no_grad():
+            model.weight.add_(1.0)
+
+    checkpoint = torch.load(tmp_path / "checkpoint_0.pt")
+    assert torch.equal(checkpoint["model_state_dict"]["weight"], expected)
+
+
+def test_resume_uses_index_and_skips_broken_files(tmp_path):
+    model, optimizer = _model_and_optimizer()
+    with CheckpointManager(tmp_path, keep_last=3, async_write=False) as manager:
+        for epoch in range(3):
+            manager.save(model, optimizer, epoch=epoch)
+
+    # an interrupted write of the latest checkpoint
+    (tmp_path / "checkpoint_2.pt").write_bytes(b"truncated")
+
+    new_model, new_optimizer = _model_and_optimizer()
+    epoch = load_checkpoint(new_model, new_optimizer, tmp_path)
+    assert epoch == 1
+    assert torch.equal(new_model.weight, model.weight)
+
+
+def test_invalid_keep_last(tmp_path):
+    with pytest.raises(ValueError):
+        CheckpointManager(tmp_path, keep_last=0)
+
+
+@pytest.mark.parametrize("async_write", [True, False])
+def test_late_results_select_the_best_checkpoint(tmp_path, async_write):
+    model, optimizer = _model_and_optimizer()
+    with CheckpointManager(
+        tmp_path, keep_last=2, monitor="dice", mode=MonitorMode.MAX, async_write=async_write
+    ) as manager:
+        for epoch, dice in enumerate([0.2, 0.9, 0.5, 0.6]):
+            manager.save(model, optimizer, epoch=epoch)
+            # the validation of an epoch finishes during the next one
+            manager.update_metrics(epoch, {"dice": dice})
+        # already deleted by the retention policy
+        manager.update_metrics(0, {"dice": 1.0})
+
+    assert manager.index["best"]["epoch"] == 1
+    assert sorted(p.name for p in tmp_path.glob("checkpoint_*.pt")) == [
+        "checkpoint_1.pt",
+        "checkpoint_2.pt",
+        "checkpoint_3.pt",
+    ]
@@ -5,11 +5,13 @@ import nibabel as nib
 import numpy as np
 import pytest
 import torch
+from monai.transforms import Compose, LoadImage, ResizeWithPadOrCrop, Spacing
 
 from ml4mip.dataset import (
     ABCNiftiDataset,
     GroupedNifitDataset,  # Update this with your module name
     NiftiDataset,
+    resample_to_original,
 )
 
 
@@ -239,3 +241,33 @@ def test_invalid_files():
             image_affix=("", ".img.nii.gz"),
             mask_affix=("", ".label.nii.gz"),
         )
+
+
+def test_resample_to_original_inverts_spacing_and_padding(tmp_path):
+    # a sphere as signed distance (logits) on an anisotropic grid with an offset origin
+    shape = (40, 36, 20)
+    affine = np.diag([0.5, 0.6, 1.2, 1.0])
+    affine[:3, 3] = [-10.0, 4.0, 7.0]
+    grid = np.stack(np.meshgrid(*(np.arange(size) for size in shape), indexing="ij"), axis=-1)
+    world = grid @ affine[:3, :3].T + affine[:3, 3]
+    logits = (6.0 - np.linalg.norm(world - world.mean(axis=(0, 1, 2)), axis=-1)).astype(np.float32)
+    nib.save(nib.Nifti1Image(logits, affine), tmp_path / "0.img.nii.gz")
+
+    image = LoadImage(ensure_channel_first=True)(tmp_path / "0.img.nii.gz")
+    # crops the first axis and pads the others, like the inference transforms
+    output = Compose([Spacing(pixdim=(0.8, 0.8, 0.8), mode="bilinear"), ResizeWithPadOrCrop((20, 40, 40))])(image)
+
+    mask = resample_to_original(output, threshold=0.0, slab_size=7)
+    assert mask.shape == (1, *shape)
+    assert mask.dtype == torch.uint8
+    assert np.allclose(mask.affine.numpy(), affine)
+
+    expected = logits >= 0
+    # the first axis was cropped from 25 to 20 voxels, the sphere (radius 6 mm) stays inside
+    dice = 2 * (mask[0].numpy() & expected).sum() / (mask[0].numpy().sum() + expected.sum())
+    assert dice > 0.95
+
+    values = resample_to_original(output, threshold=None)
+    assert values.dtype == torch.float32
+    inside = expected & (np.abs(logits) < 4)
+    assert np.abs(values[0].numpy()[inside] - logits[inside]).max() < 0.5
@@ -0,0 +1,79 @@
+import socket
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import TensorDataset
+
+from ml4mip.utils.distributed import (
+    all_reduce_metrics,
+    get_sampler,
+    is_main_process,
+    unwrap_model,
+    wrap_model,
+)
+
+WORLD_SIZE = 2
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _worker(rank: int, port: int, results) -> None:
+    dist.init_process_group(
+        backend="gloo",
+        init_method=f"tcp://127.0.0.1:{port}",
+        rank=rank,
+        world_size=WORLD_SIZE,
+    )
+    try:
+        # metrics are averaged over the ranks
+        reduced = all_reduce_metrics({"loss": float(rank), "dice": 0.5 + rank * 0.25})
+
+        # every rank gets a disjoint shard of the dataset
+        ds = TensorDataset(torch.arange(10))
+        sampler = get_sampler(ds, shuffle=False)
+        indices = list(sampler)
+
+        model = wrap_model(torch.nn.Linear(2, 1), torch.device("cpu"))
+        results[rank] = {
+            "reduced": reduced,
+            "indices": indices,
+            "main": is_main_process(),
+            "wrapped": isinstance(model, DistributedDataParallel),
+            "unwrapped": isinstance(unwrap_model(model), torch.nn.Linear),
+        }
+    finally:
+        dist.destroy_process_group()
+
+
+@pytest.mark.skipif(not dist.is_available(), reason="torch.distributed not available")
+def test_gloo_all_reduce_and_sharding():
+    results = mp.Manager().dict()
+    mp.spawn(_worker, args=(_free_port(), results), nprocs=WORLD_SIZE, join=True)
+
+    for rank in range(WORLD_SIZE):
+        res = results[rank]
+        assert res["reduced"]["loss"] == pytest.approx(0.5)
+        assert res["reduced"]["dice"] == pytest.approx(0.625)
+        assert res["main"] == (rank == 0)
+        assert res["wrapped"]
+        assert res["unwrapped"]
+
+    shard_0, shard_1 = results[0]["indices"], results[1]["indices"]
+    assert not set(shard_0) & set(shard_1)
+    assert sorted(shard_0 + shard_1) == list(range(10))
+
+
+def test_non_distributed_is_noop():
+    metrics = {"loss": 1.0}
+    assert all_reduce_metrics(metrics) is metrics
+    assert get_sampler(TensorDataset(torch.arange(3)), shuffle=True) is None
+    assert is_main_process()
+    model = torch.nn.Linear(2, 1)
+    assert wrap_model(model, torch.device("cpu")) is model
@@ -0,0 +1,54 @@
+import importlib.util
+
+import pytest
+import torch
+
+from ml4mip.export import ExportFormat, export_model
+from ml4mip.models import CPUModelWrapper, ModelConfig, ModelType, get_model
+from ml4mip.trainer import InferenceConfig, InferenceMode, inference
+
+ONNX_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("onnx", "onnxruntime"))
+
+
+@pytest.mark.parametrize(
+    "export_format",
+    [
+        ExportFormat.TORCHSCRIPT,
+        pytest.param(
+            ExportFormat.ONNX,
+            marks=pytest.mark.skipif(not ONNX_AVAILABLE, reason="onnx and onnxruntime are not installed"),
+        ),
+    ],
+)
+@pytest.mark.parametrize("model_type", [ModelType.UNET, ModelType.UNETMONAI1])
+def test_exported_model_matches_eager_model(tmp_path, export_format, model_type):
+    torch.manual_seed(0)
+    model = get_model(ModelConfig(model_type=model_type)).cpu().eval()
+    (model_cfg,) = export_model(model, tmp_path, [export_format], example_size=(32, 32, 32)).values()
+    exported = get_model(model_cfg)
+
+    # the spatial axes are dynamic
+    images = torch.rand(2, 1, 48, 64, 32)
+    cfg = InferenceConfig(mode=InferenceMode.SLIDING_WINDOW, sw_size=(32, 48, 32))
+    with torch.no_grad():
+        expected = inference(images, model, cfg)
+        outputs = inference(images, exported, cfg)
+    assert torch.allclose(outputs, expected, atol=1e-4)
+
+
+class LinearCPUModel(CPUModelWrapper):
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(2, 1)
+
+    def forward_cpu(self, x):
+        return self.linear(x.to(self.linear.weight.dtype))
+
+
+def test_cpu_wrapper_ignores_only_device_moves():
+    model = LinearCPUModel()
+    model.to("meta")
+    assert model.linear.weight.device == torch.device("cpu")
+    model.double()
+    assert model.linear.weight.dtype == torch.float64
+    assert model(torch.rand(3, 2)).dtype == torch.float64
@@ -0,0 +1,91 @@
+import pytest
+import torch
+from monai.data import MetaTensor
+from torch import nn
+
+from ml4mip.trainer import InferenceConfig, InferenceMode, inference, predict_mask
+from ml4mip.utils.inference_cache import CacheDtype, InferenceCacheConfig, get_inference_cache
+
+
+class CountingModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = nn.Conv3d(1, 1, kernel_size=3, padding=1)
+        self.samples = 0
+
+    def forward(self, x):
+        self.samples += x.shape[0]
+        return self.conv(x)
+
+
+@pytest.mark.parametrize(("dtype", "atol"), [(CacheDtype.FLOAT16, 1e-2), (CacheDtype.UINT8, 0.1)])
+def test_cached_inference_skips_the_model(tmp_path, dtype, atol):
+    torch.manual_seed(0)
+    model = CountingModel().eval()
+    images = MetaTensor(torch.rand(2, 1, 20, 16, 12), meta={"filename_or_obj": "case"})
+    cfg = InferenceConfig(
+        mode=InferenceMode.STD,
+        cache=InferenceCacheConfig(enabled=True, directory=str(tmp_path), dtype=dtype),
+    )
+
+    with torch.no_grad():
+        expected = inference(images, model, InferenceConfig(mode=InferenceMode.STD))
+        model.samples = 0
+        first = inference(images, model, cfg)
+        stats = {}
+        second = inference(images, model, cfg, stats=stats)
+        assert model.samples == 2
+        assert stats["inference_cache_hits"] == 1
+        assert torch.equal(first, expected)
+        assert torch.allclose(second, expected, atol=atol)
+        assert second.meta["filename_or_obj"] == "case"
+        assert torch.equal(predict_mask(images, model, cfg), (second >= 0.5).to(torch.uint8))
+
+        # only the new sample is predicted
+        mixed = torch.cat([images[:1].as_tensor(), torch.rand(1, 1, 20, 16, 12)])
+        inference(mixed, model, cfg, stats=stats)
+        assert model.samples == 3
+        assert stats["inference_cache_hits"] == 0.5
+
+        # other weights or another config are different keys
+        model.conv.weight.add_(1)
+        inference(images, model, cfg)
+        assert model.samples == 5
+        inference(images, model, InferenceConfig(mode=InferenceMode.SLIDING_WINDOW, sw_size=(8, 8, 8), cache=cfg.cache))
+        assert model.samples > 5
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = get_inference_cache(InferenceCacheConfig(directory=str(tmp_path), max_bytes=2**20 + 2**12))
+    probabilities = torch.rand(1, 64, 64, 64)  # 512 KiB as float16
+    cache.put("a", probabilities)
+    cache.put("b", probabilities)
+    assert cache.get("a") is not None
+    cache.put("c", probabilities)
+    # b was used least recently
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_exported_models_are_cached_separately(tmp_path, exported_models):
+    images = torch.rand(1, 1, 12, 12, 12)
+    # the frozen models have no state dict, only the files tell them apart
+    assert not exported_models[0].state_dict()
+    cfg = InferenceConfig(
+        mode=InferenceMode.STD, cache=InferenceCacheConfig(enabled=True, directory=str(tmp_path / "cache"))
+    )
+
+    with torch.no_grad():
+        for model in exported_models:
+            stats = {}
+            outputs = inference(images, model, cfg, stats=stats)
+            assert stats["inference_cache_hits"] == 0
+            assert torch.allclose(outputs, model(images), atol=1e-2)
+
+        # a frozen model that wasn't loaded from a file is not cached
+        unknown = torch.jit.freeze(torch.jit.script(nn.Conv3d(1, 1, kernel_size=3, padding=1).eval()))
+        stats = {}
+        inference(images, unknown, cfg, stats=stats)
+        inference(images, unknown, cfg, stats=stats)
+        assert "inference_cache_hits" not in stats
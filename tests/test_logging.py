@@ -0,0 +1,107 @@
+import mlflow
+import pytest
+from mlflow.exceptions import MlflowException
+from mlflow.protos.databricks_pb2 import INVALID_PARAMETER_VALUE
+from mlflow.tracking import MlflowClient
+
+from ml4mip.utils.logging import BufferedMlflowLogger, buffered_mlflow_logging, log_metrics
+
+
+class FakeClient:
+    def __init__(self, fail_first: bool = False):
+        self.batches = []
+        self.fail_first = fail_first
+
+    def log_batch(self, run_id, metrics=(), params=()):
+        if self.fail_first:
+            self.fail_first = False
+            msg = "store not reachable"
+            raise OSError(msg)
+        self.batches.append((run_id, list(metrics), list(params)))
+
+
+class FailingClient(FakeClient):
+    """Rejects every batch with params, fails on all batches if `unreachable`."""
+
+    def __init__(self, unreachable: bool = False):
+        super().__init__()
+        self.unreachable = unreachable
+
+    def log_batch(self, run_id, metrics=(), params=()):
+        if self.unreachable:
+            msg = "store not reachable"
+            raise OSError(msg)
+        if params:
+            msg = "Changing param values is not allowed"
+            raise MlflowException(msg, error_code=INVALID_PARAMETER_VALUE)
+        super().log_batch(run_id, metrics=metrics, params=params)
+
+
+def test_buffered_logger_preserves_order_and_chunks():
+    client = FakeClient()
+    buffered = BufferedMlflowLogger("run", flush_interval=3600, client=client)
+    buffered.log_params({"lr": 0.1, "model": "unet"})
+    for step in range(1500):
+        buffered.log_metrics({"loss": float(step)}, step=step)
+    assert client.batches == []  # nothing is sent before a flush
+
+    buffered.close()
+    params = [p for _, _, batch in client.batches for p in batch]
+    metrics = [m for _, batch, _ in client.batches for m in batch]
+    assert [p.key for p in params] == ["lr", "model"]
+    assert [m.step for m in metrics] == list(range(1500))
+    assert all(len(batch) <= 1000 for _, batch, _ in client.batches)
+
+
+def test_failed_flush_is_retried():
+    client = FakeClient(fail_first=True)
+    buffered = BufferedMlflowLogger("run", flush_interval=3600, client=client)
+    buffered.log_metrics({"dice": 0.5}, step=0)
+    with pytest.raises(OSError):
+        buffered.flush()
+    buffered.log_metrics({"dice": 0.6}, step=1)
+    buffered.close()
+
+    metrics = [m for _, batch, _ in client.batches for m in batch]
+    assert [(m.step, m.value) for m in metrics] == [(0, 0.5), (1, 0.6)]
+
+
+def test_nothing_lost_on_keyboard_interrupt(tmp_path):
+    mlflow.set_tracking_uri(tmp_path.as_uri())
+    with mlflow.start_run() as run:
+        with pytest.raises(KeyboardInterrupt), buffered_mlflow_logging(flush_interval=3600):
+            for step in range(5):
+                log_metrics("train", {"loss": 1.0 / (step + 1)}, step=step)
+            raise KeyboardInterrupt
+
+    history = MlflowClient().get_metric_history(run.info.run_id, "train_loss")
+    assert sorted(m.step for m in history) == list(range(5))
+
+
+def test_rejected_and_failing_batches_are_dropped():
+    client = FailingClient()
+    buffered = BufferedMlflowLogger("run", flush_interval=3600, client=client, max_attempts=3)
+    buffered.log_params({"lr": 0.1})
+    buffered.log_metrics({"dice": 0.5}, step=0)
+    # the rejected param doesn't block the metrics
+    buffered.flush()
+    assert [m.value for _, batch, _ in client.batches for m in batch] == [0.5]
+
+    client.unreachable = True
+    buffered.log_metrics({"dice": 0.6}, step=1)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            buffered.flush()
+    # dropped after the third attempt
+    buffered.flush()
+    client.unreachable = False
+    buffered.log_metrics({"dice": 0.7}, step=2)
+    buffered.close()
+    assert [m.value for _, batch, _ in client.batches for m in batch] == [0.5, 0.7]
+
+
+def test_close_logs_a_failed_flush(caplog):
+    buffered = BufferedMlflowLogger("run", flush_interval=3600, client=FailingClient(unreachable=True))
+    buffered.log_metrics({"dice": 0.5}, step=0)
+    buffered.close()
+    assert "1 metrics and 0 params were not logged" in caplog.text
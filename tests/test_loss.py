@@ -0,0 +1,74 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from ml4mip.loss import SoftSkeletonize, compute_loss, soft_cldice, soft_dice_cldice, target_skeleton
+
+
+@pytest.mark.parametrize("loss_cls", [soft_cldice, soft_dice_cldice])
+def test_precomputed_target_skeleton_gives_same_loss(loss_cls):
+    torch.manual_seed(0)
+    loss_fn = loss_cls()
+    masks = (torch.rand(2, 1, 16, 16, 16) > 0.7).float()
+    logits = torch.randn(2, 1, 16, 16, 16, requires_grad=True)
+
+    expected = loss_fn(logits, masks)
+    (expected_grad,) = torch.autograd.grad(expected, logits)
+
+    # the dataset appends the skeleton per sample
+    masks_with_skeleton = torch.stack([torch.cat([mask, target_skeleton(mask)]) for mask in masks])
+    loss, stripped_masks = compute_loss(loss_fn, logits, masks_with_skeleton)
+    (grad,) = torch.autograd.grad(loss, logits)
+
+    assert torch.equal(stripped_masks, masks)
+    assert torch.allclose(loss, expected)
+    assert torch.allclose(grad, expected_grad)
+
+
+def _reference_soft_skel(img, num_iter):
+    """The original (unfused) soft skeletonization."""
+
+    def erode(x):
+        if x.dim() == 4:
+            p1 = -F.max_pool2d(-x, (3, 1), (1, 1), (1, 0))
+            p2 = -F.max_pool2d(-x, (1, 3), (1, 1), (0, 1))
+            return torch.min(p1, p2)
+        p1 = -F.max_pool3d(-x, (3, 1, 1), (1, 1, 1), (1, 0, 0))
+        p2 = -F.max_pool3d(-x, (1, 3, 1), (1, 1, 1), (0, 1, 0))
+        p3 = -F.max_pool3d(-x, (1, 1, 3), (1, 1, 1), (0, 0, 1))
+        return torch.min(torch.min(p1, p2), p3)
+
+    def dilate(x):
+        if x.dim() == 4:
+            return F.max_pool2d(x, (3, 3), (1, 1), (1, 1))
+        return F.max_pool3d(x, (3, 3, 3), (1, 1, 1), (1, 1, 1))
+
+    skel = F.relu(img - dilate(erode(img)))
+    for _ in range(num_iter):
+        img = erode(img)
+        delta = F.relu(img - dilate(erode(img)))
+        skel = skel + F.relu(delta - skel * delta)
+    return skel
+
+
+@pytest.mark.parametrize("shape", [(2, 1, 20, 20), (2, 1, 12, 12, 12)])
+@pytest.mark.parametrize("use_checkpoint", [False, True])
+def test_soft_skeletonize_matches_reference(shape, use_checkpoint):
+    torch.manual_seed(0)
+    # binary targets produce many ties in the min/max operations
+    for img in (torch.rand(shape), (torch.rand(shape) > 0.5).float()):
+        img.requires_grad_(True)
+        weights = torch.rand(shape)
+
+        expected = _reference_soft_skel(img, num_iter=5)
+        (expected_grad,) = torch.autograd.grad((expected * weights).sum(), img)
+
+        skel = SoftSkeletonize(num_iter=5, checkpoint=use_checkpoint)(img)
+        (grad,) = torch.autograd.grad((skel * weights).sum(), img)
+
+        assert torch.equal(skel, expected)
+        assert torch.allclose(grad, expected_grad, atol=1e-6)
+
+        # the in-place path without gradients
+        with torch.no_grad():
+            assert torch.equal(SoftSkeletonize(num_iter=5)(img), expected)
@@ -1,8 +1,21 @@
+import copy
+
 import pytest
 import torch
+from monai.data import MetaTensor
 from monai.metrics import DiceMetric
 
-from ml4mip.utils.metrics import MetricsManager
+from ml4mip.utils import metrics as metrics_module
+from ml4mip.utils.metrics import (
+    ClDiceMetric,
+    ConfusionMetric,
+    ConfusionReduction,
+    MetricsConfig,
+    MetricsManager,
+    MetricType,
+    SurfaceDistanceMetric,
+    get_metrics,
+)
 
 
 def test_metric_manager_copy():
@@ -49,3 +62,128 @@ def test_metric_manager_copy():
     res = metrics.aggregate()
     for key in res:
         assert res[key] == pytest.approx(res_copy_avg[key], rel=1e-5)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_cldice_matches_full_volume_and_caches_targets(num_workers):
+    torch.manual_seed(0)
+    y = torch.zeros(2, 1, 24, 24, 24)
+    y[:, :, 8:16, 10:13, 4:20] = 1
+    y[1, :, 4:7, 4:20, 10:12] = 1
+    y_pred = y.clone()
+    y_pred[:, :, 8:16, 10:13, 18:22] = 1
+    y_pred[0, :, 14:16, 14:16, 14:16] = 1
+    y = MetaTensor(y, meta={"filename_or_obj": ["case_0", "case_1"]})
+
+    expected = [
+        ClDiceMetric._clDice_single(y_pred[i, 0].numpy().astype(bool), y[i, 0].numpy().astype(bool)) for i in range(2)
+    ]
+
+    metric = ClDiceMetric(num_workers=num_workers)
+    metric(y_pred=y_pred, y=y)
+    assert metric.aggregate().item() == pytest.approx(sum(expected) / 2)
+    assert set(metric._target_cache) == {"case_0", "case_1"}
+
+    # second epoch: the cached target skeletons are used
+    metric.reset()
+    metric(y_pred=y_pred, y=y)
+    assert metric.aggregate().item() == pytest.approx(sum(expected) / 2)
+
+    # a copy (e.g. MetricsManager.copy) works without the pool
+    assert copy.deepcopy(metric).aggregate().item() == pytest.approx(sum(expected) / 2)
+    metric.close()
+
+
+def test_cldice_target_cache_is_independent_of_the_prediction(monkeypatch):
+    y = torch.zeros(1, 1, 24, 24, 24)
+    y[:, :, 8:16, 10:13, 4:20] = 1
+    y = MetaTensor(y, meta={"filename_or_obj": ["case_0"]})
+    skeletonized = []
+    skeleton_coords = metrics_module._skeleton_coords
+    monkeypatch.setattr(
+        metrics_module, "_skeleton_coords", lambda mask: skeletonized.append(mask.shape) or skeleton_coords(mask)
+    )
+
+    metric = ClDiceMetric()
+    for epoch in range(3):
+        # the prediction (and the bounding box of prediction and target) changes every epoch
+        y_pred = y.as_tensor().clone()
+        y_pred[:, :, 2 + epoch : 6 + epoch, 2:20, 10:12] = 1
+        metric.reset()
+        metric(y_pred=y_pred, y=y)
+        expected = ClDiceMetric._clDice_single(y_pred[0, 0].numpy().astype(bool), y[0, 0].numpy().astype(bool))
+        assert metric.aggregate().item() == pytest.approx(expected)
+
+    # the target once, the prediction every epoch
+    assert len(skeletonized) == 4
+
+
+def test_confusion_metric_matches_monai_and_counts():
+    torch.manual_seed(0)
+    y_pred = (torch.rand(3, 1, 8, 8, 8) > 0.5).float()
+    y = (torch.rand(3, 1, 8, 8, 8) > 0.5).float()
+
+    metric = ConfusionMetric()
+    case_scores = metric(y_pred=y_pred, y=y)
+    dice = DiceMetric(include_background=True, reduction="none")(y_pred, y)[:, 0]
+    assert torch.allclose(case_scores["dice"], dice.double())
+
+    tp = (y_pred * y).sum(dim=(1, 2, 3, 4)).double()
+    fp = (y_pred * (1 - y)).sum(dim=(1, 2, 3, 4)).double()
+    fn = ((1 - y_pred) * y).sum(dim=(1, 2, 3, 4)).double()
+    assert torch.allclose(case_scores["jaccard_index"], tp / (tp + fp + fn))
+    assert torch.allclose(case_scores["precision"], tp / (tp + fp))
+    assert torch.allclose(case_scores["recall"], tp / (tp + fn))
+    assert metric.aggregate()["dice"] == pytest.approx(dice.mean().item())
+
+    # the global reduction pools the counts of all cases
+    pooled = ConfusionMetric(reduction=ConfusionReduction.GLOBAL)
+    pooled(y_pred=y_pred[:2], y=y[:2])
+    pooled(y_pred=y_pred[2:], y=y[2:])
+    tp, fp, fn = int(tp.sum()), int(fp.sum()), int(fn.sum())
+    assert pooled.counts.tolist() == [tp, fp, fn, 3 * 8**3 - tp - fp - fn]
+    assert pooled.aggregate()["dice"] == pytest.approx(2 * tp / (2 * tp + fp + fn))
+
+
+def test_confusion_metric_empty_masks_and_manager():
+    metrics = get_metrics(metric_types=[MetricType.DICE, MetricType.JACCARD_INDEX])
+    empty = torch.zeros(1, 1, 4, 4, 4)
+    # logits of an empty prediction
+    metrics(empty - 10, empty)
+    assert metrics.aggregate() == {"dice": 1.0, "jaccard_index": 1.0}
+
+
+def test_async_metrics_match_sync():
+    torch.manual_seed(0)
+    batches = [
+        ((torch.rand(2, 1, 12, 12, 12) - 0.5) * 4, (torch.rand(2, 1, 12, 12, 12) > 0.6).float()) for _ in range(5)
+    ]
+    metric_types = [MetricType.DICE, MetricType.HAUSDORFF_DISTANCE, MetricType.CENTERLINE_LOSS]
+    sync_metrics = get_metrics(metric_types)
+    async_metrics = get_metrics(metric_types, cfg=MetricsConfig(async_update=True, max_pending=2))
+    for y_pred, y in batches:
+        sync_metrics(y_pred, y)
+        async_metrics(y_pred, y)
+
+    expected = sync_metrics.aggregate()
+    assert async_metrics.copy().aggregate() == pytest.approx(expected)
+    assert async_metrics.aggregate() == pytest.approx(expected)
+    async_metrics.reset()
+    async_metrics.close()
+
+
+def test_surface_distance_skips_empty_predictions():
+    y = torch.zeros(3, 1, 16, 16, 16)
+    y[:, :, 4:10, 4:10, 4:10] = 1
+    y_pred = y.clone()
+    y_pred[1] = 0  # empty prediction, infinite distances
+    y_pred[2, :, 4:12, 4:10, 4:10] = 1
+
+    metric = SurfaceDistanceMetric(use_spacing=False)
+    metric(y_pred=y_pred, y=y)
+    result = metric.aggregate()
+
+    assert result["surface_distance_empty"] == 1
+    # mean of the two finite cases
+    assert result["hausdorff_distance"] == pytest.approx(1.0)
+    assert all(value < float("inf") for value in result.values())
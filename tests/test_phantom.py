@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+
+from ml4mip.dataset import GraphDataset, NiftiDataset
+from ml4mip.phantom import PhantomConfig, generate_phantom, write_case
+
+
+def _config(tmp_path) -> PhantomConfig:
+    return PhantomConfig(
+        output_dir=str(tmp_path),
+        size=(64, 64, 48),
+        spacing=(1.0, 1.0, 1.0),
+        branches_per_tree=5,
+        branch_length=(5.0, 10.0),
+    )
+
+
+def test_phantom_is_deterministic_per_seed(tmp_path):
+    cfg = _config(tmp_path)
+    image_a, mask_a, graph_a = generate_phantom(cfg, np.random.default_rng([0, 1]))
+    image_b, mask_b, graph_b = generate_phantom(cfg, np.random.default_rng([0, 1]))
+    _, mask_c, _ = generate_phantom(cfg, np.random.default_rng([0, 2]))
+
+    assert np.array_equal(image_a, image_b)
+    assert np.array_equal(mask_a, mask_b)
+    assert not np.array_equal(mask_a, mask_c)
+    assert list(graph_a.edges) == list(graph_b.edges)
+    assert image_a.dtype == np.int16
+    assert mask_a.shape == (64, 64, 48)
+    assert mask_a.any()
+
+
+def test_written_cases_match_dataset_conventions(tmp_path):
+    cfg = _config(tmp_path)
+    for case in range(2):
+        write_case(case, cfg)
+
+    dataset = NiftiDataset(data_dir=tmp_path, split_ratio=1.0)
+    assert len(dataset) == 2
+    assert len(GraphDataset(tmp_path)) == 2
+
+    with (tmp_path / "0.graph.json").open() as f:
+        graph = json.load(f)
+    assert sum(node["is_root"] for node in graph["nodes"]) == 2
+    assert all(edge["length"] > 0 for edge in graph["edges"])
@@ -0,0 +1,19 @@
+import torch
+
+from ml4mip.utils.profiling import StepProfiler
+from ml4mip.utils.timing import PhaseTimer
+
+
+def test_step_profiler_writes_one_trace_per_window(tmp_path):
+    timer = PhaseTimer()
+    model = torch.nn.Linear(4, 1)
+    with StepProfiler(tmp_path, prefix="epoch_0_", wait=1, warmup=1, active=2, repeat=2) as prof:
+        for _ in range(10):
+            with timer.phase("forward"):
+                model(torch.rand(2, 4)).sum().backward()
+            prof.step()
+
+    traces = sorted(p.name for p in tmp_path.glob("*_trace.json"))
+    assert traces == ["epoch_0_window_0_trace.json", "epoch_0_window_1_trace.json"]
+    # the timer phases show up as ranges in the trace
+    assert '"forward"' in (tmp_path / traces[0]).read_text()
@@ -0,0 +1,35 @@
+import pytest
+import torch
+
+from ml4mip.models import ModelConfig, ModelType, get_model
+from ml4mip.quantization import quantize_model, save_quantized_model
+from ml4mip.trainer import InferenceConfig, InferenceMode, inference
+
+pytestmark = pytest.mark.skipif(
+    "x86" not in torch.backends.quantized.supported_engines, reason="x86 quantized engine not available"
+)
+
+
+@pytest.mark.parametrize("model_type", [ModelType.UNET, ModelType.UNETMONAI1])
+def test_quantized_model_matches_float_model(tmp_path, model_type):
+    torch.manual_seed(0)
+    model = get_model(ModelConfig(model_type=model_type)).cpu().eval()
+    batches = [torch.rand(2, 1, 32, 32, 32) for _ in range(4)]
+
+    quantized = quantize_model(model, batches)
+    save_quantized_model(quantized, tmp_path / "model.pt", batches[0])
+    loaded = get_model(ModelConfig(model_type=ModelType.QUANTIZED, base_model_jit_path=str(tmp_path / "model.pt")))
+    # the wrapper stays on the CPU
+    loaded.to("meta")
+
+    images = torch.rand(1, 1, 48, 40, 32)
+    cfg = InferenceConfig(mode=InferenceMode.SLIDING_WINDOW, sw_size=(32, 32, 32))
+    with torch.no_grad():
+        expected = inference(images, model, cfg)
+        outputs = inference(images, loaded, cfg)
+
+    assert outputs.shape == expected.shape
+    assert outputs.dtype == torch.float32
+    # the int8 outputs stay within a few quantization steps of the float outputs
+    scale = expected.abs().max()
+    assert (outputs - expected).abs().mean() < 0.05 * scale
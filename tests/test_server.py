@@ -0,0 +1,115 @@
+import json
+import queue
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import nibabel as nib
+import numpy as np
+import pytest
+import torch
+from monai.data import MetaTensor
+from torch import nn
+
+from ml4mip.dataset import get_inference_transform
+from ml4mip.pipeline import restore_mask
+from ml4mip.server import InferenceServer, make_server
+from ml4mip.trainer import InferenceConfig, InferenceMode
+
+
+@pytest.fixture
+def inference_server():
+    server = InferenceServer(
+        nn.Identity(),
+        InferenceConfig(mode=InferenceMode.STD),
+        device=torch.device("cpu"),
+        max_batch_size=4,
+        max_wait_ms=500,
+        # small volumes keep the test fast
+        transform=get_inference_transform(target_pixel_dim=(0.8, 0.8, 0.8), target_spatial_size=(16, 20, 20)),
+    )
+    yield server
+    server.close()
+
+
+def test_server_batches_concurrent_requests(tmp_path, inference_server):
+    affine = np.diag([0.5, 0.6, 1.2, 1.0])
+    rng = np.random.default_rng(0)
+    paths = []
+    for idx in range(4):
+        path = tmp_path / f"{idx}.img.nii.gz"
+        nib.save(nib.Nifti1Image(rng.random((30, 26, 14)).astype(np.float32), affine), path)
+        paths.append(path)
+
+    http = make_server(inference_server, port=0, input_dir=tmp_path, output_dir=tmp_path / "out")
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{http.server_address[1]}"
+
+    def post(path):
+        request = urllib.request.Request(
+            f"{url}/predict",
+            data=json.dumps({"path": str(path), "output": str(tmp_path / "out" / path.name)}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)["output"]
+
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            outputs = list(executor.map(post, paths))
+
+        # the raw file content is accepted as well and the mask is returned
+        request = urllib.request.Request(f"{url}/predict", data=paths[0].read_bytes())
+        with urllib.request.urlopen(request) as response:
+            (tmp_path / "response.nii.gz").write_bytes(response.read())
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            metrics = json.load(response)
+
+        # files outside of the configured directories are refused
+        request = urllib.request.Request(
+            f"{url}/predict",
+            data=json.dumps({"path": str(paths[0]), "output": "../escaped.nii.gz"}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request)
+        assert error.value.code == 403
+        assert not (tmp_path / "escaped.nii.gz").exists()
+    finally:
+        http.shutdown()
+        http.server_close()
+
+    # the outputs are passed on in half precision
+    expected = restore_mask(inference_server.transform(inference_server.loader(paths[0])).half())
+    for output in [outputs[0], tmp_path / "response.nii.gz"]:
+        mask = nib.load(output)
+        assert mask.shape == (30, 26, 14)
+        assert np.allclose(mask.affine, affine)
+        assert np.array_equal(mask.get_fdata(), expected[0].numpy())
+
+    assert metrics["requests"] == 5
+    assert metrics["batches"] < 5
+    assert metrics["queue_depth"] == 0
+    assert metrics["latency_ms_p95"] > 0
+
+
+def test_server_rejects_requests_after_close(inference_server):
+    image = inference_server.transform(MetaTensor(torch.rand(1, 8, 8, 8)))
+    inference_server.submit(image).result()
+    inference_server.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        inference_server.submit(image)
+
+
+def test_server_rejects_requests_beyond_max_queue(tmp_path):
+    server = InferenceServer(nn.Identity(), InferenceConfig(mode=InferenceMode.STD), max_queue=1)
+    try:
+        # a request in progress holds the only slot, the next one is rejected before loading the file
+        with server._admitted(), pytest.raises(queue.Full):
+            server.predict_file(tmp_path / "missing.nii.gz")
+        metrics = server.metrics()
+    finally:
+        server.close()
+    assert metrics["rejected"] == 1
+    assert metrics["errors"] == 0
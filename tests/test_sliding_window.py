@@ -0,0 +1,129 @@
+import pytest
+import torch
+from monai.data import MetaTensor
+from monai.inferers import sliding_window_inference
+from monai.losses import DiceCELoss, DiceLoss
+from torch import nn
+
+from ml4mip.sliding_window import BlendMode, SlidingWindow, StreamingLoss, streaming_validation_step
+from ml4mip.trainer import InferenceConfig, InferenceMode, inference, predict_mask
+from ml4mip.utils.metrics import MetricType, get_metrics
+
+
+@pytest.mark.parametrize("shape", [(2, 1, 40, 33, 21), (1, 1, 12, 40, 30)])
+@pytest.mark.parametrize("order", [(0, 1, 2), (2, 0, 1)])
+def test_matches_monai_sliding_window(shape, order):
+    torch.manual_seed(0)
+    model = nn.Conv3d(1, 2, kernel_size=3, padding=1).eval()
+    images = torch.randn(shape)
+    window = SlidingWindow((16, 16, 16), sw_batch_size=3, overlap=0.25, order=order)
+
+    with torch.no_grad():
+        expected = sliding_window_inference(images, (16, 16, 16), 3, model, overlap=0.25)
+        slabs = list(window.stream(images, model))
+        stats = {}
+        outputs = window(images, model, stats=stats)
+
+    # the slabs tile the slab axis in order
+    axis = order[0]
+    assert [position[axis].start for position, _ in slabs][0] == 0
+    assert slabs[-1][0][axis].stop == shape[2 + axis]
+    assert torch.allclose(torch.cat([slab for _, slab in slabs], dim=2 + axis), expected, atol=1e-6)
+    assert torch.allclose(outputs, expected, atol=1e-6)
+    assert stats["sw_skipped_windows"] == 0
+    assert stats["sw_windows_per_sec"] > 0
+
+
+def test_gaussian_blending_matches_monai():
+    torch.manual_seed(0)
+    model = nn.Conv3d(1, 1, kernel_size=3, padding=1).eval()
+    images = torch.randn(1, 1, 40, 36, 30)
+    window = SlidingWindow((16, 16, 16), overlap=0.5, blend=BlendMode.GAUSSIAN)
+
+    with torch.no_grad():
+        expected = sliding_window_inference(images, (16, 16, 16), 4, model, overlap=0.5, mode="gaussian")
+        outputs = window(images, model)
+    # the gaussians differ slightly in their discretization
+    assert torch.allclose(outputs, expected, atol=5e-2)
+
+
+def test_skips_windows_outside_the_region():
+    torch.manual_seed(0)
+    model = nn.Conv3d(1, 1, kernel_size=3, padding=1).eval()
+    images = torch.full((1, 1, 40, 36, 12), -1000.0)
+    images[..., :4, :4, :] = torch.randn(1, 1, 4, 4, 12)
+    window = SlidingWindow((16, 16, 16), skip_threshold=-500, skip_fill=-5.0)
+
+    with torch.no_grad():
+        expected = sliding_window_inference(images, (16, 16, 16), 4, model, overlap=0.25)
+        stats = {}
+        outputs = window(images, model, stats=stats)
+
+    # the body in the corner only needs the window containing it
+    assert stats["sw_skipped_windows"] == pytest.approx(1 - 1 / 9)
+    assert torch.allclose(outputs[..., :12, :12, :], expected[..., :12, :12, :], atol=1e-6)
+    assert torch.all(outputs[..., 16:, 16:, :] == -5)
+
+    with torch.no_grad():
+        stats = {}
+        cfg = InferenceConfig(mode=InferenceMode.CASCADE, sw_size=(16, 16, 16), model_input_size=(16, 16, 8))
+        outputs = inference(images, model, cfg, stats=stats)
+    assert outputs.shape == images.shape
+    assert 0 <= stats["sw_skipped_windows"] <= 1
+
+
+@pytest.mark.parametrize(
+    "loss_fn",
+    [
+        DiceLoss(include_background=True, sigmoid=True),
+        DiceCELoss(include_background=True, sigmoid=True, lambda_dice=1.0, lambda_ce=0.3),
+        DiceCELoss(include_background=True, sigmoid=True, lambda_ce=0.3, batch=True),
+    ],
+)
+def test_streaming_validation_step_matches_full_volume(loss_fn):
+    torch.manual_seed(0)
+    model = nn.Conv3d(1, 1, kernel_size=3, padding=1).eval()
+    images = torch.randn(2, 1, 36, 30, 24)
+    masks = (torch.rand(2, 1, 36, 30, 24) > 0.7).float()
+    metric_types = [MetricType.DICE, MetricType.RECALL, MetricType.HAUSDORFF_DISTANCE]
+    window = SlidingWindow((16, 16, 16))
+
+    with torch.no_grad():
+        outputs = sliding_window_inference(images, (16, 16, 16), 4, model, overlap=0.25)
+        expected_loss = loss_fn(outputs, masks)
+        expected_metrics = get_metrics(metric_types)
+        expected_metrics(outputs, masks)
+
+        metrics = get_metrics(metric_types)
+        loss, binary, _ = streaming_validation_step(
+            images, masks, model, StreamingLoss.from_loss(loss_fn), metrics, window=window
+        )
+
+    assert loss.item() == pytest.approx(expected_loss.item(), rel=1e-5)
+    assert torch.equal(binary, (torch.sigmoid(outputs) > 0.5).to(torch.uint8))
+    assert metrics.aggregate() == pytest.approx(expected_metrics.aggregate())
+
+    # without the binary prediction only the confusion metrics can be computed
+    with pytest.raises(ValueError, match="hausdorff_distance"), torch.no_grad():
+        streaming_validation_step(
+            images, masks, model, StreamingLoss.from_loss(loss_fn), metrics, window=window, keep_mask=False
+        )
+
+
+def test_low_memory_outputs(tmp_path):
+    torch.manual_seed(0)
+    model = nn.Conv3d(1, 1, kernel_size=3, padding=1).eval()
+    images = MetaTensor(torch.randn(1, 1, 40, 36, 30), meta={"filename_or_obj": "case"})
+
+    with torch.no_grad():
+        expected = SlidingWindow((16, 16, 16))(images, model)
+        half = SlidingWindow((16, 16, 16), accumulate_dtype=torch.float16)(images, model)
+        mapped = SlidingWindow((16, 16, 16), memmap_dir=tmp_path)(images, model)
+        cfg = InferenceConfig(sw_size=(16, 16, 16))
+        mask = predict_mask(images, model, cfg)
+
+    assert half.dtype == torch.float16
+    assert torch.allclose(half.float(), expected, atol=1e-2)
+    assert torch.equal(mapped, expected)
+    assert torch.equal(mask, (expected >= 0.5).to(torch.uint8))
+    assert mask.meta["filename_or_obj"] == expected.meta["filename_or_obj"] == "case"
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import torch
+from monai.metrics import compute_hausdorff_distance
+from scipy.spatial.distance import cdist
+from skimage.metrics import hausdorff_distance
+
+from ml4mip.utils.surface_distance import surface_distances, surface_points
+
+
+def _boxes():
+    pred = np.zeros((30, 30, 30), dtype=bool)
+    target = np.zeros((30, 30, 30), dtype=bool)
+    pred[5:15, 5:15, 5:15] = True
+    target[8:20, 6:16, 9:25] = True
+    return pred, target
+
+
+def test_matches_skimage_and_monai_hausdorff():
+    pred, target = _boxes()
+    result = surface_distances(pred, target)
+
+    assert result["hd"] == pytest.approx(hausdorff_distance(pred, target, method="standard"))
+    monai_hd = compute_hausdorff_distance(
+        torch.from_numpy(pred[None, None]), torch.from_numpy(target[None, None]), include_background=True
+    )
+    assert result["hd"] == pytest.approx(monai_hd.item())
+
+
+def test_percentile_and_average_with_spacing():
+    pred, target = _boxes()
+    spacing = (0.5, 1.0, 2.0)
+    result = surface_distances(pred, target, spacing=spacing)
+
+    distances = cdist(surface_points(pred) * spacing, surface_points(target) * spacing)
+    pred_to_target, target_to_pred = distances.min(axis=1), distances.min(axis=0)
+    assert result["hd"] == pytest.approx(max(pred_to_target.max(), target_to_pred.max()))
+    assert result["hd95"] == pytest.approx(
+        max(np.percentile(pred_to_target, 95), np.percentile(target_to_pred, 95))
+    )
+    assert result["asd"] == pytest.approx(np.concatenate([pred_to_target, target_to_pred]).mean())
+
+
+def test_empty_masks():
+    pred, _ = _boxes()
+    empty = np.zeros_like(pred)
+    assert surface_distances(empty, empty) == {"hd": 0.0, "hd95": 0.0, "asd": 0.0}
+    assert surface_distances(pred, empty)["hd"] == np.inf
@@ -0,0 +1,21 @@
+import time
+
+import pytest
+import torch
+
+from ml4mip.utils.timing import PhaseTimer
+
+
+def test_phase_timer_summary():
+    timer = PhaseTimer(percentiles=(50, 90))
+    for batch in timer.time_iter([torch.zeros(2, 1, 4, 4, 4)] * 3):
+        with timer.phase("forward"):
+            time.sleep(0.01)
+        timer.count(batch)
+
+    summary = timer.summary()
+    assert summary["forward_p50_ms"] >= 10
+    assert {"data_wait_p50_ms", "data_wait_p90_ms", "forward_p90_ms", "forward_share"} <= summary.keys()
+    assert 0 < summary["forward_share"] <= 1
+    assert summary["samples_per_sec"] == pytest.approx(6 / summary["epoch_time"], rel=0.05)
+    assert summary["voxels_per_sec"] == pytest.approx(6 * 64 / summary["epoch_time"], rel=0.05)